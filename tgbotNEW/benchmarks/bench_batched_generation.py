@@ -0,0 +1,85 @@
+# benchmarks/bench_batched_generation.py
+"""Пакетная генерация нескольких предметов одним запросом против параллельных запросов по предмету.
+
+Для профильного теста (2 предмета) и пробного ЕНТ (5 предметов) сравниваются число вызовов модели,
+токены промпта и ответа, время до готовности всех вопросов и выход парсера (доля вопросов, принятых
+с первого ответа модели). Модель имитируется локальным сервером: задержка складывается из постоянной
+части и времени на каждый токен ответа, а в текстовом формате часть блоков приходит без строки ответа.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_batched_generation --runs 5 --corrupt-rate 0.05
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.fake_openai import FakeOpenAIServer
+from config import LLM_LANE_WEIGHTS
+from utils import metrics, openai_utils
+from utils.llm_scheduler import LLMScheduler
+
+SCENARIOS = {
+    "профиль": {"Физика": 10, "Математика": 10},
+    "пробный ЕНТ": {"История Казахстана": 20, "Математическая грамотность": 10, "Грамотность чтения": 10,
+                    "Физика": 40, "Математика": 40},
+}
+
+
+def _total(counter) -> float:
+    return sum(child.value for child in counter._children.values())
+
+
+async def generate(client, mode: str, subjects: dict) -> dict:
+    if mode == "batched":
+        return await openai_utils._generate_batched(client, subjects)
+    results = await asyncio.gather(*(
+        openai_utils._generate_subject_questions(client, subject_name, count) for subject_name, count in subjects.items()
+    ))
+    return dict(zip(subjects, results))
+
+
+async def run(server: FakeOpenAIServer, mode: str, scenario: str, runs: int) -> None:
+    subjects = SCENARIOS[scenario]
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    server.requests = server.prompt_tokens = server.completion_tokens = 0
+    accepted_before = _total(metrics.PARSER_ACCEPTED)
+    rejected_before = _total(metrics.PARSER_REJECTED)
+    delivered = 0
+    elapsed = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await generate(client, mode, subjects)
+        elapsed.append(time.perf_counter() - started)
+        delivered += sum(len(questions) for questions, _ in result.values())
+    await client.close()
+    accepted = _total(metrics.PARSER_ACCEPTED) - accepted_before
+    rejected = _total(metrics.PARSER_REJECTED) - rejected_before
+    requested = sum(subjects.values()) * runs
+    print(f"{scenario:>12} {mode:>9} {server.requests / runs:>8.1f} {server.prompt_tokens / runs:>9.0f} "
+          f"{server.completion_tokens / runs:>9.0f} {sum(elapsed) / runs:>8.2f} "
+          f"{accepted / (accepted + rejected) if accepted + rejected else 0:>8.1%} {delivered / requested:>8.1%}")
+
+
+async def main(runs: int, latency: float, token_latency: float, corrupt_rate: float) -> None:
+    server = FakeOpenAIServer(latency=latency, token_latency=token_latency, corrupt_rate=corrupt_rate)
+    await server.start()
+    # Одинаковые запросы не объединяются, а планировщик не ограничивает: сравниваются только форматы запросов
+    openai_utils.GENERATION_COALESCING = False
+    openai_utils.LLM_CACHE_ENABLED = False
+    openai_utils._scheduler = LLMScheduler(max_concurrency=100, tokens_per_minute=10 ** 9, lane_weights=LLM_LANE_WEIGHTS)
+    try:
+        print(f"{'сценарий':>12} {'режим':>9} {'вызовов':>8} {'промпт':>9} {'ответ':>9} "
+              f"{'время,с':>8} {'выход':>8} {'выдано':>8}")
+        for scenario in SCENARIOS:
+            for mode in ("parallel", "batched"):
+                await run(server, mode, scenario, runs)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="постоянная часть задержки ответа модели, с")
+    parser.add_argument("--token-latency", type=float, default=0.0005, help="время на токен ответа, с")
+    parser.add_argument("--corrupt-rate", type=float, default=0.05, help="доля текстовых блоков без строки ответа")
+    args = parser.parse_args()
+    asyncio.run(main(args.runs, args.latency, args.token_latency, args.corrupt_rate))
@@ -0,0 +1,117 @@
+# benchmarks/bench_dispatch.py
+"""Накладные расходы маршрутизации одного апдейта: прежняя регистрация через lambda-фильтры
+против роутеров с CallbackData, фильтрами состояния и поиском текста кнопки в множестве.
+Основная разница - не в числе сравнений, а в том, что синхронные lambda-фильтры aiogram
+проверяет через asyncio.to_thread, а асинхронные Filter - прямо в event loop.
+
+Обработчики подменяются пустыми функциями, поэтому измеряется только путь апдейта через
+Dispatcher (FSM-контекст, фильтры, выбор обработчика). В прежней регистрации фильтр выбора
+предмета пробного ЕНТ вызывал несуществующий str.in_ и падал на любом нераспознанном тексте;
+здесь он заменен на оператор in, чтобы прежний вариант можно было измерить.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_dispatch --iterations 20000
+"""
+import argparse
+import asyncio
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from benchmarks.fake_telegram import FakeBotSession, make_callback_update, make_message_update
+import handlers
+from handlers import register_handlers
+from keyboards import PROFILE_SUBJECTS
+from states import TestState
+
+USER_ID = 1
+
+# (название, состояние FSM, апдейт)
+SCENARIOS = [
+    ("ответ в тесте", TestState.subject, make_message_update(1, USER_ID, "A")),
+    ("ответ в пробном ЕНТ", TestState.full_ent_process, make_message_update(1, USER_ID, "b")),
+    ("кнопка меню", None, make_message_update(1, USER_ID, "📊 Статистика")),
+    ("команда /start", None, make_message_update(1, USER_ID, "/start")),
+    ("profile1 в пробном ЕНТ", TestState.full_ent_profile_subject_1, make_callback_update(1, USER_ID, "profile1:Физика")),
+    ("profile2 в тесте", TestState.profile_subject_2, make_callback_update(1, USER_ID, "profile2:Химия")),
+    ("предмет пробного ЕНТ", TestState.full_ent_start_subject, make_message_update(1, USER_ID, "Грамотность чтения")),
+    ("неизвестный текст", None, make_message_update(1, USER_ID, "привет")),
+]
+
+
+def register_legacy_handlers(dp: Dispatcher) -> None:
+    """Регистрация в том виде, в каком она была до перехода на роутеры"""
+    dp.message.register(handlers.cmd_start, Command(commands=["start"]))
+    dp.message.register(handlers.cmd_help, Command(commands=["help"]))
+    dp.message.register(handlers.cmd_premium, Command(commands=["premium"]))
+    dp.message.register(handlers.handle_obligatory_subjects, lambda message: message.text == "📖 Обязательные предметы")
+    dp.callback_query.register(handlers.handle_select_obligatory, lambda callback: callback.data.startswith("obligatory:"))
+    dp.message.register(handlers.handle_profile_subjects, lambda message: message.text == "🧪 Профильные предметы")
+    dp.callback_query.register(handlers.handle_select_profile_1, lambda callback: callback.data.startswith("profile1:"))
+    dp.callback_query.register(handlers.handle_select_profile_2, lambda callback: callback.data.startswith("profile2:"))
+    dp.message.register(handlers.handle_answer, lambda message: message.text.upper() in ("A", "B", "C", "D"))
+    dp.message.register(handlers.handle_restart_test, lambda message: message.text == "🔄 Пройти ещё раз")
+    dp.message.register(handlers.handle_menu, lambda message: message.text == "☰ Меню")
+    dp.message.register(handlers.cmd_stats, lambda message: message.text == "📊 Статистика")
+    dp.message.register(handlers.handle_start_full_ent, lambda message: message.text == "🧪 Пробный ЕНТ")
+    dp.callback_query.register(handlers.handle_select_profile_1_full, lambda callback: callback.data.startswith("profile1:"))
+    dp.callback_query.register(handlers.handle_select_profile_2_full, lambda callback: callback.data.startswith("profile2:"))
+    dp.message.register(handlers.handle_full_ent_start_subject, lambda message: message.text in (
+        ["История Казахстана", "Математическая грамотность", "Грамотность чтения"] + PROFILE_SUBJECTS
+    ), StateFilter(TestState.full_ent_start_subject))
+
+
+def stub_handlers(dp: Dispatcher) -> dict:
+    """Подменяет обработчики пустыми функциями и возвращает счетчик вызовов по имени обработчика"""
+    calls = {}
+    for router in dp.chain_tail:
+        for event_name, observer in router.observers.items():
+            if event_name == "update":
+                continue  # Обработчик update у Dispatcher сам раздает апдейты по роутерам
+            for handler in observer.handlers:
+                name = handler.callback.__name__
+
+                async def stub(*args, _name=name, **kwargs):
+                    calls[_name] = calls.get(_name, 0) + 1
+
+                handler.callback = stub
+    return calls
+
+
+async def measure(register, iterations: int) -> dict:
+    bot = Bot("123:abc", session=FakeBotSession())
+    dp = Dispatcher(storage=MemoryStorage())
+    register(dp)
+    calls = stub_handlers(dp)
+    context = dp.fsm.get_context(bot, chat_id=USER_ID, user_id=USER_ID)
+    results = {}
+    for name, state, raw_update in SCENARIOS:
+        await context.set_state(state)
+        update = Update.model_validate(raw_update, context={"bot": bot})
+        calls.clear()
+        for _ in range(iterations // 10):
+            await dp.feed_update(bot, update)
+        calls.clear()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await dp.feed_update(bot, update)
+        elapsed = time.perf_counter() - started
+        results[name] = (elapsed / iterations * 1e6, next(iter(calls), "-"))
+    await bot.session.close()
+    return results
+
+
+async def main(iterations: int) -> None:
+    legacy = await measure(register_legacy_handlers, iterations)
+    routers = await measure(register_handlers, iterations)
+    print(f"{'апдейт':>24} {'было, мкс':>10} {'стало, мкс':>11}  обработчик было -> стало")
+    for name, _, _ in SCENARIOS:
+        (legacy_us, legacy_handler), (router_us, router_handler) = legacy[name], routers[name]
+        print(f"{name:>24} {legacy_us:>10.1f} {router_us:>11.1f}  {legacy_handler} -> {router_handler}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
@@ -0,0 +1,80 @@
+# benchmarks/bench_fsm_storage.py
+"""Задержка одного ответа (get_data + update_data) для MemoryStorage и SQLiteStorage.
+
+Сессия имитирует пробный ЕНТ: ~120 вопросов в данных FSM, каждый ответ читает и обновляет данные.
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_fsm_storage --sessions 200 --answers 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from utils.sqlite_storage import SQLiteStorage
+
+FULL_ENT_SIZES = {"history": 20, "math_literacy": 10, "reading_literacy": 10, "profile1": 40, "profile2": 40}
+QUESTION = "Вопрос: Когда была принята Конституция Республики Казахстан?\nA) 1993\nB) 1995\nC) 1991\nD) 1998"
+
+
+def full_ent_data() -> dict:
+    return {
+        "full_ent_questions": {key: [QUESTION] * size for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_correct_answers": {key: ["B"] * size for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_user_answers": {},
+        "full_ent_current_subject": "profile1",
+        "full_ent_current_question_index": 0,
+    }
+
+
+async def answer(storage, key: StorageKey, index: int) -> float:
+    """Повторяет работу handle_answer с хранилищем"""
+    started = time.perf_counter()
+    data = await storage.get_data(key)
+    user_answers = data.get("full_ent_user_answers", {})
+    user_answers.setdefault("profile1", {})[index] = "A"
+    await storage.update_data(key, {"full_ent_user_answers": user_answers,
+                                    "full_ent_current_question_index": index + 1})
+    return time.perf_counter() - started
+
+
+async def run(storage, sessions: int, answers: int) -> list:
+    keys = [StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id) for chat_id in range(sessions)]
+    for key in keys:
+        await storage.set_data(key, full_ent_data())
+    latencies = []
+    for index in range(answers):
+        for key in keys:
+            latencies.append(await answer(storage, key, index))
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1e6
+    print(f"{name:<28} p50 {p50:8.1f} мкс   p99 {p99:8.1f} мкс   ответов {len(latencies)}")
+
+
+async def main(sessions: int, answers: int) -> None:
+    report("MemoryStorage", await run(MemoryStorage(), sessions, answers))
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteStorage(os.path.join(directory, "fsm.sqlite3"))
+        report("SQLiteStorage (кэш)", await run(storage, sessions, answers))
+        await storage.close()
+
+        # Кэш меньше числа сессий: часть чтений идет с диска
+        storage = SQLiteStorage(os.path.join(directory, "fsm_cold.sqlite3"), cache_size=sessions // 4)
+        report("SQLiteStorage (кэш 25%)", await run(storage, sessions, answers))
+        started = time.perf_counter()
+        await storage.close()
+        print(f"Финальный сброс на диск: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--answers", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.answers))
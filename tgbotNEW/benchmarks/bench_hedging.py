@@ -0,0 +1,119 @@
+# benchmarks/bench_hedging.py
+"""Хвост задержек генерации: страховочные запросы, дедлайны и предохранитель.
+
+Модель имитируется сервером, у которого доля ответов (slow_rate) задерживается на slow_latency
+секунд. Пользователи волнами запрашивают по 5 вопросов потоковой генерацией; время до первого
+вопроса (p50/p90/p99) сравнивается без страховки и со страховкой, вместе с числом лишних
+запросов к модели. Затем сервер начинает отвечать только ошибками: измеряется, сколько запросов
+до него доходит и сколько ждет пользователь, прежде чем получить ответ, с предохранителем и без.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_hedging --requests 600 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from benchmarks.fake_openai import FakeOpenAIServer
+from config import LLM_LANE_WEIGHTS, LLM_HEDGE_BUDGET, LLM_HEDGE_BURST
+from utils import openai_utils
+from utils.hedging import HedgeBudget
+from utils.llm_scheduler import LLMScheduler
+
+SUBJECT = "История Казахстана"
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def reset(hedging: bool) -> None:
+    openai_utils.LLM_HEDGING = hedging
+    openai_utils._hedge_budget = HedgeBudget(LLM_HEDGE_BUDGET, LLM_HEDGE_BURST)
+    openai_utils._latencies = {}
+    openai_utils._breakers = {}
+
+
+async def first_question(client) -> float:
+    started = time.perf_counter()
+    async with aclosing(openai_utils._stream_subject_questions(client, SUBJECT, 5)) as questions:
+        async for _ in questions:
+            return time.perf_counter() - started
+    raise RuntimeError("нет вопросов")
+
+
+async def run_tail(server: FakeOpenAIServer, hedging: bool, requests: int, concurrency: int) -> None:
+    reset(hedging)
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    # Прогрев: страховка включается, когда накоплено достаточно замеров для квантиля
+    for _ in range(3):
+        await asyncio.gather(*(first_question(client) for _ in range(concurrency)))
+    server.requests = 0
+    durations = []
+    for offset in range(0, requests, concurrency):
+        durations.extend(await asyncio.gather(*(first_question(client) for _ in range(min(concurrency, requests - offset)))))
+    await client.close()
+    budget = openai_utils._hedge_budget.stats
+    print(f"{'да' if hedging else 'нет':>10} {percentile(durations, 0.5) * 1000:>8.0f} {percentile(durations, 0.9) * 1000:>8.0f} "
+          f"{percentile(durations, 0.99) * 1000:>8.0f} {max(durations) * 1000:>8.0f} {server.requests:>9} "
+          f"{server.requests / requests - 1:>+8.1%} {budget['denied']:>10}")
+
+
+async def run_outage(server: FakeOpenAIServer, breaker: bool, calls: int) -> None:
+    reset(hedging=False)
+    failures = openai_utils.LLM_BREAKER_FAILURES
+    if not breaker:
+        openai_utils.LLM_BREAKER_FAILURES = 10 ** 9
+    openai_utils.GENERATION_RETRY_DELAY = 0.05
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    server.requests = 0
+    waits = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        try:
+            await openai_utils._generate_subject_questions(client, SUBJECT, 5)
+        except Exception:
+            pass
+        waits.append(time.perf_counter() - started)
+    await client.close()
+    openai_utils.LLM_BREAKER_FAILURES = failures
+    print(f"{'да' if breaker else 'нет':>14} {server.requests:>10} {sum(waits) / calls * 1000:>12.0f} "
+          f"{waits[-1] * 1000:>14.1f}")
+
+
+async def main(requests: int, concurrency: int, latency: float, slow_rate: float, slow_latency: float,
+               outage_calls: int) -> None:
+    logging.disable(logging.WARNING)  # Предупреждения о каждой ошибке модели в сценарии недоступности не нужны
+    server = FakeOpenAIServer(latency=latency, slow_rate=slow_rate, slow_latency=slow_latency)
+    await server.start()
+    openai_utils.GENERATION_COALESCING = False
+    openai_utils.LLM_CACHE_ENABLED = False
+    openai_utils._scheduler = LLMScheduler(max_concurrency=1000, tokens_per_minute=10 ** 9, lane_weights=LLM_LANE_WEIGHTS)
+    try:
+        print(f"Время до первого вопроса, мс ({requests} генераций, {slow_rate:.0%} ответов медленнее на {slow_latency} c)")
+        print(f"{'страховка':>10} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'запросов':>9} {'лишних':>8} "
+              f"{'отказ бюдж.':>10}")
+        for hedging in (False, True):
+            await run_tail(server, hedging, requests, concurrency)
+
+        server.fail_rate = 1.0
+        print(f"\nМодель недоступна, {outage_calls} генераций подряд")
+        print(f"{'предохранитель':>14} {'запросов':>10} {'ожидание,мс':>12} {'последняя,мс':>14}")
+        for breaker in (False, True):
+            await run_outage(server, breaker, outage_calls)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="доля медленных ответов модели")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="на сколько секунд медленнее")
+    parser.add_argument("--outage-calls", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.latency, args.slow_rate, args.slow_latency,
+                     args.outage_calls))
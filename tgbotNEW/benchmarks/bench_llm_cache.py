@@ -0,0 +1,95 @@
+# benchmarks/bench_llm_cache.py
+"""Кэш ответов модели: сколько запросов и токенов он экономит и насколько быстрее генерация.
+
+Пользователи волнами по concurrency запрашивают тесты; предмет выбирается с перекосом к
+популярным (как в жизни), количество вопросов - 5 или 10. Сравнивается работа без кэша и с
+кэшем в пустом временном каталоге: вызовы модели, токены, время одной генерации, доля
+попаданий и сэкономленные байты. Каждую генерацию запрашивает новый пользователь (пополнение
+пула кэш не читает), просмотренные вопросы хранятся во временном каталоге. "Одинаковых наборов" - доля генераций, у которых тот же
+набор вопросов в том же порядке уже выдавался кому-то раньше.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_llm_cache --requests 600 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from benchmarks.fake_openai import FakeOpenAIServer
+from config import LLM_CACHE_VARIANTS, LLM_LANE_WEIGHTS
+from utils import llm_cache, openai_utils, seen_questions
+from utils.llm_scheduler import LLMScheduler
+from utils.single_flight import SingleFlight
+
+SUBJECTS = ["История Казахстана", "Математическая грамотность", "Грамотность чтения", "Математика", "Физика",
+            "Химия", "Биология", "География", "Всемирная история", "Английский язык"]
+
+
+async def run(server: FakeOpenAIServer, cache_enabled: bool, requests: list, concurrency: int, directory: str) -> None:
+    openai_utils.LLM_CACHE_ENABLED = cache_enabled
+    openai_utils._single_flight = SingleFlight()
+    if cache_enabled:
+        llm_cache._llm_cache = llm_cache.LLMCache(os.path.join(directory, "llm_cache.sqlite3"),
+                                                  variants=LLM_CACHE_VARIANTS)
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    server.requests = server.prompt_tokens = server.completion_tokens = 0
+    durations, seen_sets, repeated = [], set(), 0
+
+    async def generate(user_id: int, subject_name: str, count: int) -> None:
+        nonlocal repeated
+        # gather запускает каждую генерацию в своей задаче, поэтому контекст у каждой свой
+        openai_utils._set_request_context(None, user_id, False)
+        started = time.perf_counter()
+        questions, _ = await openai_utils._generate_subject_questions(client, subject_name, count)
+        durations.append(time.perf_counter() - started)
+        ordered = tuple(questions)
+        repeated += ordered in seen_sets
+        seen_sets.add(ordered)
+
+    started = time.perf_counter()
+    for offset in range(0, len(requests), concurrency):
+        await asyncio.gather(*(generate(offset + index, *request)
+                               for index, request in enumerate(requests[offset:offset + concurrency])))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    durations.sort()
+    line = (f"{'да' if cache_enabled else 'нет':>5} {server.requests:>8} "
+            f"{server.prompt_tokens + server.completion_tokens:>9} {statistics.mean(durations) * 1000:>9.0f} "
+            f"{durations[int(len(durations) * 0.95)] * 1000:>9.0f} {elapsed:>8.2f} {repeated / len(requests):>11.1%}")
+    if cache_enabled:
+        stats = llm_cache._llm_cache.get_stats()
+        line += (f"  попаданий {stats['hit_ratio']:.1%} (память {stats['memory_hits']}, диск {stats['disk_hits']}), "
+                 f"сэкономлено {stats['saved_bytes'] / 1024:.0f} КБ и {stats['saved_tokens']} токенов")
+        llm_cache._llm_cache.close()
+    print(line)
+
+
+async def main(requests: int, concurrency: int, latency: float, seed: int) -> None:
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(SUBJECTS))]
+    plan = [(rng.choices(SUBJECTS, weights)[0], rng.choice((5, 10))) for _ in range(requests)]
+    server = FakeOpenAIServer(latency=latency)
+    await server.start()
+    openai_utils._scheduler = LLMScheduler(max_concurrency=100, tokens_per_minute=10 ** 9, lane_weights=LLM_LANE_WEIGHTS)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            seen_questions._seen_questions = seen_questions.SeenQuestionsStore(os.path.join(directory, "seen.sqlite3"))
+            print(f"{'кэш':>5} {'вызовов':>8} {'токенов':>9} {'сред,мс':>9} {'p95,мс':>9} {'всего,с':>8} "
+                  f"{'одинаковых':>11}")
+            for cache_enabled in (False, True):
+                await run(server, cache_enabled, plan, concurrency, directory)
+            seen_questions._seen_questions.close()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.latency, args.seed))
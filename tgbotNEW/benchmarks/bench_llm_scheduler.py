@@ -0,0 +1,113 @@
+# benchmarks/bench_llm_scheduler.py
+"""Всплеск пробных ЕНТ и короткие тесты: кто сколько ждет начала запроса к модели.
+
+Сравниваются три стратегии: без ограничений (как было; "модель" отвечает 429 на запросы сверх
+своего лимита параллельности), общий FIFO-семафор и LLMScheduler с полосами premium/free и
+очередью по кругу между пользователями. Запрос к модели имитируется задержкой, пропорциональной
+числу вопросов.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_llm_scheduler --full-ent 20 --quick 100 --premium 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from utils.llm_scheduler import LLMScheduler
+
+FULL_ENT_CALLS = (20, 10, 10, 40, 40)
+QUICK_QUESTIONS = 5
+PROMPT_TOKENS = 150
+TOKENS_PER_QUESTION = 120
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class FakeModel:
+    """Модель с ограничением параллельности: лишние запросы получают 429"""
+
+    def __init__(self, limit: int, seconds_per_question: float):
+        self.limit = limit
+        self.seconds_per_question = seconds_per_question
+        self.active = 0
+        self.rejected = 0
+
+    async def call(self, num_questions: int) -> bool:
+        if self.active >= self.limit:
+            self.rejected += 1
+            return False
+        self.active += 1
+        try:
+            await asyncio.sleep(num_questions * self.seconds_per_question)
+            return True
+        finally:
+            self.active -= 1
+
+
+def make_requests(full_ent: int, quick: int, premium: int, seed: int) -> list:
+    """(задержка появления, пользователь, полоса, вопросов, вид запроса)"""
+    rng = random.Random(seed)
+    requests = []
+    for user in range(full_ent):
+        for num_questions in FULL_ENT_CALLS:
+            requests.append((0.0, f"ent{user}", "free", num_questions, "full_ent"))
+    for user in range(quick):
+        requests.append((rng.uniform(0, 0.05), f"free{user}", "free", QUICK_QUESTIONS, "quick"))
+    for user in range(premium):
+        requests.append((rng.uniform(0, 0.05), f"premium{user}", "premium", QUICK_QUESTIONS, "premium"))
+    return requests
+
+
+async def run(strategy: str, requests: list, limit: int, seconds_per_question: float) -> dict:
+    model = FakeModel(limit, seconds_per_question)
+    semaphore = asyncio.Semaphore(limit)
+    scheduler = LLMScheduler(limit, 10 ** 9, {"premium": 4, "free": 2, "background": 1})
+    waits = {"full_ent": [], "quick": [], "premium": []}
+    started = time.perf_counter()
+
+    async def one(delay: float, user: str, lane: str, num_questions: int, kind: str) -> None:
+        await asyncio.sleep(delay)
+        arrived = time.perf_counter()
+        if strategy == "без ограничений":
+            waits[kind].append(0.0)
+            await model.call(num_questions)
+        elif strategy == "FIFO-семафор":
+            async with semaphore:
+                waits[kind].append(time.perf_counter() - arrived)
+                await model.call(num_questions)
+        else:
+            async with scheduler.slot(user, lane, PROMPT_TOKENS + num_questions * TOKENS_PER_QUESTION):
+                waits[kind].append(time.perf_counter() - arrived)
+                await model.call(num_questions)
+
+    await asyncio.gather(*(one(*request) for request in requests))
+    return {"elapsed": time.perf_counter() - started, "rejected": model.rejected, "waits": waits}
+
+
+async def main(full_ent: int, quick: int, premium: int, limit: int, seconds_per_question: float, seed: int) -> None:
+    requests = make_requests(full_ent, quick, premium, seed)
+    print(f"{full_ent} пробных ЕНТ ({len(FULL_ENT_CALLS)} запросов), {quick} коротких тестов, {premium} Premium; "
+          f"лимит модели {limit} запросов")
+    print(f"{'стратегия':>16} {'429':>6} {'время,с':>8} {'короткие p50/p95,с':>20} {'Premium p50/p95,с':>19} "
+          f"{'ЕНТ p95,с':>10}")
+    for strategy in ("без ограничений", "FIFO-семафор", "планировщик"):
+        result = await run(strategy, requests, limit, seconds_per_question)
+        waits = result["waits"]
+        print(f"{strategy:>16} {result['rejected']:>6} {result['elapsed']:>8.2f} "
+              f"{percentile(waits['quick'], 0.5):>9.2f}/{percentile(waits['quick'], 0.95):<10.2f} "
+              f"{percentile(waits['premium'], 0.5):>8.2f}/{percentile(waits['premium'], 0.95):<10.2f} "
+              f"{percentile(waits['full_ent'], 0.95):>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full-ent", type=int, default=20)
+    parser.add_argument("--quick", type=int, default=100)
+    parser.add_argument("--premium", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seconds-per-question", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.full_ent, args.quick, args.premium, args.limit, args.seconds_per_question, args.seed))
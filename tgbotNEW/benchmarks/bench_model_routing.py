@@ -0,0 +1,152 @@
+# benchmarks/bench_model_routing.py
+"""Выбор модели для генерации: все запросы в gpt-4 против маршрутизации по размеру, полосе и статистике.
+
+Сервер имитирует три модели с разной задержкой и долей испорченных блоков (gpt-4o-mini быстрая,
+но чаще ошибается в формате). Пользователи волнами запрашивают вопросы: бесплатные по 5,
+premium по 10, фоновые пополнения по 40 (как раздел профильного предмета). Для каждого режима
+печатаются время генерации, стоимость по таблице цен ниже, доля вопросов, принятых парсером с
+первого запроса, число повторов на более сильной модели и распределение запросов по моделям.
+
+Затем у gpt-4o-mini растет задержка, а потом доля испорченных блоков: видно, как маршрутизатор
+уводит запросы с нее и возвращает их, когда модель снова в норме.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_model_routing --waves 20 --concurrency 20
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from benchmarks.fake_openai import FakeOpenAIServer
+from config import GENERATION_MIN_YIELD, GENERATION_MODELS, GENERATION_TIER_MODELS, LLM_LANE_WEIGHTS
+from utils import metrics, openai_utils
+from utils.llm_scheduler import LLMScheduler
+from utils.model_router import ModelRouter
+
+SUBJECT = "История Казахстана"
+# Цена за миллион токенов (промпт, ответ), долларов
+PRICES = {"gpt-4": (30.0, 60.0), "gpt-4o": (2.5, 10.0), "gpt-4o-mini": (0.15, 0.6)}
+PROFILES = {
+    "gpt-4": {"latency": 0.5, "token_latency": 0.002, "corrupt_rate": 0.02},
+    "gpt-4o": {"latency": 0.2, "token_latency": 0.0008, "corrupt_rate": 0.02},
+    "gpt-4o-mini": {"latency": 0.1, "token_latency": 0.0004, "corrupt_rate": 0.08},
+}
+# Имитация отвечает в несколько раз быстрее настоящих моделей, поэтому и цели по задержке меньше, чем в config.py
+LATENCY_TARGETS = {"free": 0.15, "premium": 0.1, "background": 1.0}
+# (полоса, вопросов, доля запросов); колонки "парсер" - доля блоков ответа, принятых парсером,
+# "выдано" - доля запрошенных вопросов, которые пользователь получил после догенерации
+WORKLOAD = [("free", 5, 0.6), ("premium", 10, 0.3), ("background", 40, 0.1)]
+
+
+def escalations() -> int:
+    return int(sum(child.value for child in metrics.LLM_ESCALATIONS._children.values()))
+
+
+def cost(server: FakeOpenAIServer) -> float:
+    return sum(prompt * PRICES[model][0] / 10 ** 6 + completion * PRICES[model][1] / 10 ** 6
+               for model, (prompt, completion) in server.model_tokens.items())
+
+
+async def generate(client, lane: str, num_questions: int, user_id: int, results: list) -> None:
+    # Контекст запроса задает полосу, как это делает обработчик; уведомление об очереди не отправляется
+    openai_utils._request_context.set({"bot": None, "user_id": user_id, "lane": lane, "notified": True})
+    started = time.perf_counter()
+    questions, _ = await openai_utils._generate_subject_questions(client, SUBJECT, num_questions)
+    results.append((lane, time.perf_counter() - started, len(questions), num_questions))
+
+
+async def run_waves(client, plan: list, concurrency: int) -> list:
+    results = []
+    for offset in range(0, len(plan), concurrency):
+        await asyncio.gather(*(generate(client, lane, count, offset + index, results)
+                               for index, (lane, count) in enumerate(plan[offset:offset + concurrency])))
+    return results
+
+
+def reset(server: FakeOpenAIServer, routing: bool) -> None:
+    openai_utils.GENERATION_ROUTING = routing
+    openai_utils.GENERATION_MODEL = "gpt-4"
+    openai_utils._router = ModelRouter(GENERATION_TIER_MODELS, GENERATION_MODELS, LATENCY_TARGETS,
+                                       min_yield=GENERATION_MIN_YIELD, explore=0.05, rng=random.Random(0))
+    openai_utils._breakers = {}
+    openai_utils._latencies = {}
+    server.requests = server.prompt_tokens = server.completion_tokens = 0
+    server.model_requests, server.model_tokens = {}, {}
+
+
+def share(server: FakeOpenAIServer) -> str:
+    total = max(sum(server.model_requests.values()), 1)
+    return ", ".join(f"{model} {count / total:.0%}" for model, count in sorted(server.model_requests.items()))
+
+
+async def run_mode(server: FakeOpenAIServer, routing: bool, plan: list, concurrency: int) -> None:
+    reset(server, routing)
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    accepted_before = sum(child.value for child in metrics.PARSER_ACCEPTED._children.values())
+    rejected_before = sum(child.value for child in metrics.PARSER_REJECTED._children.values())
+    escalated_before = escalations()
+    started = time.perf_counter()
+    results = await run_waves(client, plan, concurrency)
+    elapsed = time.perf_counter() - started
+    await client.close()
+    accepted = sum(child.value for child in metrics.PARSER_ACCEPTED._children.values()) - accepted_before
+    rejected = sum(child.value for child in metrics.PARSER_REJECTED._children.values()) - rejected_before
+    by_lane = {lane: sorted(duration for result_lane, duration, _, _ in results if result_lane == lane)
+               for lane, _, _ in WORKLOAD}
+    delivered = sum(received for _, _, received, _ in results) / sum(requested for _, _, _, requested in results)
+    print(f"{'маршрутизация' if routing else 'всё в gpt-4':>14} "
+          + " ".join(f"{statistics.mean(by_lane[lane]) * 1000:>8.0f}" for lane, _, _ in WORKLOAD)
+          + f" {elapsed:>8.1f} {cost(server):>8.3f} {accepted / max(accepted + rejected, 1):>8.1%} {delivered:>8.1%} "
+            f"{server.requests:>8} {escalations() - escalated_before:>7}  {share(server)}")
+
+
+async def run_phases(server: FakeOpenAIServer, plan: list, concurrency: int) -> None:
+    """Маршрутизация при ухудшении gpt-4o-mini: сначала задержка, потом формат ответа, потом норма"""
+    reset(server, routing=True)
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    normal = dict(PROFILES["gpt-4o-mini"])
+    phases = [("норма", normal), ("задержка x10", dict(normal, latency=1.0, token_latency=0.004)),
+              ("30% брака", dict(normal, corrupt_rate=0.3)), ("снова норма", normal)]
+    print(f"\n{'фаза':>14} {'сред,мс':>8} {'escal.':>7}  запросы по моделям")
+    for name, profile in phases:
+        server.models["gpt-4o-mini"] = profile
+        server.model_requests = {}
+        escalated_before = escalations()
+        results = await run_waves(client, plan, concurrency)
+        print(f"{name:>14} {statistics.mean(duration for _, duration, _, _ in results) * 1000:>8.0f} "
+              f"{escalations() - escalated_before:>7}  {share(server)}")
+    await client.close()
+    server.models["gpt-4o-mini"] = normal
+
+
+async def main(waves: int, concurrency: int, seed: int) -> None:
+    logging.disable(logging.WARNING)
+    rng = random.Random(seed)
+    plan = [(lane, count) for lane, count, _ in
+            rng.choices(WORKLOAD, [weight for _, _, weight in WORKLOAD], k=waves * concurrency)]
+    server = FakeOpenAIServer(models={model: dict(profile) for model, profile in PROFILES.items()}, seed=seed)
+    await server.start()
+    openai_utils.GENERATION_COALESCING = False
+    openai_utils.LLM_CACHE_ENABLED = False
+    openai_utils.SEEN_QUESTIONS_ENABLED = False
+    openai_utils.LLM_HEDGING = False
+    openai_utils._scheduler = LLMScheduler(max_concurrency=1000, tokens_per_minute=10 ** 9, lane_weights=LLM_LANE_WEIGHTS)
+    try:
+        print(f"{len(plan)} генераций; среднее время генерации по полосам, мс")
+        print(f"{'режим':>14} " + " ".join(f"{lane[:8]:>8}" for lane, _, _ in WORKLOAD)
+              + f" {'всего,с':>8} {'цена,$':>8} {'парсер':>8} {'выдано':>8} {'запросов':>8} {'escal.':>7}  по моделям")
+        for routing in (False, True):
+            await run_mode(server, routing, plan, concurrency)
+        await run_phases(server, plan, concurrency)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--waves", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.waves, args.concurrency, args.seed))
@@ -0,0 +1,55 @@
+# benchmarks/bench_openai_client.py
+"""Сравнение пропускной способности: синхронный OpenAI через asyncio.to_thread и AsyncOpenAI с общим пулом.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_openai_client --requests 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import time
+from openai import OpenAI
+from benchmarks.fake_openai import FakeOpenAIServer
+from utils.openai_utils import create_openai_client
+
+
+async def run_thread_pool(base_url: str, total: int) -> float:
+    client = OpenAI(api_key="test", base_url=base_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        asyncio.to_thread(client.chat.completions.create, model="gpt-4",
+                          messages=[{"role": "user", "content": "test"}])
+        for _ in range(total)
+    ))
+    elapsed = time.perf_counter() - started
+    client.close()
+    return elapsed
+
+
+async def run_native_async(base_url: str, total: int) -> float:
+    client = create_openai_client(api_key="test", base_url=base_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": "test"}])
+        for _ in range(total)
+    ))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    return elapsed
+
+
+async def main(total: int, latency: float) -> None:
+    server = FakeOpenAIServer(latency=latency)
+    await server.start()
+    try:
+        for name, runner in (("to_thread + OpenAI", run_thread_pool), ("AsyncOpenAI (пул)", run_native_async)):
+            elapsed = await runner(server.base_url, total)
+            print(f"{name:<20} {total} запросов за {elapsed:.2f} c ({total / elapsed:.1f} запр/с)")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.latency))
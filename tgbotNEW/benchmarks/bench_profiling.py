@@ -0,0 +1,90 @@
+# benchmarks/bench_profiling.py
+"""Цена профилирования по команде /profile: пропускная способность Dispatcher без профилирования,
+после завершенного профилирования (middleware снята, ничего не осталось) и во время cpu/mem.
+
+Обновления (команды и кнопки меню без вызовов модели) проходят через настоящие обработчики,
+Bot API - FakeBotSession. Профилирование включается командой администратора, как в боте;
+результаты сохраняются во временный каталог и проверяются.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_profiling --updates 3000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from benchmarks.fake_telegram import FakeBotSession, make_message_update
+from config import ADMIN_IDS
+from handlers import register_handlers
+from utils.profiling import get_profiler
+from utils.statistics import get_statistics_store
+
+ADMIN_ID = 999
+TEXTS = ["/start", "/help", "/premium", "привет", "☰ Меню"]
+
+
+def build() -> tuple:
+    ADMIN_IDS.append(ADMIN_ID)
+    dp = Dispatcher(storage=MemoryStorage())
+    register_handlers(dp)
+    session = FakeBotSession()
+    return dp, Bot(token="123456:TEST", session=session), session
+
+
+async def feed(dp: Dispatcher, bot: Bot, count: int, first_id: int) -> float:
+    """Прогоняет count обновлений от разных пользователей и возвращает обновлений в секунду"""
+    updates = [Update.model_validate(make_message_update(first_id + i, 1000 + i % 500, TEXTS[i % len(TEXTS)]),
+                                     context={"bot": bot}) for i in range(count)]
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return count / (time.perf_counter() - started)
+
+
+async def command(dp: Dispatcher, bot: Bot, text: str) -> None:
+    await dp.feed_update(bot, Update.model_validate(make_message_update(1, ADMIN_ID, text), context={"bot": bot}))
+
+
+async def run(count: int, rounds: int) -> None:
+    dp, bot, session = build()
+    profiler = get_profiler()
+    profiler.directory = tempfile.mkdtemp(prefix="profiles-")
+    await feed(dp, bot, count, 1)  # прогрев
+    results = {"выключено": [], "после сессии": [], "cpu": [], "mem": []}
+    for _ in range(rounds):
+        results["выключено"].append(await feed(dp, bot, count, 1))
+        for kind in ("cpu", "mem"):
+            # Сессия на count + 1 обновление: все обновления замера идут под профилированием,
+            # последнее (команда stop) завершает ее
+            await command(dp, bot, f"/profile {kind} {count + 1}")
+            results[kind].append(await feed(dp, bot, count, 1))
+            await command(dp, bot, "/profile stop")
+            assert not profiler.active
+        results["после сессии"].append(await feed(dp, bot, count, 1))
+    baseline = sorted(results["выключено"])[rounds // 2]
+    print(f"{'режим':<14}{'обновлений/с':>14}{'к выключенному':>16}")
+    for name, values in results.items():
+        median = sorted(values)[rounds // 2]
+        print(f"{name:<14}{median:>14.0f}{median / baseline:>15.2f}x")
+    middlewares = len(dp.update.outer_middleware)
+    files = sorted(os.listdir(profiler.directory))
+    print(f"\nВнешних middleware обновлений после профилирования: {middlewares}; "
+          f"отправлено файлов: {session.calls.get('SendDocument', 0)}")
+    for name in files[-3:]:
+        path = os.path.join(profiler.directory, name)
+        with open(path, encoding="utf-8") as f:
+            head = f.read().splitlines()[:6]
+        print(f"\n{name} ({os.path.getsize(path)} байт):")
+        print("\n".join(f"  {line[:150]}" for line in head))
+    await get_statistics_store().close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.rounds))
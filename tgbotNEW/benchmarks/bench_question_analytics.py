@@ -0,0 +1,113 @@
+# benchmarks/bench_question_analytics.py
+"""Аналитика вопросов на миллионах ответов.
+
+Генерирует синтетический журнал ответов: у учеников есть уровень подготовки, у вопросов -
+сложность и различающая способность, вероятность правильного ответа считается по модели
+с угадыванием (3PL). У доли вопросов ключ в журнале неверный - их аналитика должна отсеять.
+Измеряется чтение журнала (np.fromfile), расчет compute_question_analytics и, для сравнения,
+тот же расчет сложности и долей вариантов циклом Python по части ответов.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_question_analytics --answers 5000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from config import ANALYTICS_MIN_ANSWERS, ANALYTICS_MIN_DISCRIMINATION, ANALYTICS_MIN_DIFFICULTY
+from utils.question_analytics import ANSWER_DTYPE, NO_ANSWER_CODE, compute_question_analytics
+
+
+def make_records(answers: int, questions: int, subjects: int, bad_share: float, seed: int):
+    rng = np.random.default_rng(seed)
+    question_subject = rng.integers(0, subjects, questions)
+    difficulty = rng.normal(0, 1, questions)
+    slope = rng.uniform(0.5, 2.0, questions)
+    true_key = rng.integers(0, 4, questions)
+    bad = rng.random(questions) < bad_share
+    recorded_key = np.where(bad, (true_key + 1) % 4, true_key)
+    by_subject = [np.flatnonzero(question_subject == code) for code in range(subjects)]
+
+    # Разделы по 10-40 вопросов: один ученик, один предмет
+    sizes = rng.integers(10, 41, answers // 10 + 1)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), answers) + 1]
+    section_subject = rng.integers(0, subjects, len(sizes))
+    ability = rng.normal(0, 1, len(sizes))
+    section = np.repeat(np.arange(len(sizes), dtype=np.uint64), sizes)[:answers]
+    subject = np.repeat(section_subject, sizes)[:answers]
+    question = np.empty(answers, dtype=np.int64)
+    for code in range(subjects):
+        mask = subject == code
+        question[mask] = rng.choice(by_subject[code], mask.sum())
+
+    p_correct = 0.25 + 0.75 / (1 + np.exp(-slope[question] * (np.repeat(ability, sizes)[:answers] - difficulty[question])))
+    is_correct = rng.random(answers) < p_correct
+    wrong = (true_key[question] + rng.integers(1, 4, answers)) % 4
+    chosen = np.where(is_correct, true_key[question], wrong)
+    chosen = np.where(rng.random(answers) < 0.03, NO_ANSWER_CODE, chosen)
+
+    records = np.empty(answers, dtype=ANSWER_DTYPE)
+    records["question"] = question.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)  # как у 64-битных хешей
+    records["section"] = section
+    records["subject"] = subject
+    records["chosen"] = chosen
+    records["correct"] = recorded_key[question]
+    bad_ids = {f"{qid:016x}" for qid in (np.flatnonzero(bad).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)).tolist()}
+    return records, bad_ids
+
+
+def python_loop(records: np.ndarray) -> dict:
+    """Сложность и доли вариантов по одному ответу за раз, как считал бы обычный код"""
+    stats = {}
+    for question, chosen, correct in zip(records["question"].tolist(), records["chosen"].tolist(),
+                                         records["correct"].tolist()):
+        item = stats.get(question)
+        if item is None:
+            item = stats[question] = [0, 0, [0] * 5]
+        item[0] += 1
+        item[1] += chosen == correct
+        item[2][chosen] += 1
+    return stats
+
+
+def main(answers: int, questions: int, subjects: int, bad_share: float, loop_sample: int, seed: int) -> None:
+    started = time.perf_counter()
+    records, bad_ids = make_records(answers, questions, subjects, bad_share, seed)
+    print(f"Сгенерировано {len(records)} ответов за {time.perf_counter() - started:.2f} c "
+          f"({records.nbytes / 2 ** 20:.1f} МБ)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "answers.bin")
+        records.tofile(path)
+        started = time.perf_counter()
+        loaded = np.fromfile(path, dtype=ANSWER_DTYPE)
+        print(f"Чтение журнала: {time.perf_counter() - started:.3f} c")
+
+    analytics = compute_question_analytics(loaded, [f"Предмет {code}" for code in range(subjects)])
+    print(f"Расчет по {analytics.records} ответам и {len(analytics.question_ids)} вопросам: {analytics.elapsed:.2f} c")
+
+    sample = loaded[:loop_sample]
+    started = time.perf_counter()
+    python_loop(sample)
+    loop_elapsed = time.perf_counter() - started
+    print(f"Цикл Python (только сложность и доли вариантов) по {len(sample)} ответам: {loop_elapsed:.2f} c, "
+          f"на все ответы ~{loop_elapsed * len(loaded) / max(len(sample), 1):.1f} c")
+
+    flagged = analytics.flagged(ANALYTICS_MIN_ANSWERS, ANALYTICS_MIN_DISCRIMINATION, ANALYTICS_MIN_DIFFICULTY)
+    true_positive = len(flagged & bad_ids)
+    print(f"Отсеяно вопросов: {len(flagged)}, из них с неверным ключом {true_positive} из {len(bad_ids)} "
+          f"(точность {true_positive / max(len(flagged), 1):.1%}, полнота {true_positive / max(len(bad_ids), 1):.1%})")
+    name, distribution = next(iter(analytics.subject_distributions.items()))
+    print(f"{name}: {distribution}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--answers", type=int, default=5_000_000)
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--subjects", type=int, default=12)
+    parser.add_argument("--bad-share", type=float, default=0.02, help="доля вопросов с неверным ключом")
+    parser.add_argument("--loop-sample", type=int, default=500_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.answers, args.questions, args.subjects, args.bad_share, args.loop_sample, args.seed)
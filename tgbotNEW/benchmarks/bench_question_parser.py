@@ -0,0 +1,66 @@
+# benchmarks/bench_question_parser.py
+"""Сравнение старого разбора через split("\n\n") и инкрементального QuestionParser на больших ответах.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_question_parser
+"""
+import random
+import time
+from utils.question_parser import QuestionParser, parse_questions
+
+
+def legacy_parse(generated_text: str) -> list:
+    """Прежний разбор из generate_questions / generate_full_ent_questions"""
+    question_blocks = [block.strip() for block in generated_text.split("\n\n") if block.strip()]
+    result = []
+    for block in question_blocks:
+        lines = [line.strip() for line in block.split("\n") if line.strip()]
+        if len(lines) < 6:
+            continue
+        correct_answer = lines[-1].split(":")[-1].strip().upper()
+        if correct_answer in ("A", "B", "C", "D"):
+            result.append(("\n".join(lines[:-1]), correct_answer))
+    return result
+
+
+def make_output(num_questions: int, blank_line_rate: float = 0.1, seed: int = 0) -> str:
+    """Синтетический ответ модели; часть вопросов содержит пустую строку внутри блока"""
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(num_questions):
+        stem = f"Вопрос {i + 1}: В каком году произошло событие номер {i} из истории Казахстана?"
+        if rng.random() < blank_line_rate:
+            stem += "\n"
+        options = "\n".join(f"{key}) {rng.randint(1200, 2020)} год" for key in "ABCD")
+        blocks.append(f"{stem}\n{options}\nПравильный ответ: {rng.choice('ABCD')}")
+    return "\n\n".join(blocks)
+
+
+def stream_parse(text: str, chunk_size: int = 8) -> list:
+    parser = QuestionParser()
+    questions = []
+    for i in range(0, len(text), chunk_size):
+        questions.extend(parser.feed(text[i:i + chunk_size]))
+    questions.extend(parser.close())
+    return questions
+
+
+def bench(func, text: str, repeat: int = 50) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main() -> None:
+    print(f"{'вопросов':>8} {'split, мс':>10} {'выход':>6} {'parser, мс':>11} {'выход':>6} {'поток, мс':>10}")
+    for num_questions in (40, 80, 120):
+        text = make_output(num_questions)
+        legacy_yield = len(legacy_parse(text))
+        parser_yield = len(parse_questions(text)[0])
+        print(f"{num_questions:>8} {bench(legacy_parse, text):>10.3f} {legacy_yield:>6} "
+              f"{bench(lambda t: parse_questions(t), text):>11.3f} {parser_yield:>6} "
+              f"{bench(stream_parse, text):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_seen_questions.py
+"""Фильтр уже виденных вопросов: память на пользователя, время проверки, доля узнанных
+перефразировок и ложных срабатываний.
+
+Вопросы собираются из случайных слов. Пользователь "видит" history вопросов, затем проверяются:
+те же вопросы в другом оформлении (другой номер, регистр, пунктуация, порядок вариантов),
+перефразировки (заменено или добавлено одно слово) и совсем новые вопросы - для новых
+любое срабатывание ложное. Если history больше 2 * SEEN_FILTER_CAPACITY, самые старые
+вопросы уже забыты, и доля узнанных падает - так и задумано.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_seen_questions --users 200 --history 400
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from config import SEEN_FILTER_BITS, SEEN_FILTER_CAPACITY
+from utils.seen_questions import SeenQuestionsStore, fingerprint
+
+VOCABULARY = [f"слово{index}" for index in range(5000)]
+
+
+def make_question(rng: random.Random, stem_words: list, number: int) -> str:
+    options = [f"{letter}) вариант {rng.randint(1, 1000)}" for letter in "ABCD"]
+    return f"Вопрос {number}: {' '.join(stem_words)}?\n" + "\n".join(options)
+
+
+def reformat(rng: random.Random, stem_words: list) -> str:
+    stem = " ".join(stem_words).upper() + " ?!"
+    return make_question(rng, stem.split(), rng.randint(1, 40))
+
+
+def paraphrase(rng: random.Random, stem_words: list) -> str:
+    words = list(stem_words)
+    if rng.random() < 0.5:
+        words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+    else:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(VOCABULARY))
+    return make_question(rng, words, rng.randint(1, 40))
+
+
+def main(users: int, history: int, checks: int, seed: int) -> None:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        store = SeenQuestionsStore(os.path.join(directory, "seen.sqlite3"), SEEN_FILTER_BITS, SEEN_FILTER_CAPACITY,
+                                   cache_users=users)
+        stems = {}
+        started = time.perf_counter()
+        for user_id in range(users):
+            stems[user_id] = [[rng.choice(VOCABULARY) for _ in range(rng.randint(6, 16))] for _ in range(history)]
+            for offset in range(0, history, 10):
+                store.mark_seen(user_id, [make_question(rng, words, 1) for words in stems[user_id][offset:offset + 10]])
+        mark_elapsed = time.perf_counter() - started
+        print(f"Отмечено {users * history} вопросов ({users} пользователей по {history}) за {mark_elapsed:.2f} c, "
+              f"{mark_elapsed / (users * history) * 1e6:.1f} мкс на вопрос с записью в SQLite")
+        print(f"Память на пользователя: не больше {2 * SEEN_FILTER_BITS // 8} байт (два фильтра по "
+              f"{SEEN_FILTER_BITS} бит), размер базы {os.path.getsize(os.path.join(directory, 'seen.sqlite3'))} байт")
+
+        cases = {"то же, другое оформление": reformat, "перефразировка (±1 слово)": paraphrase, "новый вопрос": None}
+        for name, transform in cases.items():
+            questions = []
+            for _ in range(checks):
+                user_id = rng.randrange(users)
+                if transform is None:
+                    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(6, 16))]
+                    questions.append((user_id, make_question(rng, words, 1)))
+                else:
+                    questions.append((user_id, transform(rng, rng.choice(stems[user_id]))))
+            fingerprint.cache_clear()
+            started = time.perf_counter()
+            hits = sum(store.is_seen(user_id, question) for user_id, question in questions)
+            elapsed = time.perf_counter() - started
+            print(f"{name:>28}: узнано {hits / checks:.1%}, {elapsed / checks * 1e6:.1f} мкс на проверку")
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=400, help="сколько вопросов видел каждый пользователь")
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.users, args.history, args.checks, args.seed)
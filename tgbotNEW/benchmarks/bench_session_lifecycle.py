@@ -0,0 +1,88 @@
+# benchmarks/bench_session_lifecycle.py
+"""Память брошенных сессий: MemoryStorage против SessionStorage и SQLiteStorage с бюджетом памяти
+и вытеснением простаивающих сессий.
+
+Пользователи начинают пробный ЕНТ и бросают его. Сессии - худший случай, с полными текстами
+вопросов, как до QuestionStore. Для каждого хранилища печатается реальный прирост памяти
+(tracemalloc), учтенный хранилищем размер и число вытесненных сессий. Затем, после простоя дольше
+idle_timeout, печатается то же самое, и проверяется, что сессии, вытесненные SQLiteStorage,
+читаются с диска без потерь.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_session_lifecycle --sessions 2000 --budget-mb 16
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from benchmarks.bench_session_state import legacy_session
+from utils.session_storage import SessionStorage
+from utils.sqlite_storage import SQLiteStorage
+
+IDLE_TIMEOUT = 1.0
+
+
+def traced_mb(start: int) -> float:
+    gc.collect()
+    return (tracemalloc.get_traced_memory()[0] - start) / 2 ** 20
+
+
+def describe(storage) -> str:
+    if not hasattr(storage, "get_stats"):
+        return f"{len(storage.storage):>8} {'-':>10} {'-':>10} {'-':>10}"
+    stats = storage.get_stats()
+    return (f"{stats['sessions']:>8} {stats['memory_bytes'] / 2 ** 20:>10.1f} "
+            f"{stats['evicted_budget']:>10} {stats['evicted_idle']:>10}")
+
+
+async def run(name: str, storage, sessions: int) -> None:
+    keys = [StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id) for chat_id in range(sessions)]
+    gc.collect()
+    start = tracemalloc.get_traced_memory()[0]
+    for key in keys:
+        await storage.set_state(key, "TestState:full_ent_process")
+        await storage.set_data(key, legacy_session())
+        if hasattr(storage, "flush") and key.chat_id % 100 == 99:
+            await storage.flush()  # Как фоновый сброс раз в flush_interval
+    if hasattr(storage, "flush"):
+        await storage.flush()
+    print(f"{name:<28}{'брошены':<10}{traced_mb(start):>10.1f} {describe(storage)}")
+
+    await asyncio.sleep(IDLE_TIMEOUT)
+    if hasattr(storage, "flush"):
+        await storage.flush()
+    print(f"{name:<28}{'простой':<10}{traced_mb(start):>10.1f} {describe(storage)}")
+
+    if isinstance(storage, SQLiteStorage):
+        restored = await storage.get_data(keys[0])
+        assert restored == legacy_session() and await storage.get_state(keys[0]) == "TestState:full_ent_process"
+        print(f"{'':<28}сессия прочитана с диска: {storage.get_stats()['loaded']} загрузок, данные совпадают")
+    await storage.close()
+
+
+async def main(sessions: int, budget_mb: float) -> None:
+    budget = int(budget_mb * 2 ** 20)
+    print(f"Сессий: {sessions}, бюджет {budget_mb:.0f} МиБ, простой {IDLE_TIMEOUT:.0f} c")
+    print(f"{'хранилище':<28}{'момент':<10}{'МиБ (tm)':>10} {'в памяти':>8} {'МиБ учет':>10} "
+          f"{'бюджет':>10} {'простой':>10}")
+    tracemalloc.start()
+    await run("MemoryStorage", MemoryStorage(), sessions)
+    await run("SessionStorage", SessionStorage(memory_budget=budget, idle_timeout=IDLE_TIMEOUT), sessions)
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        await run("SQLiteStorage", SQLiteStorage(os.path.join(directory, "fsm.sqlite3"), memory_budget=budget,
+                                                 idle_timeout=IDLE_TIMEOUT), sessions)
+        print(f"{'':<28}время прогона SQLiteStorage: {time.perf_counter() - started:.1f} c")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--budget-mb", type=float, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.budget_mb))
@@ -0,0 +1,110 @@
+# benchmarks/bench_session_state.py
+"""Память сессии и задержка ответа: полные тексты вопросов в FSM против id из общего QuestionStore.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_session_state --sessions 500 --answers 40
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import statistics
+import tempfile
+import time
+import tracemalloc
+from aiogram.fsm.storage.base import StorageKey
+from benchmarks.bench_fsm_storage import FULL_ENT_SIZES
+from utils.question_store import QuestionStore, question_id, set_answer
+from utils.sqlite_storage import SQLiteStorage
+
+
+def make_question(subject: str, index: int) -> str:
+    # Вопросы повторяются между сессиями, как при выдаче из пула или кэша
+    return (f"Вопрос: Вопрос {index} по предмету {subject}, достаточно длинный, чтобы быть похожим на настоящий?\n"
+            f"A) Первый вариант ответа\nB) Второй вариант ответа\nC) Третий вариант ответа\nD) Четвертый вариант")
+
+
+def legacy_session() -> dict:
+    return {
+        "full_ent_questions": {key: [make_question(key, i) for i in range(size)] for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_correct_answers": {key: ["B"] * size for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_user_answers": {},
+        "full_ent_current_subject": "profile1",
+    }
+
+
+async def store_questions(store: QuestionStore) -> None:
+    for key, size in FULL_ENT_SIZES.items():
+        await store.add_many([make_question(key, i) for i in range(size)])
+
+
+def compact_session() -> dict:
+    # id считаются так же, как в QuestionStore.add_many; тексты уже сохранены в store_questions
+    return {
+        "full_ent_question_ids": {key: [question_id(make_question(key, i)) for i in range(size)]
+                                  for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_answer_keys": {key: "B" * size for key, size in FULL_ENT_SIZES.items()},
+        "full_ent_user_answers": {},
+        "full_ent_current_subject": "profile1",
+    }
+
+
+async def legacy_answer(storage, key, index):
+    data = await storage.get_data(key)
+    user_answers = data.get("full_ent_user_answers", {})
+    user_answers.setdefault("profile1", {})[index] = "A"
+    await storage.update_data(key, {"full_ent_user_answers": user_answers})
+
+
+async def compact_answer(storage, key, index):
+    data = await storage.get_data(key)
+    user_answers = dict(data.get("full_ent_user_answers", {}))
+    user_answers["profile1"] = set_answer(user_answers.get("profile1", ""), index, "A")
+    await storage.update_data(key, {"full_ent_user_answers": user_answers})
+
+
+async def measure(name: str, make_session, answer, sessions: int, answers: int, directory: str) -> None:
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    session_list = [make_session() for _ in range(sessions)]
+    memory = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot_before, "filename"))
+    tracemalloc.stop()
+    pickled = len(pickle.dumps(session_list[0], pickle.HIGHEST_PROTOCOL))
+
+    storage = SQLiteStorage(os.path.join(directory, f"{name}.sqlite3"), flush_interval=3600)
+    keys = [StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id) for chat_id in range(sessions)]
+    for key, session in zip(keys, session_list):
+        await storage.set_data(key, session)
+    await storage.flush()
+    latencies = []
+    flush_time = 0.0
+    for index in range(answers):
+        for key in keys:
+            started = time.perf_counter()
+            await answer(storage, key, index)
+            latencies.append(time.perf_counter() - started)
+        # Сброс на диск после каждого раунда ответов: стоимость сериализации сессий
+        started = time.perf_counter()
+        await storage.flush()
+        flush_time += time.perf_counter() - started
+    await storage.close()
+
+    print(f"{name:<10} память на сессию {memory / sessions / 1024:7.1f} КБ   сериализовано {pickled / 1024:6.1f} КБ   "
+          f"ответ p50 {statistics.median(latencies) * 1e6:6.1f} мкс   "
+          f"сброс на ответ {flush_time / len(latencies) * 1e6:6.1f} мкс")
+
+
+async def main(sessions: int, answers: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        store = QuestionStore(os.path.join(directory, "questions.sqlite3"))
+        await measure("до", legacy_session, legacy_answer, sessions, answers, directory)
+        await store_questions(store)
+        await measure("после", compact_session, compact_answer, sessions, answers, directory)
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--answers", type=int, default=40)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.answers))
@@ -0,0 +1,63 @@
+# benchmarks/bench_single_flight.py
+"""Объединение одинаковых запросов генерации в пиковый момент.
+
+Много пользователей одновременно выбирают один и тот же предмет. Сравнивается число запросов
+к модели (локальный фейковый сервер) с объединением и без него, для обычной и потоковой генерации.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_single_flight --users 200 --subjects 3
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.fake_openai import FakeOpenAIServer
+from utils import openai_utils
+from utils.single_flight import SingleFlight
+
+SUBJECTS = ["История Казахстана", "Математическая грамотность", "Грамотность чтения", "Физика", "Химия"]
+
+
+async def consume_stream(client, subject: str, num_questions: int) -> int:
+    return len([item async for item in openai_utils._stream_subject_questions(client, subject, num_questions)])
+
+
+async def consume(client, subject: str, num_questions: int) -> int:
+    questions, _ = await openai_utils._generate_subject_questions(client, subject, num_questions)
+    return len(questions)
+
+
+async def run(server: FakeOpenAIServer, users: int, subjects: int, coalescing: bool, streaming: bool) -> None:
+    openai_utils.GENERATION_COALESCING = coalescing
+    openai_utils._single_flight = SingleFlight()
+    client = openai_utils.create_openai_client(api_key="test", base_url=server.base_url)
+    server.requests = 0
+    func = consume_stream if streaming else consume
+    started = time.perf_counter()
+    results = await asyncio.gather(*(func(client, SUBJECTS[i % subjects], 5) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    stats = openai_utils.get_generation_stats()
+    print(f"{'поток' if streaming else 'целиком':>8} {'да' if coalescing else 'нет':>12} {server.requests:>10} "
+          f"{elapsed:>8.2f} {stats['coalesce_ratio']:>8.2%} {stats['saved_tokens']:>10} "
+          f"{sum(results) / users:>8.1f}")
+
+
+async def main(users: int, subjects: int, latency: float) -> None:
+    server = FakeOpenAIServer(latency=latency, num_questions=5)
+    await server.start()
+    openai_utils.LLM_CACHE_ENABLED = False  # Измеряется только объединение одновременных запросов
+    try:
+        print(f"{'режим':>8} {'объединение':>12} {'запросов':>10} {'время,с':>8} {'доля':>8} {'токенов':>10} {'вопросов':>8}")
+        for streaming in (False, True):
+            for coalescing in (False, True):
+                await run(server, users, subjects, coalescing, streaming)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--subjects", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, min(args.subjects, len(SUBJECTS)), args.latency))
@@ -0,0 +1,99 @@
+# benchmarks/bench_telegram_sender.py
+"""Всплеск исходящих сообщений: прямые вызовы Bot API против OutboundSender.
+
+Фейковая сессия Bot отвечает 429 (retry_after), если превышены лимиты Telegram: 30 сообщений в
+секунду на бота и около одного в секунду в чат (с небольшим запасом на всплеск). Каждый чат
+получает несколько сообщений одновременно, как бывает, когда фоновая генерация и обработчик
+пишут в один чат ("⏳ генерируется..." и следом вопрос). Затем проверяется, что сообщения,
+отправляемые в один чат по одному (обработчик ждет каждое), тоже идут не чаще лимита чата.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_telegram_sender --chats 100 --messages 3
+"""
+import argparse
+import asyncio
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from benchmarks.fake_telegram import FakeBotSession
+from utils.telegram_sender import OutboundSender, TokenBucket
+
+
+class LimitedBotSession(FakeBotSession):
+    """FakeBotSession с лимитами Telegram: при превышении бросает TelegramRetryAfter"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.global_bucket = TokenBucket(30, 30)
+        self.chat_buckets = {}
+        self.rejected = 0
+
+    async def make_request(self, bot, method, timeout: int = None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            chat_bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(1.0, 3))
+            chat_wait, global_wait = chat_bucket.reserve(), self.global_bucket.reserve()
+            if chat_wait or global_wait:
+                # Отклоненный запрос не расходует лимит
+                chat_bucket.tokens += 1
+                self.global_bucket.tokens += 1
+                self.rejected += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests",
+                                         retry_after=max(1, round(max(chat_wait, global_wait))))
+        return await super().make_request(bot, method, timeout)
+
+
+async def run(chats: int, messages: int, use_sender: bool) -> None:
+    session = LimitedBotSession(latency=0.01)
+    bot = Bot(token="123456:TEST", session=session)
+    sender = OutboundSender(max_retries=10)
+    if use_sender:
+        session.middleware(sender)
+    failed = 0
+
+    async def send(chat_id: int, i: int) -> None:
+        nonlocal failed
+        try:
+            await bot.send_message(chat_id, f"Сообщение {i + 1} из {messages}")
+        except TelegramRetryAfter:
+            failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(chat_id, i) for chat_id in range(1, chats + 1) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+    delivered = sum(len(texts) for texts in session.sent.values())
+    stats = sender.get_stats()
+    print(f"{'очередь' if use_sender else 'напрямую':>9} {elapsed:>8.2f} {failed:>10} {session.rejected:>6} "
+          f"{delivered:>10} {stats['coalesced']:>10} {stats['queue_delay_avg']:>12.2f}")
+
+
+async def sequential(messages: int) -> None:
+    """Обработчик ждет каждое сообщение перед следующим: очередь чата каждый раз пустая"""
+    session = LimitedBotSession()
+    bot = Bot(token="123456:TEST", session=session)
+    sender = OutboundSender(max_retries=0)
+    session.middleware(sender)
+    started = time.perf_counter()
+    for i in range(messages):
+        await bot.send_message(1, f"Сообщение {i + 1} из {messages}")
+    elapsed = time.perf_counter() - started
+    expected = (messages - sender.chat_burst) / sender.chat_rate
+    print(f"\n{messages} сообщений в один чат по одному: {elapsed:.2f} c (по лимиту чата не меньше {expected:.2f} c), "
+          f"429: {session.rejected}")
+    assert session.rejected == 0 and elapsed >= expected * 0.95, "лимит чата не соблюдается"
+
+
+async def main(chats: int, messages: int) -> None:
+    print(f"{chats} чатов x {messages} сообщений одновременно")
+    print(f"{'режим':>9} {'время,с':>8} {'не дошло':>10} {'429':>6} {'отправок':>10} {'склеено':>10} "
+          f"{'ожидание,с':>12}")
+    await run(chats, messages, use_sender=False)
+    await run(chats, messages, use_sender=True)
+    await sequential(messages + 5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.messages))
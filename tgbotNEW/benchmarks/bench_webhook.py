@@ -0,0 +1,153 @@
+# benchmarks/bench_webhook.py
+"""Пропускная способность обработки обновлений: long polling против вебхука с UpdatePipeline.
+
+Настоящий Dispatcher с register_handlers получает обновления от локального фейкового Bot API
+(benchmarks/fake_telegram.py): в режиме polling через getUpdates, в режиме webhook - POST-запросами
+на локальное приложение вебхука (как Telegram, не больше --connections одновременно, обновления
+одного чата по очереди). Фейковый Bot API и отправитель работают в отдельном процессе, чтобы не
+делить процессор с ботом. Заодно проверяется, что все обновления обработаны и ответы в каждом
+чате идут в порядке сообщений.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.bench_webhook --users 200 --messages 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import re
+import socket
+import time
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
+from benchmarks.fake_telegram import FakeTelegramServer, make_message_update
+from handlers import register_handlers
+from utils.webhook import run_webhook
+
+TOKEN = "123456:TEST"
+WEBHOOK_SECRET = "secret"
+_SEQ_RE = re.compile(r"u\d+m(\d+)")
+
+
+def make_updates(users: int, messages: int) -> dict:
+    """Обновления по чатам. Номер сообщения зашит в имя пользователя, /start возвращает его в ответе"""
+    updates = {}
+    update_id = 0
+    for seq in range(messages):
+        for user_id in range(1, users + 1):
+            update_id += 1
+            updates.setdefault(user_id, []).append(
+                make_message_update(update_id, user_id, "/start", first_name=f"u{user_id}m{seq}"))
+    return updates
+
+
+def check_order(server: FakeTelegramServer) -> int:
+    """Количество чатов, в которых ответы пришли не в порядке сообщений"""
+    last_seq = {}
+    broken = set()
+    for chat_id, text in server.sent:
+        match = _SEQ_RE.search(text)
+        if not match:
+            continue
+        seq = int(match.group(1))
+        if seq < last_seq.get(chat_id, -1):
+            broken.add(chat_id)
+        last_seq[chat_id] = seq
+    return len(broken)
+
+
+async def deliver_webhook(url: str, updates: dict, connections: int) -> None:
+    limit = asyncio.Semaphore(connections)
+    async with aiohttp.ClientSession() as session:
+        async def deliver_chat(chat_updates: list) -> None:
+            for update in chat_updates:
+                async with limit:
+                    async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}) as response:
+                        assert response.status == 200, response.status
+
+        await asyncio.gather(*(deliver_chat(chat_updates) for chat_updates in updates.values()))
+
+
+async def run_load(conn, mode: str, users: int, messages: int, latency: float, connections: int) -> None:
+    """Процесс нагрузки: фейковый Bot API и, в режиме webhook, отправитель обновлений"""
+    updates = make_updates(users, messages)
+    total = users * messages
+    server = FakeTelegramServer(latency=latency)
+    await server.start()
+    conn.send(server.base_url)
+    if mode == "polling":
+        started = time.perf_counter()
+        server.add_updates(sorted((u for chat in updates.values() for u in chat), key=lambda u: u["update_id"]))
+    else:
+        while server.webhook_url is None:
+            await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await deliver_webhook(server.webhook_url, updates, connections)
+    await server.wait_sent(total)
+    elapsed = time.perf_counter() - started
+    conn.send((elapsed, len(server.sent), check_order(server)))
+    conn.recv()  # Бот остановлен
+    await server.stop()
+
+
+def load_process(conn, *args) -> None:
+    asyncio.run(run_load(conn, *args))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_bot(conn, mode: str, concurrency: int) -> tuple:
+    base_url = await asyncio.to_thread(conn.recv)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp["openai_client"] = None
+    dp["question_pool"] = None
+    register_handlers(dp)
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    if mode == "polling":
+        runner = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    else:
+        port = free_port()
+        stop_event = asyncio.Event()
+        runner = asyncio.create_task(run_webhook(dp, bot, f"http://127.0.0.1:{port}", "/webhook", "127.0.0.1", port,
+                                                 secret_token=WEBHOOK_SECRET, concurrency=concurrency,
+                                                 stop_event=stop_event))
+    result = await asyncio.to_thread(conn.recv)
+    if mode == "polling":
+        await dp.stop_polling()
+    else:
+        stop_event.set()
+    await runner
+    await bot.session.close()
+    conn.send(None)
+    return result
+
+
+def main(users: int, messages: int, latency: float, connections: int, concurrency: int) -> None:
+    total = users * messages
+    print(f"{users} чатов x {messages} сообщений, задержка Bot API {latency * 1000:.0f} мс")
+    print(f"{'режим':>8} {'время,с':>8} {'обновл./с':>10} {'нарушен порядок':>16}")
+    for mode in ("polling", "webhook"):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        load = multiprocessing.Process(target=load_process,
+                                       args=(child_conn, mode, users, messages, latency, connections))
+        load.start()
+        elapsed, sent, broken = asyncio.run(run_bot(parent_conn, mode, concurrency))
+        load.join()
+        assert sent == total, (sent, total)
+        print(f"{mode:>8} {elapsed:>8.2f} {total / elapsed:>10.0f} {broken:>16}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    main(args.users, args.messages, args.latency, args.connections, args.concurrency)
@@ -0,0 +1,177 @@
+# benchmarks/fake_openai.py
+import asyncio
+import json
+import random
+import re
+import time
+from aiohttp import web
+
+QUESTION_BLOCK = (
+    "Вопрос: Когда была принята Конституция Республики Казахстан?\n"
+    "A) 1993\nB) 1995\nC) 1991\nD) 1998\n"
+    "Правильный ответ: B"
+)
+# Тот же вопрос, но без строки с ответом: так выглядит сбой формата у модели
+BROKEN_BLOCK = QUESTION_BLOCK.rsplit("\n", 1)[0]
+QUESTION_JSON = {"question": "Когда была принята Конституция Республики Казахстан?",
+                 "A": "1993", "B": "1995", "C": "1991", "D": "1998", "answer": "B"}
+# Формулировки собираются из случайных слов: одинаковые вопросы бот отбросил бы как уже виденные
+_STEM_WORDS = [f"термин{index}" for index in range(3000)]
+_STEM = "Когда была принята Конституция Республики Казахстан?"
+
+
+def _random_stem(rng: random.Random) -> str:
+    return " ".join(rng.choice(_STEM_WORDS) for _ in range(5)) + "?"
+
+
+_COUNT_RE = re.compile(r"Сгенерируй (\d+) ")
+# Строки "- предмет: количество" в промпте пакетной генерации
+_BATCH_LINE_RE = re.compile(r"^- (.+): (\d+)$", re.MULTILINE)
+
+
+def make_completion_text(num_questions: int, corrupt_rate: float = 0.0, rng: random.Random = random) -> str:
+    """Текст ответа модели в формате, который просит бот; corrupt_rate - доля блоков без строки ответа"""
+    return "\n\n".join(
+        (BROKEN_BLOCK if corrupt_rate and rng.random() < corrupt_rate else QUESTION_BLOCK).replace(_STEM, _random_stem(rng))
+        for _ in range(num_questions)
+    )
+
+
+def make_completion_json(subjects: list, rng: random.Random = random) -> str:
+    """Структурированный ответ на пакетный запрос: схема гарантирует формат, поэтому сбоев нет"""
+    return json.dumps({"subjects": [
+        {"subject": subject, "questions": [{**QUESTION_JSON, "question": _random_stem(rng)} for _ in range(count)]}
+        for subject, count in subjects
+    ]}, ensure_ascii=False)
+
+
+def count_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: для русского текста около трех символов на токен"""
+    return max(1, len(text) // 3)
+
+
+class FakeOpenAIServer:
+    """Локальный сервер, имитирующий /v1/chat/completions с заданной задержкой.
+
+    latency - постоянная часть задержки ответа, token_latency - время на каждый токен ответа
+    (модель генерирует токены последовательно, поэтому длинный ответ приходит дольше).
+    С вероятностью slow_rate ответ задерживается еще на slow_latency (хвост задержек), с
+    вероятностью fail_rate сервер отвечает ошибкой 500. models задает отдельные latency,
+    token_latency и corrupt_rate для моделей по имени из запроса: {"gpt-4o-mini": {"latency": 0.2}, ...}.
+    """
+
+    def __init__(self, latency: float = 0.2, num_questions: int = 5, host: str = "127.0.0.1", port: int = 0,
+                 token_latency: float = 0.0, corrupt_rate: float = 0.0, seed: int = 0,
+                 slow_rate: float = 0.0, slow_latency: float = 0.0, fail_rate: float = 0.0, models: dict = None):
+        self.latency = latency
+        self.num_questions = num_questions
+        self.host = host
+        self.port = port
+        self.token_latency = token_latency
+        self.corrupt_rate = corrupt_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_rate = fail_rate
+        self.models = models or {}
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.model_requests = {}
+        self.model_tokens = {}
+        self._rng = random.Random(seed)
+        self._runner = None
+
+    def _profile(self, model: str, name: str):
+        return self.models.get(model, {}).get(name, getattr(self, name))
+
+    def _usage(self, prompt: str, content: str, model: str = None) -> dict:
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        if model is not None:
+            prompt_total, completion_total = self.model_tokens.get(model, (0, 0))
+            self.model_tokens[model] = (prompt_total + prompt_tokens, completion_total + completion_tokens)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def handle_chat_completion(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        model = payload.get("model", "gpt-4")
+        self.model_requests[model] = self.model_requests.get(model, 0) + 1
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            return web.json_response({"error": {"message": "fake failure", "type": "server_error"}}, status=500)
+        extra_latency = self.slow_latency if self.slow_rate and self._rng.random() < self.slow_rate else 0.0
+        prompt = payload["messages"][-1]["content"]
+        if (payload.get("response_format") or {}).get("type") == "json_schema":
+            content = make_completion_json([(name, int(count)) for name, count in _BATCH_LINE_RE.findall(prompt)], self._rng)
+        else:
+            # Сколько вопросов просит бот, берется из промпта, как это делает модель
+            match = _COUNT_RE.search(prompt)
+            num_questions = int(match.group(1)) if match else self.num_questions
+            if payload.get("stream"):
+                return await self._stream_completion(request, payload, num_questions, extra_latency)
+            content = make_completion_text(num_questions, self._profile(model, "corrupt_rate"), self._rng)
+        usage = self._usage(prompt, content, model)
+        await asyncio.sleep(self._profile(model, "latency") + self._profile(model, "token_latency") * usage["completion_tokens"]
+                            + extra_latency)
+        body = {
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+        return web.Response(text=json.dumps(body, ensure_ascii=False), content_type="application/json")
+
+    async def _stream_completion(self, request: web.Request, payload: dict, num_questions: int,
+                                 extra_latency: float = 0.0) -> web.StreamResponse:
+        """Потоковый ответ (SSE): вопросы приходят по одному, равномерно за latency секунд"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        model = payload.get("model", "gpt-4")
+        text = make_completion_text(num_questions, self._profile(model, "corrupt_rate"), self._rng)
+        blocks = [block + "\n\n" for block in text.split("\n\n")]
+        usage = self._usage(payload["messages"][-1]["content"], "".join(blocks), model)
+        block_delay = (self._profile(model, "latency") + self._profile(model, "token_latency") * usage["completion_tokens"]) / len(blocks)
+
+        async def send(chunk: dict) -> None:
+            chunk.update(id=f"chatcmpl-{self.requests}", object="chat.completion.chunk",
+                         created=int(time.time()), model=model)
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        try:
+            await asyncio.sleep(extra_latency)
+            for block in blocks:
+                await asyncio.sleep(block_delay)
+                await send({"choices": [{"index": 0, "delta": {"content": block}, "finish_reason": None}]})
+            await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if payload.get("stream_options", {}).get("include_usage"):
+                await send({"choices": [], "usage": usage})
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # Клиент закрыл поток раньше конца (получил нужное или отменил запрос)
+        return response
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_chat_completion)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
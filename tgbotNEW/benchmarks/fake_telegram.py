@@ -0,0 +1,203 @@
+# benchmarks/fake_telegram.py
+import asyncio
+import json
+import time
+from datetime import datetime
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetMe, SendMessage
+from aiogram.types import Chat, Message, User
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "ENT Bot", "username": "ent_test_bot"}
+
+
+def make_message_update(update_id: int, user_id: int, text: str, first_name: str = "Ученик") -> dict:
+    """Обновление с текстовым сообщением пользователя в личном чате"""
+    user = {"id": user_id, "is_bot": False, "first_name": first_name}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": user, "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """Обновление с нажатием inline-кнопки под сообщением бота"""
+    user = {"id": user_id, "is_bot": False, "first_name": "Ученик"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": BOT_USER, "text": "..."}
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user, "chat_instance": "1",
+                                                       "message": message, "data": data}}
+
+
+async def _wait_chat_message(sent: dict, new_message: dict, chat_id: int, start: int, match, timeout: float) -> str:
+    async def wait():
+        index = start
+        while True:
+            messages = sent.get(chat_id, [])
+            while index < len(messages):
+                if match(messages[index]):
+                    return messages[index]
+                index += 1
+            event = new_message.setdefault(chat_id, asyncio.Event())
+            await event.wait()
+
+    return await asyncio.wait_for(wait(), timeout)
+
+
+class FakeBotSession(BaseSession):
+    """Сессия Bot без сети: каждый метод отвечает через latency секунд, сообщения копятся в sent по чатам.
+
+    Быстрее FakeTelegramServer, поэтому подходит для нагрузочных тестов на тысячи пользователей.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.sent = {}
+        self.calls = {}
+        self._message_id = 0
+        self._new_message = {}
+
+    async def make_request(self, bot, method, timeout: int = None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            chat_id = int(method.chat_id or 0)
+            self.sent.setdefault(chat_id, []).append(method.text)
+            event = self._new_message.pop(chat_id, None)
+            if event:
+                event.set()
+            self._message_id += 1
+            return Message(message_id=self._message_id, date=datetime.now(),
+                           chat=Chat(id=chat_id, type="private"), text=method.text)
+        if isinstance(method, GetMe):
+            return User(**BOT_USER)
+        return True
+
+    def message_count(self, chat_id: int) -> int:
+        return len(self.sent.get(chat_id, ()))
+
+    async def wait_message(self, chat_id: int, start: int, match, timeout: float = 60.0) -> str:
+        """Ждет сообщение бота в чате (начиная с номера start), для которого match(text) истинно"""
+        return await _wait_chat_message(self.sent, self._new_message, chat_id, start, match, timeout)
+
+    async def stream_content(self, url: str, headers: dict = None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True):
+        raise NotImplementedError("FakeBotSession не скачивает файлы")
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeTelegramServer:
+    """Локальный сервер, имитирующий Bot API: отдает обновления через getUpdates и записывает ответы бота.
+
+    Каждый вызов метода отвечает через latency секунд. Отправленные ботом сообщения копятся в sent
+    в виде (chat_id, text) и по чатам в chat_sent.
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.sent = []
+        self.chat_sent = {}
+        self.calls = {}
+        self.webhook_url = None
+        self._new_chat_message = {}
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._sent_changed = asyncio.Event()
+        self._message_id = 0
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def add_updates(self, updates: list) -> None:
+        self._updates.extend(updates)
+        self._new_updates.set()
+
+    async def wait_sent(self, count: int, timeout: float = 60.0) -> None:
+        """Ждет, пока бот отправит не меньше count сообщений"""
+        async def wait():
+            while len(self.sent) < count:
+                self._sent_changed.clear()
+                await self._sent_changed.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+
+    def message_count(self, chat_id: int) -> int:
+        return len(self.chat_sent.get(chat_id, ()))
+
+    async def wait_message(self, chat_id: int, start: int, match, timeout: float = 60.0) -> str:
+        """Ждет сообщение бота в чате (начиная с номера start), для которого match(text) истинно"""
+        return await _wait_chat_message(self.chat_sent, self._new_chat_message, chat_id, start, match, timeout)
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER, "text": text}
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        while True:
+            # Подтвержденные (update_id < offset) обновления удаляются, как в настоящем Bot API
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            if self._updates or time.monotonic() >= deadline:
+                return self._updates[:limit]
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or 0)
+            self.sent.append((chat_id, params.get("text", "")))
+            self.chat_sent.setdefault(chat_id, []).append(params.get("text", ""))
+            self._sent_changed.set()
+            event = self._new_chat_message.pop(chat_id, None)
+            if event:
+                event.set()
+            result = self._message(chat_id, params.get("text", ""))
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url")
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook_url = None
+            result = True
+        else:
+            result = True
+        return web.Response(text=json.dumps({"ok": True, "result": result}, ensure_ascii=False),
+                            content_type="application/json")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
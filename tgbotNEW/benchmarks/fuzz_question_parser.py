@@ -0,0 +1,83 @@
+# benchmarks/fuzz_question_parser.py
+"""Корпус некорректных ответов модели и случайный фаззинг QuestionParser.
+
+Проверяет, что парсер никогда не падает, не выдает вопросы без четырех вариантов или с ответом
+вне A-D и одинаково работает на целом тексте и на потоке из кусков любого размера.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.fuzz_question_parser --iterations 2000
+"""
+import argparse
+import random
+from benchmarks.bench_question_parser import make_output, stream_parse
+from utils.question_parser import OPTION_KEYS, parse_questions
+
+VALID = "Вопрос: Столица Казахстана?\nA) Алматы\nB) Астана\nC) Шымкент\nD) Караганда\nПравильный ответ: B"
+
+# (описание, текст, сколько вопросов должно получиться)
+CORPUS = [
+    ("корректный блок", VALID, 1),
+    ("пустая строка внутри вопроса", VALID.replace("\nA)", "\n\nA)"), 1),
+    ("CRLF", VALID.replace("\n", "\r\n"), 1),
+    ("кириллические буквы вариантов", VALID.replace("A)", "А)").replace("B)", "В)").replace("C)", "С)"), 1),
+    ("ответ с пояснением", VALID.replace(": B", ": B) Астана"), 1),
+    ("жирный ответ", VALID.replace("Правильный ответ: B", "**Правильный ответ:** B"), 1),
+    ("нет ответа", VALID.rsplit("\n", 1)[0], 0),
+    ("три варианта", VALID.replace("D) Караганда\n", ""), 0),
+    ("ответ вне вариантов", VALID.replace(": B", ": E"), 0),
+    ("пустой ответ", VALID.replace(": B", ":"), 0),
+    ("нет формулировки", VALID.split("\n", 1)[1], 0),
+    ("два вопроса без разделителя", VALID + "\n" + VALID, 2),
+    ("вопрос без ответа, затем корректный", VALID.rsplit("\n", 1)[0] + "\n" + VALID, 1),
+    ("вступление модели", "Вот ваши вопросы:\n\n" + VALID, 1),
+    ("обрыв посередине", VALID[:40], 0),
+    ("пустой текст", "", 0),
+    ("мусор", "\n\n\n:::\nA)\nПравильный ответ", 0),
+]
+
+
+def check(questions) -> None:
+    for question in questions:
+        assert question.stem, question
+        assert tuple(sorted(question.options)) == OPTION_KEYS, question
+        assert question.answer in OPTION_KEYS, question
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(1, 10)):
+        position = rng.randrange(len(chars) + 1)
+        action = rng.random()
+        if action < 0.4 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif action < 0.8:
+            chars.insert(position, rng.choice("\n\n ABCD):Вопрос"))
+        else:
+            chars[position:position] = list(rng.choice(["\n\n", "Правильный ответ: ", "A) "]))
+    return "".join(chars)
+
+
+def main(iterations: int, seed: int) -> None:
+    for description, text, expected in CORPUS:
+        questions, rejected = parse_questions(text)
+        check(questions)
+        assert len(questions) == expected, (description, len(questions), expected)
+        assert [q.text for q in stream_parse(text, 3)] == [q.text for q in questions], description
+    print(f"Корпус: {len(CORPUS)} случаев пройдено")
+
+    rng = random.Random(seed)
+    base = make_output(5)
+    for _ in range(iterations):
+        text = mutate(base, rng)
+        questions, _ = parse_questions(text)
+        check(questions)
+        chunked = stream_parse(text, rng.randint(1, 64))
+        assert [q.text for q in chunked] == [q.text for q in questions], text
+    print(f"Фаззинг: {iterations} мутаций без ошибок")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.iterations, args.seed)
@@ -0,0 +1,326 @@
+# benchmarks/load_test.py
+"""Синтетическая нагрузка: тысячи учеников одновременно проходят тест через настоящий Dispatcher.
+
+Dispatcher собирается с register_handlers, как в main.py, но Bot работает через FakeBotSession
+(без сети, с задержкой --tg-latency), а dp['openai_client'] указывает на локальный FakeOpenAIServer
+(задержка --llm-latency). Каждый ученик проходит меню, выбор предмета (обязательного или двух
+профильных), отвечает на все вопросы с паузой до --think секунд, получает результаты и открывает
+статистику.
+
+Отчет: p50/p95/p99 времени обработки обновления (dp.feed_update), время до первого вопроса,
+пропускная способность и пиковый RSS.
+
+С --workers N бот работает как под supervisor.py: N процессов-воркеров принимают обновления по HTTP,
+обновления раздает им ShardRouter по хешу chat_id, а ответы бота приходят на FakeTelegramServer.
+Вместо времени feed_update тогда измеряется время от отправки обновления до ответа бота (reply_*),
+а пропускная способность сравнивается между разными N (воркерам нужны свободные ядра). --save-baseline сохраняет результат в
+benchmarks/baselines/load_test.json, последующие запуски сравниваются с ним; с --check запуск
+завершается с ошибкой, если метрики ухудшились больше чем на --tolerance.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.load_test --users 1000
+                               python -m benchmarks.load_test --users 3000 --think 0.1 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import secrets
+import signal
+import sys
+import tempfile
+import time
+from functools import partial
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBotSession, FakeTelegramServer, make_callback_update, make_message_update
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, WORKER_PATH
+from handlers import register_handlers
+from keyboards import OBLIGATORY_SUBJECTS, PROFILE_SUBJECTS
+from supervisor import WorkerSet
+from utils.openai_utils import create_openai_client, set_llm_share
+from utils.sharding import ShardRouter
+from utils.sqlite_storage import SQLiteStorage
+from utils.statistics import get_statistics_store
+from utils.webhook import run_webhook
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_test.json")
+# Метрики, для которых рост означает ухудшение, и метрики, для которых ухудшение - падение
+LOWER_IS_BETTER = ("handler_p50_ms", "handler_p95_ms", "handler_p99_ms", "first_question_p95_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput_updates_per_s",)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def is_question(text: str) -> bool:
+    return "<b>Вопрос " in text
+
+
+def is_results(text: str) -> bool:
+    return "Результаты теста" in text
+
+
+class LoadTest:
+    def __init__(self, dp: Dispatcher, bot: Bot, session, think: float, profile_share: float, seed: int):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.think = think
+        self.profile_share = profile_share
+        self.rng = random.Random(seed)
+        self.handler_times = []
+        self.reply_times = []
+        self.first_question_times = []
+        self.failed_users = 0
+        self._update_id = 0
+
+    async def feed(self, raw_update: dict) -> None:
+        update = Update.model_validate(raw_update, context={"bot": self.bot})
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.handler_times.append(time.perf_counter() - started)
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def _exchange(self, user_id: int, raw_update: dict, match) -> str:
+        start = self.session.message_count(user_id)
+        started = time.perf_counter()
+        await self.feed(raw_update)
+        text = await self.session.wait_message(user_id, start, match)
+        self.reply_times.append(time.perf_counter() - started)
+        return text
+
+    async def send_text(self, user_id: int, text: str, match) -> str:
+        return await self._exchange(user_id, make_message_update(self._next_id(), user_id, text), match)
+
+    async def press(self, user_id: int, data: str, match) -> str:
+        return await self._exchange(user_id, make_callback_update(self._next_id(), user_id, data), match)
+
+    async def pause(self) -> None:
+        await asyncio.sleep(self.rng.uniform(0, self.think))
+
+    async def student(self, user_id: int, ramp: float) -> None:
+        await asyncio.sleep(self.rng.uniform(0, ramp))
+        try:
+            await self.send_text(user_id, "/start", lambda text: "Добро пожаловать" in text)
+            await self.pause()
+            started = time.perf_counter()
+            if self.rng.random() < self.profile_share:
+                subject_1, subject_2 = self.rng.sample(PROFILE_SUBJECTS, 2)
+                await self.send_text(user_id, "🧪 Профильные предметы", lambda text: "профильный предмет" in text)
+                await self.pause()
+                await self.press(user_id, f"profile1:{subject_1}", lambda text: "второй профильный" in text)
+                await self.pause()
+                started = time.perf_counter()
+                text = await self.press(user_id, f"profile2:{subject_2}", is_question)
+            else:
+                subject = self.rng.choice(OBLIGATORY_SUBJECTS)
+                await self.send_text(user_id, "📖 Обязательные предметы", lambda text: "обязательный предмет" in text)
+                await self.pause()
+                started = time.perf_counter()
+                text = await self.press(user_id, f"obligatory:{subject}", is_question)
+            self.first_question_times.append(time.perf_counter() - started)
+            while not is_results(text):
+                await self.pause()
+                text = await self.send_text(user_id, self.rng.choice("ABCD"),
+                                            lambda text: is_question(text) or is_results(text))
+            await self.send_text(user_id, "📊 Статистика", lambda text: "статистика" in text.lower())
+        except asyncio.TimeoutError:
+            self.failed_users += 1
+
+
+class ShardedLoadTest(LoadTest):
+    """Тот же сценарий, но обновления уходят процессам-воркерам через ShardRouter"""
+
+    def __init__(self, router: ShardRouter, server: FakeTelegramServer, think: float, profile_share: float, seed: int):
+        super().__init__(None, None, server, think, profile_share, seed)
+        self.router = router
+
+    async def feed(self, raw_update: dict) -> None:
+        self.router.submit(raw_update)
+
+
+def build_dispatcher(llm_url: str, storage_kind: str) -> tuple:
+    """Dispatcher как в main.py, но без пула вопросов и с моделью на llm_url. Возвращает (dp, client, storage)"""
+    storage = SQLiteStorage("data/fsm.sqlite3") if storage_kind == "sqlite" else MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    client = create_openai_client(api_key="test", base_url=llm_url)
+    dp["openai_client"] = client
+    dp["question_pool"] = None
+    register_handlers(dp)
+    return dp, client, storage
+
+
+def serve_worker(llm_url: str, tg_url: str, storage_kind: str, base_port: int, worker_index: int, workers: int,
+                 secret: str) -> None:
+    """Процесс-воркер нагрузочного теста: как main.run_worker, но Bot API и модель - имитации"""
+    asyncio.run(_serve_worker(llm_url, tg_url, storage_kind, base_port, worker_index, workers, secret))
+
+
+async def _serve_worker(llm_url: str, tg_url: str, storage_kind: str, base_port: int, worker_index: int,
+                        workers: int, secret: str) -> None:
+    logging.basicConfig(level=logging.WARNING, format=f"[w{worker_index}] {logging.BASIC_FORMAT}")
+    set_llm_share(1 / workers)
+    dp, client, storage = build_dispatcher(llm_url, storage_kind)
+    bot = Bot(token="123456:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(tg_url)))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop_event = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+    try:
+        await run_webhook(dp, bot, "", WORKER_PATH, "127.0.0.1", base_port + worker_index, secret_token=secret,
+                          concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING, stop_event=stop_event)
+    finally:
+        await client.close()
+        await storage.close()
+        await get_statistics_store().close()
+        await bot.session.close()
+
+
+async def wait_workers(router: ShardRouter, timeout: float = 60.0) -> None:
+    """Ждет, пока все воркеры начнут принимать обновления (пустая пачка - проверка готовности)"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        for url in router.urls:
+            while True:
+                try:
+                    async with session.post(url, json=[], headers=router.headers) as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Воркер {url} не запустился за {timeout:.0f} c")
+                await asyncio.sleep(0.2)
+
+
+async def run(args) -> dict:
+    llm = FakeOpenAIServer(latency=args.llm_latency)
+    await llm.start()
+    if args.workers:
+        server = FakeTelegramServer(latency=args.tg_latency)
+        await server.start()
+        secret = secrets.token_urlsafe(16)
+        worker_set = WorkerSet(args.workers, partial(serve_worker, llm.base_url, server.base_url, args.storage,
+                                                     args.worker_port), secret)
+        worker_set.start()
+        router = ShardRouter([f"http://127.0.0.1:{args.worker_port + index}{WORKER_PATH}" for index in range(args.workers)],
+                             secret_token=secret)
+        router.start()
+        await wait_workers(router)
+        test = ShardedLoadTest(router, server, args.think, args.profile_share, args.seed)
+    else:
+        dp, client, storage = build_dispatcher(llm.base_url, args.storage)
+        session = FakeBotSession(latency=args.tg_latency)
+        test = LoadTest(dp, Bot(token="123456:TEST", session=session), session, args.think, args.profile_share,
+                        args.seed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(test.student(user_id, args.ramp) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+
+    if args.workers:
+        await router.close()
+        await worker_set.stop()
+        await server.stop()
+    else:
+        await client.close()
+        await storage.close()
+        await get_statistics_store().close()
+    await llm.stop()
+    updates = len(test.reply_times)
+    result = {
+        "users": args.users,
+        "workers": args.workers,
+        "failed_users": test.failed_users,
+        "updates": updates,
+        "duration_s": round(elapsed, 2),
+        "throughput_updates_per_s": round(updates / elapsed, 1),
+        "reply_p50_ms": round(percentile(test.reply_times, 0.50) * 1000, 2),
+        "reply_p95_ms": round(percentile(test.reply_times, 0.95) * 1000, 2),
+        "first_question_p50_ms": round(percentile(test.first_question_times, 0.50) * 1000, 1),
+        "first_question_p95_ms": round(percentile(test.first_question_times, 0.95) * 1000, 1),
+        "llm_requests": llm.requests,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if not args.workers:
+        # Время dp.feed_update есть только в одном процессе: воркеры обрабатывают обновления у себя
+        for name, q in (("handler_p50_ms", 0.50), ("handler_p95_ms", 0.95), ("handler_p99_ms", 0.99)):
+            result[name] = round(percentile(test.handler_times, q) * 1000, 2)
+    else:
+        result["peak_worker_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return result
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Печатает изменения относительно базовой линии и возвращает список ухудшившихся метрик"""
+    regressions = []
+    for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if key in LOWER_IS_BETTER else change < -tolerance
+        if worse:
+            regressions.append(key)
+        print(f"{key:>28}: {old:>10} -> {new:>10} ({change:+.1%}){'  <- ухудшение' if worse else ''}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ramp", type=float, default=5.0, help="За сколько секунд подключаются все ученики")
+    parser.add_argument("--think", type=float, default=0.5, help="Максимальная пауза ученика между действиями")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--tg-latency", type=float, default=0.02)
+    parser.add_argument("--profile-share", type=float, default=0.3, help="Доля учеников, выбирающих профильные предметы")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0, help="Процессов-воркеров (0 - Dispatcher в этом процессе)")
+    parser.add_argument("--worker-port", type=int, default=18200, help="Порт первого воркера")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Код возврата 1 при ухудшении относительно базовой линии")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Базы статистики, вопросов и FSM создаются во временном каталоге, а не в data/ бота
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            result = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**result, "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "check")}},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена в {args.baseline}")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
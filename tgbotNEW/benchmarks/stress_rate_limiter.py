@@ -0,0 +1,71 @@
+# benchmarks/stress_rate_limiter.py
+"""Нагрузочная проверка лимита бесплатных генераций при одновременных нажатиях.
+
+Каждый пользователь нажимает кнопку предмета много раз одновременно; между проверкой лимита и
+генерацией есть await, как в generate_questions. Прежняя схема (проверка и увеличение счетчика
+отдельными вызовами) пропускает лишние генерации, try_consume_generation - нет. Часть генераций
+"падает" и возвращает квоту через refund_generation.
+
+Запуск (из каталога tgbotNEW): python -m benchmarks.stress_rate_limiter --users 1000 --taps 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from utils import statistics
+from utils.rate_limiter import SlidingWindowLimiter
+
+
+async def legacy_tap(counters: dict, user_id: int) -> bool:
+    """Проверка и увеличение счетчика раздельно, как было раньше"""
+    if counters.get(user_id, 0) >= statistics.FREE_GENERATE_LIMIT:
+        return False
+    await asyncio.sleep(0)  # Ожидание ответа модели между проверкой и увеличением
+    counters[user_id] = counters.get(user_id, 0) + 1
+    return True
+
+
+async def atomic_tap(user_id: int, rng: random.Random, failure_rate: float) -> bool:
+    if not await statistics.try_consume_generation(user_id):
+        return False
+    await asyncio.sleep(0)
+    if rng.random() < failure_rate:
+        await statistics.refund_generation(user_id)
+        return False
+    return True
+
+
+async def main(users: int, taps: int, failure_rate: float, seed: int) -> None:
+    rng = random.Random(seed)
+    limit = statistics.FREE_GENERATE_LIMIT
+
+    counters = {}
+    results = await asyncio.gather(*(legacy_tap(counters, user_id) for user_id in range(users) for _ in range(taps)))
+    over_limit = sum(1 for count in counters.values() if count > limit)
+    print(f"Раздельные проверка и увеличение: успешных {sum(results)}, пользователей сверх лимита {over_limit}")
+
+    statistics.generation_limiter = SlidingWindowLimiter(limit, statistics.GENERATE_WINDOW.total_seconds())
+    statistics.get_statistics_store()  # Хранилище создается до замера
+    started = time.perf_counter()
+    results = await asyncio.gather(*(atomic_tap(user_id, rng, failure_rate)
+                                     for user_id in range(users) for _ in range(taps)))
+    elapsed = time.perf_counter() - started
+    per_user = {}
+    for (user_id, _), ok in zip(((user_id, tap) for user_id in range(users) for tap in range(taps)), results):
+        per_user[user_id] = per_user.get(user_id, 0) + ok
+    over_limit = sum(1 for count in per_user.values() if count > limit)
+    # С возвратами квоты каждый пользователь должен получить ровно limit успешных генераций
+    under_limit = sum(1 for count in per_user.values() if count < limit)
+    print(f"try_consume_generation: успешных {sum(results)}, сверх лимита {over_limit}, недополучили {under_limit}, "
+          f"{len(results) / elapsed:.0f} операций/с, состояний в памяти {len(statistics.generation_limiter)}")
+    assert over_limit == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--taps", type=int, default=20)
+    parser.add_argument("--failure-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.taps, args.failure_rate, args.seed))
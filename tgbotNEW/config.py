@@ -1,2 +1,154 @@
 BOT_TOKEN = ""  # Замените на ваш токен
 OPENAI_API_KEY = ""  # Замените на ваш API ключ
+
+# Получение обновлений: "polling" (long polling) или "webhook" (локальный aiohttp-сервер)
+BOT_MODE = "polling"
+WEBHOOK_BASE_URL = ""  # Публичный адрес бота, например https://example.com (пусто - вебхук не регистрируется)
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = "0.0.0.0"
+WEBAPP_PORT = 8080
+UPDATE_CONCURRENCY = 100  # Сколько обновлений разных чатов обрабатывается одновременно (режим webhook)
+UPDATE_MAX_PENDING = 10000  # Сколько обновлений может ждать обработки, прежде чем вебхук начнет отвечать 503
+
+# Несколько процессов (python supervisor.py): supervisor получает обновления (polling или webhook, как выше)
+# и раздает их воркерам по хешу chat_id. Лимиты Telegram и модели делятся между воркерами поровну
+WORKERS = 4  # Количество процессов-воркеров
+WORKER_HOST = "127.0.0.1"
+WORKER_BASE_PORT = 8200  # Воркер i принимает обновления от supervisor на порту WORKER_BASE_PORT + i
+WORKER_PATH = "/updates"
+
+# Очередь исходящих сообщений (лимиты Telegram)
+TELEGRAM_GLOBAL_RATE = 30  # Сообщений в секунду на всего бота
+TELEGRAM_CHAT_RATE = 1.0  # Сообщений в секунду в один чат
+TELEGRAM_CHAT_BURST = 3  # Сколько сообщений в чат можно отправить подряд без паузы
+TELEGRAM_MAX_RETRIES = 3  # Повторы после ответа 429 (retry_after)
+TELEGRAM_COALESCE = True  # Склеивать подряд идущие сообщения одному чату, накопившиеся в очереди
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Профилирование по команде /profile (доступна только администраторам): cpu - сэмплы стеков event loop
+# для flame graph, mem - крупнейшие места выделения памяти (tracemalloc). Выключенное ничего не стоит
+ADMIN_IDS = []  # Telegram id администраторов
+PROFILE_DIR = "data/profiles"  # Куда сохраняются результаты (они же приходят администратору файлами)
+PROFILE_DEFAULT_UPDATES = 200  # Сколько следующих обновлений профилировать, если число не указано
+PROFILE_MAX_SECONDS = 300  # Профилирование завершается не позже чем через столько секунд
+PROFILE_SAMPLE_INTERVAL = 0.005  # Интервал сэмплирования стека event loop (секунды)
+PROFILE_TOP_N = 30  # Сколько строк в таблицах функций и мест выделения памяти
+PROFILE_MEMORY_FRAMES = 10  # Глубина стека, которую tracemalloc запоминает для каждого выделения
+
+# Генерация вопросов
+FULL_ENT_CONCURRENCY = 5  # Сколько предметов пробного ЕНТ генерируется одновременно
+GENERATION_RETRIES = 2  # Повторные попытки генерации по одному предмету
+GENERATION_RETRY_DELAY = 1.0  # Базовая задержка между попытками (секунды)
+GENERATION_TOPUP_ATTEMPTS = 1  # Сколько раз догенерировать вопросы, отброшенные парсером
+GENERATION_STREAMING = True  # Отправлять первый вопрос, не дожидаясь генерации остальных
+GENERATION_MODEL = "gpt-4"
+GENERATION_COALESCING = True  # Одинаковые одновременные запросы (предмет, количество, модель) разделяют один вызов модели
+# "parallel" - по запросу на предмет параллельно (быстрее первый вопрос, есть потоковая выдача);
+# "batched" - несколько предметов одним запросом со структурированным JSON-ответом (меньше вызовов и
+# токенов промпта). Для "batched" нужна модель с поддержкой Structured Outputs (gpt-4o и новее)
+GENERATION_MODE = "parallel"
+GENERATION_BATCH_MAX_QUESTIONS = 60  # Максимум вопросов в одном пакетном запросе, остальные предметы идут следующими пакетами
+
+# Выбор модели для каждого запроса генерации. Без маршрутизации все запросы идут в GENERATION_MODEL
+GENERATION_ROUTING = True
+# Параметры моделей: сколько вопросов за запрос им доверять и поддерживают ли они Structured Outputs (для "batched")
+GENERATION_MODELS = {
+    "gpt-4o-mini": {"max_questions": 20, "structured_outputs": True},
+    "gpt-4o": {"max_questions": 60, "structured_outputs": True},
+    "gpt-4": {"max_questions": 60, "structured_outputs": False},
+}
+# Модели каждой полосы от дешевой к сильной; при неудаче запрос повторяется на следующей, более сильной
+GENERATION_TIER_MODELS = {
+    "free": ["gpt-4o-mini", "gpt-4o"],
+    "premium": ["gpt-4o", "gpt-4"],
+    "background": ["gpt-4o-mini", "gpt-4o"],
+}
+GENERATION_LATENCY_TARGETS = {"free": 2.0, "premium": 1.0, "background": 10.0}  # Допустимое время на один вопрос (секунды)
+GENERATION_MIN_YIELD = 0.8  # Модель с меньшей долей принятых парсером вопросов не выбирается
+GENERATION_ROUTER_EXPLORE = 0.05  # Доля запросов к случайной подходящей модели, чтобы обновлять ее статистику
+
+# HTTP-клиент OpenAI (общий пул соединений для всех обработчиков)
+OPENAI_CONNECT_TIMEOUT = 5.0  # Таймаут установки соединения (секунды)
+OPENAI_READ_TIMEOUT = 120.0  # Таймаут чтения ответа (секунды)
+OPENAI_MAX_CONNECTIONS = 100  # Максимум одновременных соединений
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20  # Сколько соединений держать открытыми между запросами
+OPENAI_KEEPALIVE_EXPIRY = 30.0  # Через сколько секунд простоя закрывать keep-alive соединение
+OPENAI_MAX_RETRIES = 2  # Повторы внутри клиента OpenAI (429, 5xx, сетевые ошибки)
+
+# Планировщик запросов к модели
+LLM_MAX_CONCURRENCY = 20  # Сколько запросов к модели выполняется одновременно
+LLM_TOKENS_PER_MINUTE = 90000  # Бюджет токенов в минуту (лимит TPM аккаунта OpenAI)
+LLM_PROMPT_TOKENS = 150  # Оценка токенов промпта для планирования
+LLM_TOKENS_PER_QUESTION = 120  # Оценка токенов одного сгенерированного вопроса
+LLM_LANE_WEIGHTS = {"premium": 4, "free": 2, "background": 1}  # Доли слотов: Premium, бесплатные, пополнение пула
+LLM_QUEUE_NOTICE = True  # Сообщать пользователю место в очереди, если запрос не начался сразу
+
+# Дедлайны, страховочные запросы и предохранитель вызовов модели
+LLM_DEADLINE_BASE = 20.0  # Дедлайн одного вызова модели без потока: базовая часть (секунды)
+LLM_DEADLINE_PER_QUESTION = 3.0  # ...плюс столько секунд на каждый запрошенный вопрос
+LLM_FIRST_CHUNK_DEADLINE = 20.0  # Дедлайн до первого фрагмента потокового ответа (секунды)
+LLM_HEDGING = True  # Если запрос идет дольше обычного, параллельно отправить второй такой же
+LLM_HEDGE_QUANTILE = 0.9  # "Дольше обычного" - дольше этого квантиля недавних длительностей
+LLM_HEDGE_MIN_DELAY = 1.0  # Второй запрос не раньше, чем через столько секунд
+LLM_HEDGE_BUDGET = 0.1  # Страховочных запросов не больше этой доли от обычных
+LLM_HEDGE_BURST = 3  # Запас страховочных запросов сверх доли (на всплеск задержек)
+LLM_BREAKER_FAILURES = 5  # После стольких ошибок подряд запросы к модели не отправляются...
+LLM_BREAKER_RESET = 30.0  # ...столько секунд, потом пробный запрос
+
+# Кэш ответов модели: одинаковый промпт и параметры запроса не отправляются в модель повторно
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "data/llm_cache.sqlite3"
+LLM_CACHE_TTL = 7 * 24 * 3600  # Сколько секунд сохраненный ответ можно выдавать
+LLM_CACHE_MEMORY_BYTES = 16 * 2 ** 20  # Бюджет LRU-кэша в памяти (байты ответов)
+LLM_CACHE_DISK_BYTES = 512 * 2 ** 20  # Бюджет кэша на диске, сверх него удаляются давно не запрашивавшиеся ответы
+LLM_CACHE_VARIANTS = 3  # Сколько разных ответов хранить на один запрос: пока их меньше, запрос идет в модель
+
+# Пул заранее сгенерированных вопросов
+QUESTION_POOL_ENABLED = True
+QUESTION_POOL_PATH = "data/question_pool.json"  # Файл, в котором пул сохраняется между перезапусками
+QUESTION_POOL_LOW_WATER = 20  # Ниже этого количества вопросов предмет ставится на пополнение
+QUESTION_POOL_TARGET = 60  # До скольких вопросов пополняется предмет
+QUESTION_POOL_BATCH_SIZE = 10  # Сколько вопросов запрашивать у модели за одно пополнение
+QUESTION_POOL_WORKERS = 2  # Количество фоновых воркеров пополнения
+QUESTION_POOL_STALL_BATCHES = 3  # После стольких пакетов подряд без новых вопросов пополнение предмета откладывается...
+QUESTION_POOL_STALL_BACKOFF = 300  # ...на столько секунд
+
+# Аналитика ответов по всем пользователям
+ANALYTICS_ENABLED = True
+ANALYTICS_ANSWERS_PATH = "data/answers.bin"  # Журнал ответов (20 байт на ответ)
+ANALYTICS_INTERVAL = 3600  # Как часто пересчитывать статистику вопросов (секунды)
+ANALYTICS_MIN_ANSWERS = 30  # С какого числа ответов статистике вопроса можно доверять
+ANALYTICS_MIN_DISCRIMINATION = 0.0  # Вопросы с меньшей различающей способностью не выдаются из пула (вероятно, неверный ключ)
+ANALYTICS_MIN_DIFFICULTY = 0.1  # Вопросы, на которые правильно отвечает меньшая доля, не выдаются из пула
+
+# Учет вопросов, которые пользователь уже видел
+SEEN_QUESTIONS_ENABLED = True
+SEEN_DB_PATH = "data/seen.sqlite3"  # Фильтры просмотренных вопросов по пользователям
+SEEN_FILTER_BITS = 65536  # Размер одного фильтра Блума (бит); на пользователя хранится не больше двух
+SEEN_FILTER_CAPACITY = 500  # После стольких вопросов фильтр сменяется новым, самые старые вопросы забываются
+SEEN_CACHE_USERS = 2000  # Сколько пользователей держать в памяти, остальные читаются из базы
+SEEN_FLUSH_INTERVAL = 2.0  # Как часто писать изменившиеся фильтры на диск (секунды)
+
+# Хранилище состояний FSM: "memory" (теряется при перезапуске) или "sqlite"
+FSM_STORAGE = "sqlite"
+FSM_SQLITE_PATH = "data/fsm.sqlite3"
+FSM_CACHE_SIZE = 10000  # Сколько сессий держать в памяти; давно не использовавшиеся вытесняются
+# Вытесненная из памяти сессия в "sqlite" остается на диске и читается при следующем обращении, в "memory" теряется
+# Бюджет на данные сессий в байтах pickle (сами объекты в памяти занимают в 2-3 раза больше); сверх него вытесняются давние
+FSM_MEMORY_BUDGET = 64 * 2 ** 20
+FSM_IDLE_TIMEOUT = 1800  # Через сколько секунд без обращений сессия вытесняется из памяти
+FSM_FLUSH_INTERVAL = 0.5  # Как часто сбрасывать накопленные изменения на диск (секунды)
+FSM_SESSION_TTL = 7 * 24 * 3600  # Через сколько секунд простоя сессия удаляется
+QUESTION_STORE_PATH = "data/questions.sqlite3"  # Общее хранилище текстов вопросов (в сессиях только их id)
+QUESTION_STORE_CACHE_SIZE = 20000  # Сколько последних использованных текстов вопросов держать в памяти
+
+# Статистика пользователей
+STATS_DB_PATH = "data/statistics.sqlite3"
+STATS_FLUSH_INTERVAL = 2.0  # Как часто писать накопленные изменения статистики на диск (секунды)
+STATS_RECENT_SCORES = 10  # Сколько последних результатов хранить по каждому предмету
+STATS_CACHE_USERS = 10000  # Сколько последних пользователей держать в памяти (остальные читаются из SQLite)
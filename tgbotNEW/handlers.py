@@ -1,10 +1,17 @@
-from aiogram import Dispatcher, types
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.filters import StateFilter
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
-from utils.openai_utils import generate_questions, generate_full_ent_questions
-from utils.statistics import user_statistics, can_generate_questions, increment_generation_counter
+from openai import AsyncOpenAI
+from utils.question_pool import QuestionPool
+from utils.question_store import get_question_store, get_answer, set_answer
+from utils.openai_utils import generate_questions, generate_full_ent_questions, get_chat_lock
+from utils.statistics import record_test_result, get_user_report
+from utils.filters import TextIn, FromUser
+from utils.profiling import get_profiler, CPU, MEMORY
+from config import ADMIN_IDS, PROFILE_DEFAULT_UPDATES
+from utils.question_analytics import record_answers
 from states import TestState
 from keyboards import (
     get_main_menu_keyboard,
@@ -13,15 +20,16 @@ from keyboards import (
     get_profile_subjects_keyboard_2,
     get_answer_keyboard,
     get_end_test_keyboard,
-    ReplyKeyboardBuilder, KeyboardButton
+    ReplyKeyboardBuilder, KeyboardButton,
+    ObligatorySubjectCallback, FirstProfileCallback, SecondProfileCallback,
+    BUTTON_OBLIGATORY, BUTTON_PROFILE, BUTTON_FULL_ENT, BUTTON_RESTART, BUTTON_MENU, BUTTON_STATS,
+    BUTTON_FINISH_FULL_ENT, ANSWER_OPTIONS
 )
 import logging
 logger = logging.getLogger(__name__)
 
-
-# Предметы (теперь могут быть определены здесь или в keyboards.py, в зависимости от использования)
-OBLIGATORY_SUBJECTS = ["Мат. грамотность", "История Казахстана", "Грамотность чтения"]
-PROFILE_SUBJECTS = ["Математика", "Физика", "География", "Информатика", "Биология", "Химия", "Иностранный язык", "Основы права", "Творческий экзамен"]
+# Ответ принимается в любом регистре, как и раньше; проверка - поиск в множестве
+ANSWER_TEXTS = frozenset(ANSWER_OPTIONS) | frozenset(option.lower() for option in ANSWER_OPTIONS)
 
 
 async def cmd_start(message: types.Message, state: FSMContext) -> None:
@@ -62,16 +70,18 @@ async def handle_obligatory_subjects(message: types.Message, state: FSMContext)
     await state.update_data(test_type="obligatory")
 
 
-async def handle_select_obligatory(callback: types.CallbackQuery, state: FSMContext) -> None:
-    subject = callback.data.split(":")[1]
+async def handle_select_obligatory(callback: types.CallbackQuery, callback_data: ObligatorySubjectCallback,
+                                   state: FSMContext, openai_client: AsyncOpenAI = None,
+                                   question_pool: QuestionPool = None) -> None:
+    subject = callback_data.subject
     await callback.answer(f"Выбран обязательный предмет: {subject}", show_alert=False)
     await state.update_data(subject=subject)
     await callback.message.edit_text(f"Выбран обязательный предмет: {subject}\n⏳ Начинаем генерацию вопросов...")
-    # Предполагается, что объект 'client' (OpenAI) доступен через state или dp
-    client = state.bot['openai_client']
+    # Клиент OpenAI передается aiogram из dp['openai_client']
+    client = openai_client
     user_id = callback.from_user.id
     if client:
-        await generate_questions(client, user_id, state, subject=subject)
+        await generate_questions(client, callback.bot, user_id, state, subject=subject, question_pool=question_pool)
     else:
         await callback.message.answer("⚠️ Ошибка: Клиент OpenAI не инициализирован.")
 
@@ -83,8 +93,9 @@ async def handle_profile_subjects(message: types.Message, state: FSMContext) ->
     await state.update_data(test_type="profile")
 
 
-async def handle_select_profile_1(callback: types.CallbackQuery, state: FSMContext) -> None:
-    subject_1 = callback.data.split(":")[1]
+async def handle_select_profile_1(callback: types.CallbackQuery, callback_data: FirstProfileCallback,
+                                  state: FSMContext) -> None:
+    subject_1 = callback_data.subject
     await callback.answer(f"Выбран первый профильный предмет: {subject_1}", show_alert=False)
     await state.update_data(profile_subject_1=subject_1, selected_profile_subjects=[subject_1])
     await callback.message.edit_text(f"Выбран первый профильный предмет: {subject_1}\nВыберите второй профильный предмет:")
@@ -92,19 +103,24 @@ async def handle_select_profile_1(callback: types.CallbackQuery, state: FSMConte
     await state.set_state(TestState.profile_subject_2)
 
 
-async def handle_select_profile_2(callback: types.CallbackQuery, state: FSMContext) -> None:
-    subject_2 = callback.data.split(":")[1]
+async def handle_select_profile_2(callback: types.CallbackQuery, callback_data: SecondProfileCallback,
+                                  state: FSMContext, openai_client: AsyncOpenAI = None,
+                                  question_pool: QuestionPool = None) -> None:
+    subject_2 = callback_data.subject
     data = await state.get_data()
     subject_1 = data.get("profile_subject_1")
     if subject_1 and subject_2 != subject_1:
         await callback.answer(f"Выбраны профильные предметы: {subject_1} и {subject_2}", show_alert=False)
         await state.update_data(profile_subject_2=subject_2, selected_profile_subjects=[subject_1, subject_2])
+        # Ответы на вопросы одиночного теста handle_answer принимает в состоянии TestState.subject
+        await state.set_state(TestState.subject)
         await callback.message.edit_text(
             f"Выбраны профильные предметы: {subject_1} и {subject_2}\n⏳ Начинаем генерацию вопросов...")
-        client = state.bot['openai_client'] # Исправленная строка
+        client = openai_client
         user_id = callback.from_user.id
         if client:
-            await generate_questions(client, user_id, state, subject_1=subject_1, subject_2=subject_2)
+            await generate_questions(client, callback.bot, user_id, state, subject_1=subject_1, subject_2=subject_2,
+                                     question_pool=question_pool)
         else:
             await callback.message.answer("⚠️ Ошибка: Клиент OpenAI не инициализирован.")
     elif not subject_1:
@@ -114,32 +130,43 @@ async def handle_select_profile_2(callback: types.CallbackQuery, state: FSMConte
 
 
 async def handle_answer(message: types.Message, state: FSMContext) -> None:
+    """Ответ на вопрос теста по обязательным или профильным предметам (состояние TestState.subject)"""
     user_answer = message.text.upper()
-    current_state = await state.get_state()
     data = await state.get_data()
+    if data.get("waiting_for_question"):
+        await message.answer("⏳ Следующий вопрос ещё генерируется, подождите немного.")
+    elif data.get("question_ids"):
+        await state.update_data(answers=data.get("answers", "") + user_answer)
+        await send_next_question(message.bot, state, message.from_user.id)
+    else:
+        await message.answer("Пожалуйста, выберите предмет и начните тест.")
 
-    if current_state == TestState.full_ent_process:
-        current_subject = data.get("full_ent_current_subject")
-        current_question_index = data.get("full_ent_current_question_index", 1) - 1 # Adjust index to match the question number
-        if current_subject and data.get("full_ent_questions", {}).get(current_subject) and current_question_index < len(data["full_ent_questions"][current_subject]):
-            user_answers = data.get("full_ent_user_answers", {})
-            if current_subject not in user_answers:
-                user_answers[current_subject] = {}
-            user_answers[current_subject][current_question_index] = user_answer
-            await state.update_data(full_ent_user_answers=user_answers)
-            await send_next_full_ent_question(message, state) # Эта функция должна быть реализована здесь
-        else:
-            await message.answer("⚠️ Произошла ошибка при обработке вашего ответа.")
-    elif current_state == TestState.subject: # Handle answers for obligatory/profile subjects (single test)
-        if "all_questions" in data and data["all_questions"]:
-            answers = data.get("answers", [])
-            answers.append(user_answer)
-            await state.update_data(answers=answers)
-            await send_next_question(message, state) # Эта функция должна быть реализована здесь
-        else:
-            await message.answer("Пожалуйста, выберите предмет и начните тест.")
+
+async def handle_full_ent_answer(message: types.Message, state: FSMContext) -> None:
+    """Ответ на вопрос пробного ЕНТ (состояние TestState.full_ent_process)"""
+    user_answer = message.text.upper()
+    data = await state.get_data()
+    current_subject = data.get("full_ent_current_subject")
+    current_question_index = data.get("full_ent_current_question_index", 1) - 1 # Adjust index to match the question number
+    if data.get("full_ent_waiting"):
+        await message.answer("⏳ Следующий вопрос ещё генерируется, подождите немного.")
+    elif current_subject and data.get("full_ent_question_ids", {}).get(current_subject) and current_question_index < len(data["full_ent_question_ids"][current_subject]):
+        # Ответы по предмету хранятся упакованной строкой: символ i - ответ на вопрос i
+        user_answers = dict(data.get("full_ent_user_answers", {}))
+        user_answers[current_subject] = set_answer(user_answers.get(current_subject, ""), current_question_index, user_answer)
+        await state.update_data(full_ent_user_answers=user_answers)
+        await send_next_full_ent_question(message.bot, state, message.from_user.id)
     else:
-        await message.answer("Пожалуйста, выберите раздел для начала тестирования.")
+        await message.answer("⚠️ Произошла ошибка при обработке вашего ответа.")
+
+
+async def handle_answer_without_test(message: types.Message) -> None:
+    await message.answer("Пожалуйста, выберите раздел для начала тестирования.")
+
+
+async def handle_stale_callback(callback: types.CallbackQuery) -> None:
+    """Нажатие кнопки из старого сообщения, не подходящей к текущему шагу"""
+    await callback.answer("Эта кнопка уже неактуальна. Выберите раздел в меню заново.", show_alert=True)
 
 
 async def handle_restart_test(message: types.Message, state: FSMContext) -> None:
@@ -153,16 +180,16 @@ async def handle_menu(message: types.Message, state: FSMContext) -> None:
 
 async def cmd_stats(message: types.Message, state: FSMContext) -> None:
     user_id = message.from_user.id
-    if user_id in user_statistics:
-        stats = user_statistics[user_id]
+    stats = await get_user_report(user_id)
+    if stats and stats.tests_passed:
         report = f"📊 <b>Ваша статистика:</b>\n"
-        report += f"Всего пройдено тестов: {stats.get('tests_passed', 0)}\n\n"
-        if "scores" in stats and stats["scores"]:
+        report += f"Всего пройдено тестов: {stats.tests_passed}\n\n"
+        if stats.subjects:
             report += "<b>Средний балл по предметам:</b>\n"
-            for subject, scores in stats["scores"].items():
-                if scores:
-                    average_score = sum(scores) / len(scores)
-                    report += f"  - {subject}: {average_score:.2f}%\n"
+            for subject, aggregate in stats.subjects.items():
+                if aggregate.count:
+                    report += (f"  - {subject}: {aggregate.average:.2f}% "
+                               f"(тестов: {aggregate.count}, мин. {aggregate.min:.0f}%, макс. {aggregate.max:.0f}%)\n")
                 else:
                     report += f"  - {subject}: Тесты еще не пройдены.\n"
         else:
@@ -173,20 +200,22 @@ async def cmd_stats(message: types.Message, state: FSMContext) -> None:
 
 async def handle_start_full_ent(message: types.Message, state: FSMContext) -> None:
     await message.answer("Выберите первый профильный предмет для пробного ЕНТ:", reply_markup=await get_profile_subjects_keyboard_1())
-    await state.set_state(TestState.profile_subject_1_full)
+    await state.set_state(TestState.full_ent_profile_subject_1)
     await state.update_data(full_ent_subjects={})
 
-async def handle_select_profile_1_full(callback: types.CallbackQuery, state: FSMContext) -> None:
-    subject_1 = callback.data.split(":")[1]
+async def handle_select_profile_1_full(callback: types.CallbackQuery, callback_data: FirstProfileCallback,
+                                       state: FSMContext) -> None:
+    subject_1 = callback_data.subject
     await callback.answer(f"Выбран первый профильный предмет: {subject_1}", show_alert=False)
     await state.update_data(full_ent_subjects={"profile1": subject_1})
     await callback.message.edit_text(
         f"Выбран первый профильный предмет: {subject_1}\nВыберите второй профильный предмет для пробного ЕНТ:")
     await callback.message.edit_reply_markup(reply_markup=await get_profile_subjects_keyboard_2(subject_1))
-    await state.set_state(TestState.profile_subject_2_full)
+    await state.set_state(TestState.full_ent_profile_subject_2)
 
-async def handle_select_profile_2_full(callback: types.CallbackQuery, state: FSMContext) -> None:
-    subject_2 = callback.data.split(":")[1]
+async def handle_select_profile_2_full(callback: types.CallbackQuery, callback_data: SecondProfileCallback,
+                                       state: FSMContext, openai_client: AsyncOpenAI = None) -> None:
+    subject_2 = callback_data.subject
     data = await state.get_data()
     subject_1 = data.get("full_ent_subjects", {}).get("profile1")
     if subject_1 and subject_2 != subject_1:
@@ -194,10 +223,10 @@ async def handle_select_profile_2_full(callback: types.CallbackQuery, state: FSM
         await state.update_data(full_ent_subjects={"profile1": subject_1, "profile2": subject_2})
         await callback.message.edit_text(
             f"Выбраны профильные предметы: {subject_1} и {subject_2}\n⏳ Начинаем генерацию вопросов для пробного ЕНТ...")
-        client = state.bot.get('openai_client')
+        client = openai_client
         user_id = callback.from_user.id
         if client:
-            await generate_full_ent_questions(client, user_id, state, subject_1=subject_1, subject_2=subject_2)
+            await generate_full_ent_questions(client, callback.bot, user_id, state, subject_1=subject_1, subject_2=subject_2)
         else:
             await callback.message.answer("⚠️ Ошибка: Клиент OpenAI не инициализирован.")
     elif not subject_1:
@@ -215,78 +244,95 @@ async def handle_full_ent_start_subject(message: types.Message, state: FSMContex
         data.get("full_ent_subjects", {}).get("profile1"): "profile1",
         data.get("full_ent_subjects", {}).get("profile2"): "profile2",
     }
-    subject_key = next((key for name, key in subjects_map.items() if name == chosen_subject), None)
+    subject_key = subjects_map.get(chosen_subject) if chosen_subject else None
 
-    if subject_key and data.get("full_ent_questions") and data.get("full_ent_questions").get(subject_key):
+    # При потоковой генерации предмет можно выбрать, пока его вопросы еще приходят
+    subject_available = bool(data.get("full_ent_question_ids", {}).get(subject_key)) or subject_key in data.get("full_ent_generation_pending", [])
+    subject_finished = subject_key in data.get("full_ent_user_answers", {})
+    if subject_key and subject_available and not subject_finished:
         await state.update_data(full_ent_current_subject=subject_key)
         await state.update_data(full_ent_current_question_index=0)
         await state.set_state(TestState.full_ent_process)
-        await send_next_full_ent_question(message, state) # Реализовать здесь
+        await send_next_full_ent_question(message.bot, state, message.from_user.id)
     else:
         await message.answer("⚠️ Пожалуйста, выберите предмет из предложенной клавиатуры.")
 
-    async def is_full_ent_start_subject(message: types.Message, state: FSMContext) -> bool:
-        if await state.get_state() == TestState.full_ent_start_subject:
-            data = await state.get_data()
-            profile_subject_1 = data.get("full_ent_subjects", {}).get("profile1")
-            profile_subject_2 = data.get("full_ent_subjects", {}).get("profile2")
-            valid_texts = ["История Казахстана", "Математическая грамотность", "Грамотность чтения"]
-            if profile_subject_1:
-                valid_texts.append(profile_subject_1)
-            if profile_subject_2:
-                valid_texts.append(profile_subject_2)
-            return message.text in valid_texts
-        return False
-
-async def send_next_question(message: Message, state: FSMContext, generated_subjects: list = None) -> None:
+
+async def handle_finish_full_ent(message: types.Message, state: FSMContext) -> None:
+    await process_full_ent_results(message.bot, state, message.from_user.id)
+
+async def send_next_question(bot: Bot, state: FSMContext, user_id: int, generated_subjects: list = None) -> None:
     data = await state.get_data()
     current_question_index = data.get("current_question_index", 0)
     current_subject_index = data.get("current_subject_index", 0)
-    all_questions = data.get("all_questions", [])
+    all_questions = data.get("question_ids", [])
     selected_profile_subjects = data.get("selected_profile_subjects", [])
     subject = data.get("subject")  # Для обязательных предметов
 
     subjects_list_for_display = generated_subjects if generated_subjects else (selected_profile_subjects if selected_profile_subjects else [subject] if subject else [])
 
+    generation_pending = data.get("generation_pending", [])
+    expected_questions = data.get("expected_questions", [])
+
     if current_subject_index < len(all_questions):
         current_subject_questions = all_questions[current_subject_index]
+        subject_pending = current_subject_index < len(generation_pending) and generation_pending[current_subject_index]
         if current_question_index < len(current_subject_questions):
-            question = current_subject_questions[current_question_index]
+            question = await get_question_store().get(current_subject_questions[current_question_index])
+            total_questions = expected_questions[current_subject_index] if subject_pending else len(current_subject_questions)
             subject_name = ""
             if current_subject_index < len(subjects_list_for_display):
                 subject_name = subjects_list_for_display[current_subject_index]
             elif subject:
                 subject_name = subject
 
-            await message.answer(
-                f"<b>Предмет: {subject_name}</b>\n<b>Вопрос {current_question_index + 1}/{len(current_subject_questions)}:</b>\n{question}",
+            await bot.send_message(
+                user_id,
+                f"<b>Предмет: {subject_name}</b>\n<b>Вопрос {current_question_index + 1}/{total_questions}:</b>\n{question}",
                 reply_markup=await get_answer_keyboard()
             )
             await state.update_data(current_question_index=current_question_index + 1)
+        elif subject_pending:
+            # Вопрос еще генерируется: фоновая задача отправит его, как только он придет
+            async with get_chat_lock(user_id):
+                data = await state.get_data()
+                question_arrived = current_question_index < len(data["question_ids"][current_subject_index])
+                still_pending = data["generation_pending"][current_subject_index]
+                if not question_arrived and still_pending:
+                    await state.update_data(waiting_for_question=True)
+            if question_arrived or not still_pending:
+                await send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
+            elif current_question_index > 0:
+                await bot.send_message(user_id, "⏳ Следующий вопрос ещё генерируется...")
         else:
             await state.update_data(current_subject_index=current_subject_index + 1, current_question_index=0)
-            await send_next_question(message, state, generated_subjects=generated_subjects)
+            await send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
     else:
-        await process_test_results(message, state, generated_subjects=generated_subjects)
+        await process_test_results(bot, state, user_id, generated_subjects=generated_subjects)
 
-async def process_test_results(message: Message, state: FSMContext, generated_subjects: list = None) -> None:
+async def process_test_results(bot: Bot, state: FSMContext, user_id: int, generated_subjects: list = None) -> None:
     data = await state.get_data()
-    all_correct_answers = data.get("all_correct_answers", [])
-    answers = data.get("answers", [])
+    all_correct_answers = data.get("answer_keys", [])
+    answers = data.get("answers", "")
     selected_profile_subjects = data.get("selected_profile_subjects", [])
     test_type = data.get("test_type")
     results_text = "<b>🎉 Результаты теста! 🎉</b>\n\n"
     total_correct = 0
     total_questions = 0
     answer_index = 0
+    subject_scores = {}
 
     subjects_list_for_display = generated_subjects if generated_subjects else selected_profile_subjects if selected_profile_subjects else [data.get("subject")] if data.get("subject") else []
+    question_ids = data.get("question_ids", [])
 
     for i, correct_answers_subject in enumerate(all_correct_answers):
         subject_correct_count = 0
         subject_total_questions = len(correct_answers_subject)
         total_questions += subject_total_questions
         subject_name = subjects_list_for_display[i] if i < len(subjects_list_for_display) else f"Предмет {i+1}"
+        # Ответы по каждому вопросу сохраняются для общей аналитики вопросов
+        record_answers(subject_name, question_ids[i] if i < len(question_ids) else [], correct_answers_subject,
+                       answers[answer_index:answer_index + subject_total_questions])
         results_text += f"<b>Предмет: {subject_name}</b>\n"
         for correct_answer in correct_answers_subject:
             user_answer = answers[answer_index].upper() if answer_index < len(answers) else ""
@@ -301,38 +347,19 @@ async def process_test_results(message: Message, state: FSMContext, generated_su
         percentage = (subject_correct_count / subject_total_questions) * 100 if subject_total_questions > 0 else 0
         results_text += f"Итого по предмету {subject_name}: {subject_correct_count}/{subject_total_questions} ({percentage:.2f}%)\n\n"
 
-        # Обновление статистики для каждого предмета
-        user_id = message.from_user.id
-        if user_id not in user_statistics:
-            user_statistics[user_id] = {"tests_passed": 0, "scores": {}}
-        if subject_name not in user_statistics[user_id]["scores"]:
-            user_statistics[user_id]["scores"][subject_name] = []
-        user_statistics[user_id]["scores"][subject_name].append(percentage)
+        subject_scores[subject_name] = percentage
 
     overall_percentage = (total_correct / total_questions) * 100 if total_questions > 0 else 0
     results_text += f"\n<b>Общий итог:</b> {total_correct}/{total_questions} ({overall_percentage:.2f}%)\n"
 
-    await message.answer(results_text, reply_markup=await get_end_test_keyboard())
-    user_statistics[user_id]["tests_passed"] = user_statistics[user_id].get("tests_passed", 0) + 1
-    logger.info(f"Статистика пользователя {user_id}: {user_statistics[user_id]}")
+    await bot.send_message(user_id, results_text, reply_markup=await get_end_test_keyboard())
+    await record_test_result(user_id, subject_scores)
 
-async def cmd_premium(message: types.Message, state: FSMContext) -> None:
-    premium_info = (
-        "🚀 <b>Premium подписка для подготовки к ЕНТ</b> 💎\n\n"
-        "Оформите Premium и получите неограниченный доступ к генерации вопросов и увеличьте количество вопросов за тест до 10!\n\n"
-        "Способы подключения (в разработке):\n"
-        "    - ...\n"
-        "    - ...\n\n"
-        "Следите за обновлениями!"
-    )
-    await message.answer(premium_info, parse_mode="HTML")
-
-
-async def send_next_full_ent_question(message: Message, state: FSMContext) -> None:
+async def send_next_full_ent_question(bot: Bot, state: FSMContext, user_id: int) -> None:
     data = await state.get_data()
     current_subject = data.get("full_ent_current_subject")
     current_question_index = data.get("full_ent_current_question_index", 0)
-    all_questions = data.get("full_ent_questions", {})
+    all_questions = data.get("full_ent_question_ids", {})
     subjects_map = {
         "history": "История Казахстана",
         "math_literacy": "Математическая грамотность",
@@ -343,22 +370,59 @@ async def send_next_full_ent_question(message: Message, state: FSMContext) -> No
 
     if current_subject and current_subject in all_questions:
         questions = all_questions[current_subject]
+        subject_pending = current_subject in data.get("full_ent_generation_pending", [])
         if current_question_index < len(questions):
-            question = questions[current_question_index]
+            question = await get_question_store().get(questions[current_question_index])
             subject_name = subjects_map.get(current_subject, "Неизвестный предмет")
-            await message.answer(
-                f"<b>Предмет: {subject_name}</b>\n<b>Вопрос {current_question_index + 1}/{len(questions)}:</b>\n{question}",
+            total_questions = data.get("full_ent_expected", {}).get(current_subject, len(questions)) if subject_pending else len(questions)
+            await bot.send_message(
+                user_id,
+                f"<b>Предмет: {subject_name}</b>\n<b>Вопрос {current_question_index + 1}/{total_questions}:</b>\n{question}",
                 reply_markup=await get_answer_keyboard(),
             )
             await state.update_data(full_ent_current_question_index=current_question_index + 1)
+        elif subject_pending:
+            # Вопрос еще генерируется: фоновая задача отправит его, как только он придет
+            async with get_chat_lock(user_id):
+                data = await state.get_data()
+                question_arrived = current_question_index < len(data["full_ent_question_ids"][current_subject])
+                still_pending = current_subject in data.get("full_ent_generation_pending", [])
+                if not question_arrived and still_pending:
+                    await state.update_data(full_ent_waiting=True)
+            if question_arrived or not still_pending:
+                await send_next_full_ent_question(bot, state, user_id)
+            else:
+                await bot.send_message(user_id, "⏳ Вопросы по предмету ещё генерируются...")
         else:
             # Вопросы по текущему предмету закончились, предлагаем выбрать следующий
             await state.update_data(full_ent_current_question_index=0)
-            await send_full_ent_next_subject_choice(message, state)
+            await send_full_ent_next_subject_choice(bot, state, user_id)
     else:
-        await message.answer("⚠️ Произошла ошибка при получении следующего вопроса.")
+        await bot.send_message(user_id, "⚠️ Произошла ошибка при получении следующего вопроса.")
 
-async def send_full_ent_next_subject_choice(message: Message, state: FSMContext) -> None:
+async def send_full_ent_start_subject_choice(bot: Bot, state: FSMContext, user_id: int) -> None:
+    data = await state.get_data()
+    full_ent_questions = data.get("full_ent_question_ids", {})
+    pending = data.get("full_ent_generation_pending", [])
+    available_subjects = {
+        "history": "История Казахстана",
+        "math_literacy": "Математическая грамотность",
+        "reading_literacy": "Грамотность чтения",
+        "profile1": data.get("full_ent_subjects", {}).get("profile1"),
+        "profile2": data.get("full_ent_subjects", {}).get("profile2"),
+    }
+    keyboard_builder = ReplyKeyboardBuilder()
+    for key, name in available_subjects.items():
+        if name and (full_ent_questions.get(key) or key in pending):
+            keyboard_builder.button(text=name)
+    keyboard_builder.adjust(2)
+    await bot.send_message(
+        user_id,
+        "Выберите предмет, с которого начнете пробный ЕНТ:",
+        reply_markup=keyboard_builder.as_markup(resize_keyboard=True, one_time_keyboard=True),
+    )
+
+async def send_full_ent_next_subject_choice(bot: Bot, state: FSMContext, user_id: int) -> None:
     data = await state.get_data()
     finished_subjects = data.get("full_ent_user_answers", {}).keys()
     available_subjects = {
@@ -376,19 +440,21 @@ async def send_full_ent_next_subject_choice(message: Message, state: FSMContext)
         for key, name in remaining_subjects.items():
             keyboard_builder.button(text=name)
         keyboard_builder.adjust(2)
-        await message.answer(
+        await bot.send_message(
+            user_id,
             "Тестирование по текущему предмету завершено. Выберите следующий предмет или нажмите 'Завершить пробный ЕНТ'.",
             reply_markup=keyboard_builder.row(KeyboardButton(text="Завершить пробный ЕНТ")).as_markup(
                 resize_keyboard=True, one_time_keyboard=True),
         )
-        await state.set_state(TestState.full_ent_process)  # Stay in the process state for choosing next subject
+        await state.set_state(TestState.full_ent_start_subject)  # Следующий предмет выбирается так же, как первый
     else:
-        await process_full_ent_results(message, state)
+        await process_full_ent_results(bot, state, user_id)
 
-async def process_full_ent_results(message: Message, state: FSMContext) -> None:
+async def process_full_ent_results(bot: Bot, state: FSMContext, user_id: int) -> None:
     data = await state.get_data()
-    all_correct_answers = data.get("full_ent_correct_answers", {})
+    all_correct_answers = data.get("full_ent_answer_keys", {})
     user_answers = data.get("full_ent_user_answers", {})
+    question_ids = data.get("full_ent_question_ids", {})
     subjects_map = {
         "history": "История Казахстана",
         "math_literacy": "Математическая грамотность",
@@ -403,7 +469,8 @@ async def process_full_ent_results(message: Message, state: FSMContext) -> None:
 
     for subject_key, correct_answers in all_correct_answers.items():
         subject_name = subjects_map.get(subject_key, "Неизвестный предмет")
-        user_subject_answers = user_answers.get(subject_key, {})
+        user_subject_answers = user_answers.get(subject_key, "")
+        record_answers(subject_name, question_ids.get(subject_key, []), correct_answers, user_subject_answers)
         correct_count = 0
         questions_count = num_questions.get(subject_key, 0)
         total_questions += questions_count
@@ -411,7 +478,7 @@ async def process_full_ent_results(message: Message, state: FSMContext) -> None:
         results_text += f"<b>{subject_name}:</b>\n"
         for i in range(questions_count):
             correct_answer = correct_answers[i] if i < len(correct_answers) else None
-            user_answer = user_subject_answers.get(i)
+            user_answer = get_answer(user_subject_answers, i)
             if correct_answer and user_answer == correct_answer:
                 correct_count += 1
                 total_correct += 1
@@ -427,8 +494,8 @@ async def process_full_ent_results(message: Message, state: FSMContext) -> None:
     overall_score = (total_correct / total_questions) * 100 if total_questions > 0 else 0
     results_text += f"\n<b>Общий результат: {total_correct}/{total_questions} ({overall_score:.2f}%)</b>\n"
 
-    await message.answer(results_text, reply_markup=await get_end_test_keyboard(), parse_mode="HTML")
-    await state.set_data({})  # Clear state after the test
+    await bot.send_message(user_id, results_text, reply_markup=await get_end_test_keyboard(), parse_mode="HTML")
+    await state.clear()  # Пробный ЕНТ завершен: сбрасываем и данные, и состояние
 
 async def cmd_premium(message: types.Message, state: FSMContext) -> None:
     premium_info = (
@@ -441,20 +508,104 @@ async def cmd_premium(message: types.Message, state: FSMContext) -> None:
     )
     await message.answer(premium_info, parse_mode="HTML")
 
+PROFILE_USAGE = (
+    "/profile cpu [N] - сэмплы стеков для flame graph за следующие N обновлений\n"
+    "/profile mem [N] - крупнейшие места выделения памяти за следующие N обновлений\n"
+    "/profile all [N] - и то и другое\n"
+    "/profile stop - завершить сейчас и получить результаты\n"
+    "/profile - состояние"
+)
+PROFILE_KINDS = {"cpu": (CPU,), "mem": (MEMORY,), "all": (CPU, MEMORY)}
+
+
+async def cmd_profile(message: types.Message, command: CommandObject, dispatcher: Dispatcher, bot: Bot) -> None:
+    """Профилирование следующих обновлений по команде администратора, результаты приходят файлами"""
+    profiler = get_profiler()
+    args = (command.args or "").split()
+    if not args:
+        await message.answer(f"{profiler.status()}\n\n{PROFILE_USAGE}", parse_mode=None)
+        return
+    if args[0] == "stop":
+        if not await profiler.finish():
+            await message.answer("Профилирование не запущено")
+        return
+    kinds = PROFILE_KINDS.get(args[0])
+    if kinds is None or (len(args) > 1 and not args[1].isdigit()):
+        await message.answer(PROFILE_USAGE, parse_mode=None)
+        return
+    updates = int(args[1]) if len(args) > 1 else PROFILE_DEFAULT_UPDATES
+    if not profiler.start(dispatcher, bot, message.chat.id, kinds, max(updates, 1)):
+        await message.answer(f"Уже идет. {profiler.status()}")
+        return
+    await message.answer(f"Профилирую следующие {max(updates, 1)} обновлений, результаты придут файлами")
+
+# Кнопки меню работают в любом состоянии: текст кнопки -> обработчик
+MENU_BUTTONS = {
+    BUTTON_OBLIGATORY: handle_obligatory_subjects,
+    BUTTON_PROFILE: handle_profile_subjects,
+    BUTTON_FULL_ENT: handle_start_full_ent,
+    BUTTON_RESTART: handle_restart_test,
+    BUTTON_MENU: handle_menu,
+    BUTTON_STATS: cmd_stats,
+}
+
+# Все фильтры ниже асинхронные (Filter): синхронные lambda и F-фильтры aiogram проверяет через поток
+TEST_STATES = (TestState.subject, TestState.profile_subject_1, TestState.profile_subject_2)
+FULL_ENT_STATES = (TestState.full_ent_profile_subject_1, TestState.full_ent_profile_subject_2,
+                   TestState.full_ent_start_subject, TestState.full_ent_process)
+
+
+def _build_menu_router() -> Router:
+    """Команды и кнопки меню"""
+    router = Router(name="menu")
+    router.message.register(cmd_start, Command(commands=["start"]))
+    router.message.register(cmd_help, Command(commands=["help"]))
+    router.message.register(cmd_premium, Command(commands=["premium"]))
+    router.message.register(cmd_profile, Command(commands=["profile"]), FromUser(*ADMIN_IDS))
+    for text, handler in MENU_BUTTONS.items():
+        router.message.register(handler, TextIn(text))
+    return router
+
+
+def _build_test_router() -> Router:
+    """Тест по обязательным и профильным предметам"""
+    router = Router(name="test")
+    # Апдейты в других состояниях пропускают роутер после одной проверки состояния
+    router.message.filter(StateFilter(*TEST_STATES))
+    router.callback_query.filter(StateFilter(*TEST_STATES))
+    router.callback_query.register(handle_select_obligatory, ObligatorySubjectCallback.filter(),
+                                   StateFilter(TestState.subject))
+    router.callback_query.register(handle_select_profile_1, FirstProfileCallback.filter(),
+                                   StateFilter(TestState.profile_subject_1))
+    router.callback_query.register(handle_select_profile_2, SecondProfileCallback.filter(),
+                                   StateFilter(TestState.profile_subject_2))
+    router.message.register(handle_answer, TextIn(*ANSWER_TEXTS), StateFilter(TestState.subject))
+    return router
+
+
+def _build_full_ent_router() -> Router:
+    """Пробный ЕНТ: те же кнопки выбора профильных предметов, но в своих состояниях"""
+    router = Router(name="full_ent")
+    router.message.filter(StateFilter(*FULL_ENT_STATES))
+    router.callback_query.filter(StateFilter(*FULL_ENT_STATES))
+    router.callback_query.register(handle_select_profile_1_full, FirstProfileCallback.filter(),
+                                   StateFilter(TestState.full_ent_profile_subject_1))
+    router.callback_query.register(handle_select_profile_2_full, SecondProfileCallback.filter(),
+                                   StateFilter(TestState.full_ent_profile_subject_2))
+    router.message.register(handle_full_ent_answer, TextIn(*ANSWER_TEXTS), StateFilter(TestState.full_ent_process))
+    router.message.register(handle_finish_full_ent, TextIn(BUTTON_FINISH_FULL_ENT),
+                            StateFilter(TestState.full_ent_start_subject))
+    router.message.register(handle_full_ent_start_subject, StateFilter(TestState.full_ent_start_subject))
+    return router
+
+
+def _build_fallback_router() -> Router:
+    router = Router(name="fallback")
+    router.message.register(handle_answer_without_test, TextIn(*ANSWER_TEXTS))
+    router.callback_query.register(handle_stale_callback)
+    return router
+
+
 def register_handlers(dp: Dispatcher):
-    dp.message.register(cmd_start, Command(commands=["start"]))
-    dp.message.register(cmd_help, Command(commands=["help"]))
-    dp.message.register(cmd_premium, Command(commands=["premium"]))
-    dp.message.register(handle_obligatory_subjects, lambda message: message.text == "📖 Обязательные предметы")
-    dp.callback_query.register(handle_select_obligatory, lambda callback: callback.data.startswith("obligatory:"))
-    dp.message.register(handle_profile_subjects, lambda message: message.text == "🧪 Профильные предметы")
-    dp.callback_query.register(handle_select_profile_1, lambda callback: callback.data.startswith("profile1:"))
-    dp.callback_query.register(handle_select_profile_2, lambda callback: callback.data.startswith("profile2:"))
-    dp.message.register(handle_answer, lambda message: message.text.upper() in ("A", "B", "C", "D"))
-    dp.message.register(handle_restart_test, lambda message: message.text == "🔄 Пройти ещё раз")
-    dp.message.register(handle_menu, lambda message: message.text == "☰ Меню")
-    dp.message.register(cmd_stats, lambda message: message.text == "📊 Статистика")
-    dp.message.register(handle_start_full_ent, lambda message: message.text == "🧪 Пробный ЕНТ")
-    dp.callback_query.register(handle_select_profile_1_full, lambda callback: callback.data.startswith("profile1:"))
-    dp.callback_query.register(handle_select_profile_2_full, lambda callback: callback.data.startswith("profile2:"))
-    dp.message.register(handle_full_ent_start_subject, lambda message: message.text.in_(["История Казахстана", "Математическая грамотность", "Грамотность чтения"] + PROFILE_SUBJECTS), StateFilter(TestState.full_ent_start_subject))
\ No newline at end of file
+    # Роутеры проверяются по порядку: меню работает в любом состоянии, дальше - роутеры сценариев
+    dp.include_routers(_build_menu_router(), _build_test_router(), _build_full_ent_router(), _build_fallback_router())
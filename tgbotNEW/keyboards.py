@@ -1,3 +1,4 @@
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
@@ -5,12 +6,34 @@ OBLIGATORY_SUBJECTS = ["Математическая грамотность", "
 PROFILE_SUBJECTS = ["Математика", "Физика", "География", "Информатика", "Биология", "Химия", "Иностранный язык",
                     "Основы права", "Творческий экзамен"]
 
+# Тексты кнопок reply-клавиатур: обработчики ищут их по точному совпадению
+BUTTON_OBLIGATORY = "📖 Обязательные предметы"
+BUTTON_PROFILE = "🧪 Профильные предметы"
+BUTTON_FULL_ENT = "🧪 Пробный ЕНТ"
+BUTTON_RESTART = "🔄 Пройти ещё раз"
+BUTTON_MENU = "☰ Меню"
+BUTTON_STATS = "📊 Статистика"
+BUTTON_FINISH_FULL_ENT = "Завершить пробный ЕНТ"
+ANSWER_OPTIONS = ("A", "B", "C", "D")
+
+
+class ObligatorySubjectCallback(CallbackData, prefix="obligatory"):
+    subject: str
+
+
+class FirstProfileCallback(CallbackData, prefix="profile1"):
+    subject: str
+
+
+class SecondProfileCallback(CallbackData, prefix="profile2"):
+    subject: str
+
 
 async def get_obligatory_subjects_keyboard() -> InlineKeyboardMarkup:
     """Inline-клавиатура для выбора обязательных предметов"""
     builder = InlineKeyboardBuilder()
     for subject in OBLIGATORY_SUBJECTS:
-        builder.add(InlineKeyboardButton(text=f"📚 {subject}", callback_data=f"obligatory:{subject}"))
+        builder.add(InlineKeyboardButton(text=f"📚 {subject}", callback_data=ObligatorySubjectCallback(subject=subject).pack()))
     builder.adjust(2)
     return builder.as_markup()
 
@@ -19,7 +42,7 @@ async def get_profile_subjects_keyboard_1() -> InlineKeyboardMarkup:
     """Inline-клавиатура для выбора первого профильного предмета"""
     builder = InlineKeyboardBuilder()
     for subject in PROFILE_SUBJECTS:
-        builder.add(InlineKeyboardButton(text=f"🧪 {subject}", callback_data=f"profile1:{subject}"))
+        builder.add(InlineKeyboardButton(text=f"🧪 {subject}", callback_data=FirstProfileCallback(subject=subject).pack()))
     builder.adjust(2)
     return builder.as_markup()
 
@@ -29,7 +52,7 @@ async def get_profile_subjects_keyboard_2(excluded_subject: str) -> InlineKeyboa
     builder = InlineKeyboardBuilder()
     available_subjects = [s for s in PROFILE_SUBJECTS if s != excluded_subject]
     for subject in available_subjects:
-        builder.add(InlineKeyboardButton(text=f"🔬 {subject}", callback_data=f"profile2:{subject}"))
+        builder.add(InlineKeyboardButton(text=f"🔬 {subject}", callback_data=SecondProfileCallback(subject=subject).pack()))
     builder.adjust(2)
     return builder.as_markup()
 
@@ -38,8 +61,8 @@ async def get_answer_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура вариантов ответов"""
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="A"), KeyboardButton(text="B")],
-            [KeyboardButton(text="C"), KeyboardButton(text="D")]
+            [KeyboardButton(text=ANSWER_OPTIONS[0]), KeyboardButton(text=ANSWER_OPTIONS[1])],
+            [KeyboardButton(text=ANSWER_OPTIONS[2]), KeyboardButton(text=ANSWER_OPTIONS[3])]
         ],
         resize_keyboard=True,
         one_time_keyboard=True
@@ -50,8 +73,8 @@ async def get_end_test_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура после завершения теста"""
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="🔄 Пройти ещё раз")],
-            [KeyboardButton(text="☰ Меню")]
+            [KeyboardButton(text=BUTTON_RESTART)],
+            [KeyboardButton(text=BUTTON_MENU)]
         ],
         resize_keyboard=True
     )
@@ -61,9 +84,9 @@ async def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура основного меню"""
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="📖 Обязательные предметы")],
-            [KeyboardButton(text="🧪 Профильные предметы")],
-            [KeyboardButton(text="🧪 Пробный ЕНТ")]
+            [KeyboardButton(text=BUTTON_OBLIGATORY)],
+            [KeyboardButton(text=BUTTON_PROFILE)],
+            [KeyboardButton(text=BUTTON_FULL_ENT)]
         ],
         resize_keyboard=True
     )
\ No newline at end of file
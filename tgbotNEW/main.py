@@ -1,34 +1,172 @@
 import asyncio
 import logging
+import signal
+from contextlib import suppress
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from config import BOT_TOKEN, OPENAI_API_KEY
+from config import (
+    BOT_TOKEN,
+    OPENAI_API_KEY,
+    BOT_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    UPDATE_CONCURRENCY,
+    UPDATE_MAX_PENDING,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_COALESCE,
+    METRICS_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+    QUESTION_POOL_ENABLED,
+    QUESTION_POOL_PATH,
+    QUESTION_POOL_LOW_WATER,
+    QUESTION_POOL_TARGET,
+    QUESTION_POOL_BATCH_SIZE,
+    QUESTION_POOL_WORKERS,
+    QUESTION_POOL_STALL_BATCHES,
+    QUESTION_POOL_STALL_BACKOFF,
+    FSM_STORAGE,
+    FSM_SQLITE_PATH,
+    FSM_CACHE_SIZE,
+    FSM_MEMORY_BUDGET,
+    FSM_IDLE_TIMEOUT,
+    FSM_FLUSH_INTERVAL,
+    FSM_SESSION_TTL,
+    ANALYTICS_ENABLED,
+    ANALYTICS_INTERVAL,
+    SEEN_QUESTIONS_ENABLED,
+    LLM_CACHE_ENABLED,
+    ANALYTICS_ANSWERS_PATH,
+    WORKER_HOST,
+    WORKER_BASE_PORT,
+    WORKER_PATH,
+)
 from handlers import register_handlers
-from openai import OpenAI
-from aiogram.fsm.storage.memory import MemoryStorage
+from keyboards import OBLIGATORY_SUBJECTS, PROFILE_SUBJECTS
 from utils.bot_commands import set_bot_commands
+from utils import metrics
+from utils.metrics import setup_metrics, start_metrics_server
+from utils.telegram_sender import OutboundSender
+from utils.openai_utils import create_openai_client, set_llm_share, _generate_subject_questions
+from utils.question_pool import QuestionPool
+from utils.question_analytics import analytics_loop, get_answer_log, set_answer_log_path
+from utils.sharding import worker_path
+from utils.seen_questions import get_seen_questions
+from utils.llm_cache import get_llm_cache
+from utils.question_store import get_question_store
+from utils.session_storage import SessionStorage
+from utils.sqlite_storage import SQLiteStorage
+from utils.statistics import get_statistics_store
+from utils.webhook import run_webhook
 from aiogram.client.default import DefaultBotProperties
 
-async def main():
-    logging.basicConfig(level=logging.INFO)
-    storage = MemoryStorage()
+async def main(worker_index: int = None, workers: int = 1, worker_secret: str = None):
+    """Запускает бота. С worker_index - как воркер supervisor.py: обновления приходят от supervisor
+    на WORKER_BASE_PORT + worker_index, лимиты Telegram и модели делятся на workers частей, а файлы
+    с единственным писателем (пул вопросов, журнал ответов) у воркера свои.
+    """
+    log_format = logging.BASIC_FORMAT if worker_index is None else f"[w{worker_index}] {logging.BASIC_FORMAT}"
+    logging.basicConfig(level=logging.INFO, format=log_format)
+    share = 1 / workers
+    if worker_index is not None:
+        set_llm_share(share)
+        set_answer_log_path(worker_path(ANALYTICS_ANSWERS_PATH, worker_index), worker_path(ANALYTICS_ANSWERS_PATH, "*"))
+    if FSM_STORAGE == "sqlite":
+        storage = SQLiteStorage(FSM_SQLITE_PATH, cache_size=FSM_CACHE_SIZE, flush_interval=FSM_FLUSH_INTERVAL,
+                                ttl=FSM_SESSION_TTL, memory_budget=FSM_MEMORY_BUDGET, idle_timeout=FSM_IDLE_TIMEOUT)
+    else:
+        storage = SessionStorage(memory_budget=FSM_MEMORY_BUDGET, idle_timeout=FSM_IDLE_TIMEOUT,
+                                 cache_size=FSM_CACHE_SIZE, flush_interval=FSM_FLUSH_INTERVAL, ttl=FSM_SESSION_TTL)
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML)) 
+    # Все исходящие запросы проходят через очередь с лимитами Telegram (внешняя middleware сессии)
+    sender = OutboundSender(global_rate=TELEGRAM_GLOBAL_RATE * share, chat_rate=TELEGRAM_CHAT_RATE,
+                            chat_burst=TELEGRAM_CHAT_BURST, max_retries=TELEGRAM_MAX_RETRIES,
+                            coalesce=TELEGRAM_COALESCE)
+    bot.session.middleware(sender)
+    metrics.TELEGRAM_QUEUE_DEPTH.set_function(sender.waiting)
     dp = Dispatcher(storage=storage)
 
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = create_openai_client(api_key=OPENAI_API_KEY)
         dp['openai_client'] = client
     except Exception as e:
         logging.error(f"Ошибка инициализации OpenAI: {e}")
         return
 
+    question_pool = None
+    if QUESTION_POOL_ENABLED:
+        question_pool = QuestionPool(
+            QUESTION_POOL_PATH if worker_index is None else worker_path(QUESTION_POOL_PATH, worker_index),
+            OBLIGATORY_SUBJECTS + PROFILE_SUBJECTS,
+            low_water=QUESTION_POOL_LOW_WATER,
+            target=QUESTION_POOL_TARGET,
+            batch_size=QUESTION_POOL_BATCH_SIZE,
+            workers=QUESTION_POOL_WORKERS,
+            stall_batches=QUESTION_POOL_STALL_BATCHES,
+            stall_backoff=QUESTION_POOL_STALL_BACKOFF,
+        )
+        question_pool.start(lambda subject, count: _generate_subject_questions(client, subject, count))
+    dp['question_pool'] = question_pool
+    # Статистика вопросов по всем ответам пересчитывается в фоне и отсеивает плохие вопросы пула
+    analytics_task = asyncio.create_task(analytics_loop(ANALYTICS_INTERVAL, question_pool)) if ANALYTICS_ENABLED else None
+
     register_handlers(dp)
-    await set_bot_commands(bot)
+    metrics_runner = None
+    if METRICS_ENABLED:
+        setup_metrics(dp, bot, storage)
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + (worker_index or 0))
+    if not worker_index:
+        await set_bot_commands(bot)
 
     try:
-        await dp.start_polling(bot, skip_updates=True)
+        if worker_index is not None:
+            # Останавливает воркер supervisor (SIGTERM); Ctrl+C в терминале достается только supervisor
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            stop_event = asyncio.Event()
+            with suppress(NotImplementedError):
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+            await run_webhook(dp, bot, "", WORKER_PATH, WORKER_HOST, WORKER_BASE_PORT + worker_index,
+                              secret_token=worker_secret, concurrency=UPDATE_CONCURRENCY,
+                              max_pending=UPDATE_MAX_PENDING, stop_event=stop_event)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT,
+                              secret_token=WEBHOOK_SECRET, concurrency=UPDATE_CONCURRENCY,
+                              max_pending=UPDATE_MAX_PENDING)
+        else:
+            # Как и раньше (skip_updates), накопившиеся обновления сбрасываются. Заодно снимается вебхук:
+            # пока он установлен, getUpdates не работает
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     finally:
+        if question_pool:
+            await question_pool.stop()
+        if analytics_task:
+            analytics_task.cancel()
+            await asyncio.gather(analytics_task, return_exceptions=True)
+        get_answer_log().flush()
+        if SEEN_QUESTIONS_ENABLED:
+            get_seen_questions().close()
+        if LLM_CACHE_ENABLED:
+            get_llm_cache().close()
+        # Дожидается записей из очереди исполнителя и закрывает соединение с базой вопросов
+        get_question_store().close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await client.close()
+        await get_statistics_store().close()
         await bot.session.close()
 
+
+def run_worker(worker_index: int, workers: int, worker_secret: str) -> None:
+    """Точка входа процесса-воркера (запускается из supervisor.py)"""
+    asyncio.run(main(worker_index, workers, worker_secret))
+
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
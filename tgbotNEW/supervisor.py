@@ -0,0 +1,196 @@
+"""Запуск бота в нескольких процессах: python supervisor.py [--workers N]
+
+Supervisor сам получает обновления от Telegram (long polling или вебхук, по BOT_MODE) и раздает
+их N процессам-воркерам по согласованному хешу chat_id. Обновления одного чата всегда обрабатывает
+один воркер и в порядке поступления, поэтому его сессия FSM, статистика и лимиты генерации живут
+в памяти одного процесса. Базы SQLite (FSM, статистика, вопросы, кэш ответов модели) у воркеров
+общие; лимиты Telegram и модели делятся между воркерами поровну. Упавший воркер перезапускается,
+обновления для него ждут в очереди supervisor.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import secrets
+import signal
+from contextlib import suppress
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import PRODUCTION
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    UPDATE_MAX_PENDING,
+    WORKERS,
+    WORKER_HOST,
+    WORKER_BASE_PORT,
+    WORKER_PATH,
+)
+from handlers import register_handlers
+from main import run_worker
+from utils.sharding import ShardRouter
+from utils.webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30  # Long polling: сколько секунд Telegram держит запрос getUpdates без новых обновлений
+
+
+class WorkerSet:
+    """Процессы-воркеры: запуск, перезапуск упавших и остановка"""
+
+    def __init__(self, count: int, target, secret: str):
+        self.count = count
+        self.target = target
+        self.secret = secret
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = [None] * count
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(target=self.target, args=(index, self.count, self.secret), name=f"worker-{index}")
+        process.start()
+        self._processes[index] = process
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._start(index)
+
+    async def watch(self, interval: float = 1.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаем")
+                    self.restarts += 1
+                    self._start(index)
+
+    async def stop(self, timeout: float = 40.0) -> None:
+        """SIGTERM всем воркерам: они дорабатывают принятые обновления. Не успевшие за timeout убиваются"""
+        for process in self._processes:
+            process.terminate()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, process.join, timeout) for process in self._processes))
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не остановился за {timeout:.0f} c")
+                process.kill()
+
+
+async def poll_updates(token: str, router: ShardRouter, allowed_updates: list) -> None:
+    """Long polling: сырые обновления из getUpdates сразу уходят в очереди воркеров"""
+    url = PRODUCTION.api_url(token, "getUpdates")
+    offset = None
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as session:
+        try:
+            while True:
+                if router.pending >= UPDATE_MAX_PENDING:
+                    # Воркеры не успевают: новые обновления пока подождут у Telegram
+                    await asyncio.sleep(0.1)
+                    continue
+                params = {"timeout": POLL_TIMEOUT, "allowed_updates": allowed_updates}
+                if offset is not None:
+                    params["offset"] = offset
+                try:
+                    async with session.post(url, json=params) as response:
+                        body = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logger.warning(f"Ошибка getUpdates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if not body.get("ok"):
+                    logger.warning(f"getUpdates: {body.get('description')}")
+                    await asyncio.sleep((body.get("parameters") or {}).get("retry_after", 1))
+                    continue
+                for raw_update in body["result"]:
+                    router.submit(raw_update)
+                    offset = raw_update["update_id"] + 1
+        finally:
+            if offset is not None:
+                # Подтверждаем уже розданные обновления, иначе после перезапуска Telegram пришлет их снова
+                with suppress(aiohttp.ClientError, asyncio.TimeoutError):
+                    await session.post(url, json={"offset": offset, "timeout": 0, "limit": 1})
+
+
+def create_ingress_app(router: ShardRouter, path: str, secret_token: str = None) -> web.Application:
+    """Вебхук supervisor: обновление сразу уходит в очередь воркера, Telegram получает ответ без ожидания"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        if router.pending >= UPDATE_MAX_PENDING:
+            return web.Response(status=503)
+        try:
+            raw_update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        router.submit(raw_update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def supervise(workers: int = WORKERS) -> None:
+    logging.basicConfig(level=logging.INFO, format=f"[supervisor] {logging.BASIC_FORMAT}")
+    # Порты воркеров слушают только localhost, а секрет не дает подсунуть им обновления другим процессам
+    secret = secrets.token_urlsafe(16)
+    worker_set = WorkerSet(workers, run_worker, secret)
+    worker_set.start()
+    router = ShardRouter([f"http://{WORKER_HOST}:{WORKER_BASE_PORT + index}{WORKER_PATH}" for index in range(workers)],
+                         secret_token=secret)
+    router.start()
+    dp = Dispatcher()
+    register_handlers(dp)
+    allowed_updates = dp.resolve_used_update_types()
+    bot = Bot(token=BOT_TOKEN)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+    watch_task = asyncio.create_task(worker_set.watch())
+    poll_task = None
+    runner = None
+    try:
+        if BOT_MODE == "webhook":
+            runner = web.AppRunner(create_ingress_app(router, WEBHOOK_PATH, WEBHOOK_SECRET))
+            await runner.setup()
+            await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+            if WEBHOOK_BASE_URL:
+                await bot.set_webhook(f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None,
+                                      allowed_updates=allowed_updates, drop_pending_updates=False)
+        else:
+            # Как и main.py в режиме polling: накопившиеся обновления сбрасываются, вебхук снимается
+            await bot.delete_webhook(drop_pending_updates=True)
+            poll_task = asyncio.create_task(poll_updates(BOT_TOKEN, router, allowed_updates))
+        logger.info(f"Supervisor запущен: воркеров {workers}, режим {BOT_MODE}")
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать обновления, потом отдаем воркерам принятые и останавливаем их
+        if poll_task:
+            poll_task.cancel()
+            await asyncio.gather(poll_task, return_exceptions=True)
+        if runner:
+            await runner.cleanup()
+        await router.close()
+        watch_task.cancel()
+        await asyncio.gather(watch_task, return_exceptions=True)
+        await worker_set.stop()
+        logger.info(f"Supervisor остановлен: {router.get_stats()}, перезапусков воркеров {worker_set.restarts}")
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    asyncio.run(supervise(args.workers))
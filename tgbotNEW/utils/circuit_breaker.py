@@ -0,0 +1,82 @@
+# utils/circuit_breaker.py
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: сервис недавно подряд не отвечал, запрос не отправляется"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name}: предохранитель разомкнут, повтор через {retry_after:.0f} c")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Предохранитель для вызовов внешнего сервиса.
+
+    После failure_threshold ошибок подряд размыкается на reset_timeout секунд: все вызовы сразу
+    получают CircuitOpenError, а не ждут таймаута. Потом пропускает один пробный вызов
+    (полуоткрытое состояние): успех замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 on_state_change=None, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Предохранитель {self.name}: {self.state} -> {state}")
+            self.state = state
+            if self.on_state_change is not None:
+                self.on_state_change(state)
+
+    def check(self) -> None:
+        """Разрешает вызов или бросает CircuitOpenError"""
+        if self.state == CLOSED:
+            return
+        retry_after = self._opened_at + self.reset_timeout - self.clock()
+        if self.state == OPEN and retry_after > 0:
+            raise CircuitOpenError(self.name, retry_after)
+        if self._probe_in_flight:
+            raise CircuitOpenError(self.name, max(retry_after, 0.0))
+        self._set_state(HALF_OPEN)
+        self._probe_in_flight = True
+
+    def allows(self) -> bool:
+        """Пропустит ли check() вызов сейчас; состояние не меняет"""
+        if self.state == CLOSED:
+            return True
+        if self._probe_in_flight:
+            return False
+        return self.state == HALF_OPEN or self.clock() >= self._opened_at + self.reset_timeout
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_in_flight = False
+        self._set_state(CLOSED)
+
+    def release(self) -> None:
+        """Вызов отменен без результата: пробный вызов можно будет сделать снова"""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = self.clock()
+            self._set_state(OPEN)
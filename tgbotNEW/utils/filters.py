@@ -0,0 +1,31 @@
+# utils/filters.py
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+
+class TextIn(Filter):
+    """Точное совпадение текста сообщения с одним из заданных: поиск в множестве за O(1).
+
+    lambda- и F-фильтры синхронные, и aiogram выполняет каждую их проверку через asyncio.to_thread.
+    Этот фильтр асинхронный, поэтому проверяется прямо в event loop без переключения на поток.
+    """
+
+    __slots__ = ("texts",)
+
+    def __init__(self, *texts: str):
+        self.texts = frozenset(texts)
+
+    async def __call__(self, message: Message) -> bool:
+        return message.text in self.texts
+
+
+class FromUser(Filter):
+    """Сообщение от одного из заданных пользователей (например, администраторов)"""
+
+    __slots__ = ("user_ids",)
+
+    def __init__(self, *user_ids: int):
+        self.user_ids = frozenset(user_ids)
+
+    async def __call__(self, message: Message) -> bool:
+        return message.from_user is not None and message.from_user.id in self.user_ids
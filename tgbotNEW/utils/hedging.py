@@ -0,0 +1,108 @@
+# utils/hedging.py
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Скользящее окно последних длительностей и их квантиль.
+
+    Квантиль пересчитывается не на каждом замере, а раз в recompute_every новых замеров: это
+    сортировка окна, и делать ее на каждый запрос к модели незачем.
+    """
+
+    __slots__ = ("min_samples", "recompute_every", "_samples", "_quantiles", "_since_recompute")
+
+    def __init__(self, window: int = 200, min_samples: int = 20, recompute_every: int = 10):
+        self.min_samples = min_samples
+        self.recompute_every = recompute_every
+        self._samples = deque(maxlen=window)
+        self._quantiles = {}
+        self._since_recompute = 0
+
+    def observe(self, duration: float) -> None:
+        self._samples.append(duration)
+        self._since_recompute += 1
+        if self._since_recompute >= self.recompute_every:
+            self._quantiles.clear()
+
+    def quantile(self, q: float):
+        """Квантиль q по окну или None, пока замеров меньше min_samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        value = self._quantiles.get(q)
+        if value is None:
+            ordered = sorted(self._samples)
+            value = self._quantiles[q] = ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+            self._since_recompute = 0
+        return value
+
+
+class HedgeBudget:
+    """Ограничение страховочных запросов: не больше ratio от числа обычных плюс небольшой запас burst.
+
+    Каждый обычный запрос добавляет ratio кредита (но не больше burst), страховочный тратит единицу.
+    Поэтому даже при массовых задержках модели страховка не удваивает расход.
+    """
+
+    __slots__ = ("ratio", "burst", "_credit", "stats")
+
+    def __init__(self, ratio: float = 0.1, burst: float = 3.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._credit = burst
+        self.stats = {"requests": 0, "hedges": 0, "denied": 0}
+
+    def on_request(self) -> None:
+        self.stats["requests"] += 1
+        self._credit = min(self._credit + self.ratio, self.burst)
+
+    def try_spend(self) -> bool:
+        if self._credit < 1:
+            self.stats["denied"] += 1
+            return False
+        self._credit -= 1
+        self.stats["hedges"] += 1
+        return True
+
+
+async def hedged(call: Callable[[], Awaitable], delay, budget: HedgeBudget,
+                 on_discard: Callable[[object], Awaitable] = None) -> tuple:
+    """Выполняет call(). Если за delay секунд ответа нет и бюджет позволяет, запускает второй такой же
+    вызов и возвращает результат того, кто успешно закончит первым; другой отменяется.
+
+    Возвращает (результат, выиграл ли страховочный вызов). on_discard получает успешный результат
+    проигравшего, если оба закончили одновременно (например, чтобы закрыть поток ответа).
+    delay=None - без страховки.
+    """
+    budget.on_request()
+    tasks = [asyncio.ensure_future(call())]
+    winner = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and budget.try_spend():
+                tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is None:
+                    winner = task
+                    return task.result(), task is not tasks[0]
+                error = task.exception()
+        raise error
+    finally:
+        # Проигравший отменяется и дожидается отмены, чтобы не оставлять висящих соединений
+        losers = [task for task in tasks if task is not winner]
+        for task in losers:
+            task.cancel()
+        results = await asyncio.gather(*losers, return_exceptions=True)
+        if on_discard is not None:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    await on_discard(result)
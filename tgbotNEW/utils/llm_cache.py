@@ -0,0 +1,217 @@
+# utils/llm_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from config import LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_BYTES, LLM_CACHE_DISK_BYTES, LLM_CACHE_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(params: dict) -> str:
+    """Ключ по содержимому запроса: модель, сообщения, температура, формат ответа (без stream)"""
+    payload = {name: value for name, value in params.items() if name not in ("stream", "stream_options")}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Двухуровневый кэш ответов модели: LRU в памяти поверх SQLite.
+
+    На один ключ хранится до variants разных ответов модели. Пока их меньше, поиск считается
+    промахом и новый ответ добавляется как еще один вариант; потом каждый запрос получает
+    случайный вариант, поэтому у пользователей с одинаковым запросом наборы вопросов разные.
+    Если вызывающему не подходит ни один вариант (accept), поиск тоже промах: новый ответ модели
+    вытеснит самый старый вариант. Ответ старше ttl не выдается. Оба уровня ограничены по байтам:
+    в памяти вытесняются давно не запрашивавшиеся ключи (помнятся и ключи, которых на диске нет),
+    на диске - давно не запрашивавшиеся варианты. Запросы к SQLite выполняются в отдельном потоке.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, memory_bytes: int = 8 * 2 ** 20,
+                 disk_bytes: int = 256 * 2 ** 20, variants: int = 3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.variants = variants
+        self._memory = OrderedDict()  # ключ -> [(ответ, токены, время записи), ...]
+        self._memory_size = 0
+        self._unchecked = 0  # Байты, записанные этим процессом после последней сверки размера с базой
+        # Все обращения к SQLite идут через один поток, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "rejected": 0, "saved_bytes": 0,
+                      "saved_tokens": 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT NOT NULL, content TEXT NOT NULL, tokens INTEGER NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_key ON llm_cache (key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._conn.commit()
+        self._purge_expired()
+        self._disk_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def _entry_size(entry: tuple) -> int:
+        return len(entry[0].encode("utf-8"))
+
+    def _key_size(self, key: str, entries: list) -> int:
+        # Ключ учитывается и без вариантов: в памяти помнится и то, что на диске ключа нет
+        return len(key) + sum(map(self._entry_size, entries))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _remember(self, key: str, entries: list) -> None:
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= self._key_size(key, old)
+        self._memory[key] = entries
+        self._memory_size += self._key_size(key, entries)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self._memory_size -= self._key_size(evicted_key, evicted)
+
+    def _select(self, key: str) -> list:
+        rows = self._conn.execute(
+            "SELECT content, tokens, created FROM llm_cache WHERE key = ? ORDER BY created", (key,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    async def _load(self, key: str):
+        """Варианты ключа из памяти или с диска (с диска они поднимаются в память). Возвращает (варианты, уровень)"""
+        entries = self._memory.get(key)
+        if entries is not None:
+            self._memory.move_to_end(key)
+            return entries, "memory"
+        loaded = await self._run(self._select, key)
+        # Пока шло чтение, ключ мог попасть в память из другой корутины
+        entries = self._memory.get(key)
+        if entries is not None:
+            return entries, "memory"
+        self._remember(key, loaded)
+        return loaded, "disk"
+
+    def _touch(self, key: str, now: float) -> None:
+        with self._conn:
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+
+    async def get(self, key: str, accept: Callable[[str], bool] = None):
+        """Возвращает (ответ, уровень) - уровень "memory" или "disk", - или (None, "miss").
+
+        accept(ответ) отбирает подходящие варианты; если не подошел ни один - (None, "rejected").
+        """
+        entries, tier = await self._load(key)
+        expire_before = time.time() - self.ttl
+        fresh = [entry for entry in entries if entry[2] >= expire_before]
+        if len(fresh) != len(entries):
+            self._remember(key, fresh)
+        if len(fresh) < self.variants:
+            self.stats["misses"] += 1
+            return None, "miss"
+        if accept is not None:
+            fresh = [entry for entry in fresh if accept(entry[0])]
+            if not fresh:
+                self.stats["rejected"] += 1
+                return None, "rejected"
+        content, tokens, _ = random.choice(fresh)
+        self.stats[f"{tier}_hits"] += 1
+        self.stats["saved_bytes"] += len(content.encode("utf-8"))
+        self.stats["saved_tokens"] += tokens
+        if tier == "disk":
+            await self._run(self._touch, key, time.time())
+        return content, tier
+
+    def _insert(self, key: str, content: str, tokens: int, size: int, now: float, oldest: float) -> int:
+        """Записывает вариант и удаляет варианты ключа старше oldest. Возвращает размер удаленных"""
+        with self._conn:
+            # Варианты ключа старше самого старого оставшегося - устаревшие или лишние
+            removed = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache WHERE key = ? AND created < ?",
+                                         (key, oldest)).fetchone()[0]
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ? AND created < ?", (key, oldest))
+            self._conn.execute(
+                "INSERT INTO llm_cache (key, content, tokens, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, tokens, size, now, now)
+            )
+        return removed
+
+    async def put(self, key: str, content: str, tokens: int = 0) -> None:
+        """Добавляет ответ как еще один вариант ключа; лишние старые варианты удаляются"""
+        entries, _ = await self._load(key)
+        now = time.time()
+        fresh = [entry for entry in entries if entry[2] >= now - self.ttl]
+        kept = fresh[max(len(fresh) - self.variants + 1, 0):]
+        kept.append((content, tokens, now))
+        self._remember(key, kept)
+        size = len(content.encode("utf-8"))
+        removed = await self._run(self._insert, key, content, tokens, size, now, kept[0][2])
+        self._disk_size += size - removed
+        self._unchecked += size
+        # В базу пишут и другие воркеры: свой счетчик размера сверяется с базой, когда он превышает
+        # бюджет или после записи еще 5% бюджета
+        if self._disk_size > self.disk_bytes or self._unchecked >= self.disk_bytes * 0.05:
+            self._unchecked = 0
+            self._disk_size, keys = await self._run(self._evict_disk)
+            for evicted_key in keys:
+                evicted = self._memory.pop(evicted_key, None)
+                if evicted is not None:
+                    self._memory_size -= self._key_size(evicted_key, evicted)
+
+    def _evict_disk(self) -> tuple[int, set]:
+        """Сверяет размер с базой и, если он больше бюджета, удаляет давно не запрашивавшиеся варианты,
+        пока диск не уложится в 90% бюджета. Возвращает (размер на диске, ключи удаленных вариантов)"""
+        self._purge_expired()
+        size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if size <= self.disk_bytes:
+            return size, set()
+        target = self.disk_bytes * 0.9
+        removed, keys = [], set()
+        # Строки читаются по индексу last_used по мере надобности, а не вся таблица сразу
+        rows = self._conn.execute("SELECT rowid, key, size FROM llm_cache ORDER BY last_used")
+        for rowid, key, row_size in rows:
+            if size <= target:
+                break
+            removed.append((rowid,))
+            keys.add(key)
+            size -= row_size
+        rows.close()
+        with self._conn:
+            self._conn.executemany("DELETE FROM llm_cache WHERE rowid = ?", removed)
+        logger.info(f"Кэш ответов модели: удалено {len(removed)} вариантов, на диске {size} байт")
+        return size, keys
+
+    def _purge_expired(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["rejected"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {**self.stats, "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_bytes": self._memory_size, "disk_bytes": self._disk_size}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+_llm_cache = None
+
+
+def get_llm_cache() -> LLMCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_BYTES, LLM_CACHE_DISK_BYTES,
+                              LLM_CACHE_VARIANTS)
+    return _llm_cache
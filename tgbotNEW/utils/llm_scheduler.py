@@ -0,0 +1,171 @@
+# utils/llm_scheduler.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class _Ticket:
+    __slots__ = ("user_key", "lane", "cost", "future", "enqueued_at", "tokens")
+
+    def __init__(self, user_key, lane: str, cost: int):
+        self.user_key = user_key
+        self.lane = lane
+        self.cost = cost
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        # Фактически потраченные токены: вызывающий код заполняет после ответа модели
+        self.tokens = None
+
+
+class LLMScheduler:
+    """Планировщик запросов к модели: общий лимит одновременных запросов и бюджет токенов в минуту.
+
+    Ожидающие запросы разложены по полосам (например, premium, free, background). Полосы
+    обслуживаются по взвешенному циклическому алгоритму: полоса с весом 4 получает вчетверо больше
+    слотов, чем полоса с весом 1, но и она не голодает. Внутри полосы пользователи обслуживаются по
+    кругу, по одному запросу за раз, поэтому пробный ЕНТ из пяти больших запросов не занимает
+    очередь целиком. Стоимость запроса в токенах оценивается заранее и уточняется по факту.
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int, lane_weights: dict, clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.lane_weights = dict(lane_weights)
+        self.clock = clock
+        self._lanes = {lane: OrderedDict() for lane in self.lane_weights}
+        self._current_weight = {lane: 0 for lane in self.lane_weights}
+        self._active = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = clock()
+        self._timer = None
+        self.stats = {"granted": 0, "queued": 0, "cancelled": 0, "wait_time_total": 0.0}
+
+    def waiting(self) -> int:
+        return sum(len(queue) for users in self._lanes.values() for queue in users.values())
+
+    def position(self, ticket: _Ticket) -> int:
+        """Оценка места в очереди: запросы полос с большим весом плюс пользователи своей полосы впереди"""
+        weight = self.lane_weights[ticket.lane]
+        ahead = sum(len(queue) for lane, users in self._lanes.items() if self.lane_weights[lane] > weight
+                    for queue in users.values())
+        for user_key in self._lanes[ticket.lane]:
+            if user_key == ticket.user_key:
+                break
+            ahead += 1
+        return ahead + 1
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _pick_lane(self):
+        """Взвешенный циклический выбор полосы (smooth weighted round-robin) среди непустых"""
+        lanes = [lane for lane, users in self._lanes.items() if users]
+        if not lanes:
+            return None, lanes
+        return max(lanes, key=lambda name: self._current_weight[name] + self.lane_weights[name]), lanes
+
+    def _commit_lane(self, lane: str, lanes: list) -> None:
+        for name in lanes:
+            self._current_weight[name] += self.lane_weights[name]
+        self._current_weight[lane] -= sum(self.lane_weights[name] for name in lanes)
+
+    def _dispatch(self) -> None:
+        self._refill()
+        while self._active < self.max_concurrency:
+            lane, lanes = self._pick_lane()
+            if lane is None:
+                return
+            users = self._lanes[lane]
+            user_key, queue = next(iter(users.items()))
+            ticket = queue[0]
+            # Запрос дороже всего бюджета ждет полного бюджета, а не бесконечно
+            needed = min(ticket.cost, self.capacity)
+            if self._tokens < needed:
+                self._schedule_refill((needed - self._tokens) / self.rate)
+                return
+            self._commit_lane(lane, lanes)
+            queue.popleft()
+            # Пользователь уходит в конец круга своей полосы
+            del users[user_key]
+            if queue:
+                users[user_key] = queue
+            self._tokens -= ticket.cost
+            self._active += 1
+            self.stats["granted"] += 1
+            self.stats["wait_time_total"] += self.clock() - ticket.enqueued_at
+            ticket.future.set_result(None)
+
+    def _schedule_refill(self, delay: float) -> None:
+        if self._timer is None:
+            def wake():
+                self._timer = None
+                self._dispatch()
+
+            self._timer = asyncio.get_running_loop().call_later(delay, wake)
+
+    def _remove(self, ticket: _Ticket) -> None:
+        users = self._lanes[ticket.lane]
+        queue = users.get(ticket.user_key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del users[ticket.user_key]
+
+    async def acquire(self, user_key, lane: str, cost: int,
+                      on_queued: Callable[[int], Awaitable[None]] = None) -> _Ticket:
+        """Ждет слот. on_queued(позиция) вызывается, если слот не выдан сразу."""
+        ticket = _Ticket(user_key, lane, cost)
+        self._lanes[lane].setdefault(user_key, deque()).append(ticket)
+        self._dispatch()
+        # Отмена возможна и во время уведомления о месте в очереди: слот к этому моменту уже
+        # может быть выдан, поэтому уведомление - внутри того же try, что возвращает слот
+        try:
+            if not ticket.future.done():
+                self.stats["queued"] += 1
+                if on_queued is not None:
+                    try:
+                        await on_queued(self.position(ticket))
+                    except Exception as e:
+                        logger.warning(f"Не удалось сообщить {user_key} место в очереди: {e}")
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self.release(ticket)
+            else:
+                self.stats["cancelled"] += 1
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        self._active -= 1
+        if ticket.tokens is not None:
+            # Уточняем бюджет по фактическому расходу (бюджет может уйти в минус)
+            self._tokens += ticket.cost - ticket.tokens
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_key, lane: str, cost: int, on_queued: Callable[[int], Awaitable[None]] = None):
+        ticket = await self.acquire(user_key, lane, cost, on_queued)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self) -> dict:
+        granted = self.stats["granted"]
+        return {
+            **self.stats,
+            "active": self._active,
+            "waiting": self.waiting(),
+            "tokens_available": round(self._tokens),
+            "wait_time_avg": self.stats["wait_time_total"] / granted if granted else 0.0,
+        }
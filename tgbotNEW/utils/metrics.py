@@ -0,0 +1,264 @@
+# utils/metrics.py
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени (секунды): от быстрых обработчиков до долгих запросов к LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+                for values, child in self._children.items()]
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и падать. С set_function значение вычисляется при каждом сборе."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def _samples(self) -> list:
+        if self._function is not None:
+            try:
+                self.labels().set(self._function())
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+                for values, child in self._children.items()]
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> list:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+REGISTRY = []
+
+HANDLER_DURATION = Histogram("bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+LLM_DURATION = Histogram("llm_request_duration_seconds", "Время запроса к модели", ("subject", "model", "mode"))
+LLM_TOKENS = Counter("llm_tokens_total", "Токены, потраченные на запросы к модели", ("subject", "model", "kind"))
+LLM_ERRORS = Counter("llm_request_errors_total", "Неудачные попытки запроса к модели", ("subject", "model"))
+TELEGRAM_SENDS = Counter("telegram_requests_total", "Запросы к Bot API", ("method", "status"))
+TELEGRAM_DURATION = Histogram("telegram_request_duration_seconds", "Время запроса к Bot API", ("method",))
+PARSER_ACCEPTED = Counter("question_parser_accepted_total", "Вопросы, принятые парсером", ("subject",))
+PARSER_REJECTED = Counter("question_parser_rejected_total", "Блоки ответа модели, отброшенные парсером", ("subject",))
+TELEGRAM_QUEUE_DELAY = Histogram("telegram_queue_delay_seconds", "Ожидание сообщения в очереди отправки")
+TELEGRAM_QUEUE_DEPTH = Gauge("telegram_queue_depth", "Сообщения, ожидающие отправки")
+TELEGRAM_COALESCED = Counter("telegram_coalesced_messages_total", "Сообщения, склеенные с предыдущим в очереди")
+TELEGRAM_RETRY_AFTER = Counter("telegram_retry_after_total", "Ответы 429 (retry_after) от Bot API")
+FSM_ACTIVE_SESSIONS = Gauge("fsm_active_sessions", "Сессии FSM с установленным состоянием")
+FSM_MEMORY_SESSIONS = Gauge("fsm_memory_sessions", "Сессии FSM в памяти")
+FSM_MEMORY_BYTES = Gauge("fsm_memory_bytes", "Размер данных сессий FSM в памяти (байты pickle)")
+FSM_SESSION_SIZE = Histogram("fsm_session_size_bytes", "Размер данных сессии FSM при сохранении", buckets=SIZE_BUCKETS)
+FSM_EVICTED_SESSIONS = Counter("fsm_evicted_sessions_total", "Сессии FSM, вытесненные из памяти", ("reason",))
+QUOTA_DENIALS = Counter("quota_denials_total", "Отказы в генерации из-за лимита", ("reason",))
+LLM_COALESCE_RATIO = Gauge("llm_coalesce_ratio", "Доля запросов генерации, объединенных с уже выполняющимися")
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Ожидание слота в планировщике запросов к модели", ("lane",))
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "Запросы к модели, ожидающие слота")
+LLM_SAVED_TOKENS = Gauge("llm_saved_tokens", "Токены, сэкономленные объединением одинаковых запросов")
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups_total", "Поиск ответа модели в кэше", ("result",))
+LLM_CACHE_SAVED_BYTES = Gauge("llm_cache_saved_bytes", "Байты ответов модели, выданные из кэша вместо запроса")
+LLM_CACHE_SAVED_TOKENS = Gauge("llm_cache_saved_tokens", "Токены, сэкономленные ответами из кэша")
+LLM_CACHE_MEMORY_BYTES = Gauge("llm_cache_memory_bytes", "Размер кэша ответов модели в памяти")
+LLM_CACHE_DISK_BYTES = Gauge("llm_cache_disk_bytes", "Размер кэша ответов модели на диске")
+LLM_HEDGE_RATIO = Gauge("llm_hedge_ratio", "Доля запросов к модели, для которых отправлен страховочный повтор")
+LLM_HEDGE_WINS = Counter("llm_hedge_wins_total", "Запросы, в которых страховочный повтор ответил первым", ("mode",))
+LLM_DEADLINE_EXCEEDED = Counter("llm_deadline_exceeded_total", "Вызовы модели, не уложившиеся в дедлайн", ("mode",))
+LLM_CIRCUIT_OPEN = Gauge("llm_circuit_open", "Предохранитель вызовов модели разомкнут (1) или нет (0)", ("model",))
+LLM_CIRCUIT_REJECTED = Counter("llm_circuit_rejected_total", "Запросы, отклоненные разомкнутым предохранителем", ("model",))
+LLM_MODEL_CHOICES = Counter("llm_model_choices_total", "Модели, выбранные для запросов генерации", ("model", "lane"))
+LLM_ESCALATIONS = Counter("llm_escalations_total", "Повторы запроса на более сильной модели",
+                          ("from_model", "to_model", "reason"))
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренняя middleware: время и ошибки каждого обработчика, подписанные его именем"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict], Awaitable[Any]], event: TelegramObject,
+                       data: dict) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: количество и время исходящих запросов к Bot API по методам"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            TELEGRAM_SENDS.labels(name, status).inc()
+            TELEGRAM_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def setup_metrics(dp, bot, storage) -> None:
+    """Подключает сбор метрик к диспетчеру, сессии бота и хранилищу FSM"""
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+    if hasattr(storage, "active_sessions"):
+        FSM_ACTIVE_SESSIONS.set_function(storage.active_sessions)
+        FSM_MEMORY_SESSIONS.set_function(storage.memory_sessions)
+        FSM_MEMORY_BYTES.set_function(lambda: storage.memory_bytes)
+    elif hasattr(storage, "storage"):
+        # MemoryStorage хранит записи в словаре storage
+        FSM_ACTIVE_SESSIONS.set_function(
+            lambda: sum(1 for record in storage.storage.values() if record.state is not None))
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Запускает HTTP-сервер с /metrics. Возвращает runner для остановки через runner.cleanup()"""
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
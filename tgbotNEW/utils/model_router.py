@@ -0,0 +1,101 @@
+# utils/model_router.py
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class _ModelStats:
+    __slots__ = ("seconds_per_question", "parse_yield", "samples")
+
+    def __init__(self):
+        self.seconds_per_question = 0.0
+        self.parse_yield = 1.0
+        self.samples = 0
+
+
+class ModelRouter:
+    """Выбор модели для запроса генерации.
+
+    Для каждой полосы (free, premium, background) задан список моделей от дешевой к сильной.
+    Из него отбрасываются модели, которым запрос велик (max_questions), которые не поддерживают
+    нужный формат ответа, у которых разомкнут предохранитель или скользящая доля принятых
+    парсером вопросов от запрошенных ниже min_yield. Из оставшихся берется первая, у которой
+    скользящее среднее секунд на вопрос укладывается в цель полосы; если не укладывается ни
+    одна - самая быстрая. С вероятностью explore запрос уходит случайной модели, которой он
+    подходит по размеру и формату, чтобы статистика отвергнутых моделей не устаревала навсегда.
+    """
+
+    def __init__(self, tier_models: dict, model_limits: dict, latency_targets: dict, min_yield: float = 0.8,
+                 alpha: float = 0.2, min_samples: int = 5, explore: float = 0.05, rng: random.Random = None):
+        self.tier_models = {lane: list(models) for lane, models in tier_models.items()}
+        self.model_limits = dict(model_limits)
+        self.latency_targets = dict(latency_targets)
+        self.min_yield = min_yield
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.explore = explore
+        self._rng = rng or random.Random()
+        self._stats = {}
+
+    def _get_stats(self, model: str) -> _ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = _ModelStats()
+        return stats
+
+    def _fits(self, model: str, num_questions: int, structured: bool, unavailable) -> bool:
+        limits = self.model_limits.get(model, {})
+        if num_questions > limits.get("max_questions", num_questions):
+            return False
+        if structured and not limits.get("structured_outputs", False):
+            return False
+        return model not in unavailable
+
+    def _seconds_per_question(self, model: str):
+        stats = self._get_stats(model)
+        return stats.seconds_per_question if stats.samples >= self.min_samples else None
+
+    def choose(self, lane: str, num_questions: int, structured: bool = False, unavailable=()) -> str:
+        candidates = self.tier_models.get(lane) or self.tier_models["background"]
+        fitting = [model for model in candidates if self._fits(model, num_questions, structured, unavailable)]
+        if not fitting:
+            # Ни одна модель полосы не подходит: запрос уходит самой сильной, она проверит ответ тем же парсером
+            return candidates[-1]
+        if len(fitting) > 1 and self._rng.random() < self.explore:
+            return self._rng.choice(fitting)
+        reliable = [model for model in fitting
+                    if self._get_stats(model).samples < self.min_samples or self._get_stats(model).parse_yield >= self.min_yield]
+        eligible = reliable or fitting[-1:]
+        target = self.latency_targets.get(lane)
+        observed = {model: self._seconds_per_question(model) for model in eligible}
+        for model in eligible:
+            if target is None or observed[model] is None or observed[model] <= target:
+                return model
+        return min(eligible, key=lambda model: observed[model])
+
+    def escalate(self, model: str, lane: str, structured: bool = False, unavailable=()):
+        """Следующая, более сильная модель полосы для повтора, или None, если сильнее нет"""
+        candidates = self.tier_models.get(lane) or self.tier_models["background"]
+        start = candidates.index(model) + 1 if model in candidates else len(candidates)
+        for stronger in candidates[start:]:
+            if self._fits(stronger, 0, structured, unavailable):
+                return stronger
+        return None
+
+    def observe(self, model: str, duration: float, num_questions: int, accepted: int) -> None:
+        """Обновляет скользящие средние модели по результату запроса на num_questions вопросов"""
+        stats = self._get_stats(model)
+        per_question = duration / max(num_questions, 1)
+        parse_yield = min(accepted / max(num_questions, 1), 1.0)
+        if stats.samples == 0:
+            stats.seconds_per_question, stats.parse_yield = per_question, parse_yield
+        else:
+            stats.seconds_per_question += self.alpha * (per_question - stats.seconds_per_question)
+            stats.parse_yield += self.alpha * (parse_yield - stats.parse_yield)
+        stats.samples += 1
+
+    def get_stats(self) -> dict:
+        return {model: {"seconds_per_question": round(stats.seconds_per_question, 3),
+                        "parse_yield": round(stats.parse_yield, 3), "samples": stats.samples}
+                for model, stats in self._stats.items()}
@@ -1,14 +1,353 @@
 import logging
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import asyncio
+import contextvars
+import random
+import time
+import weakref
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from typing import Callable
 from states import TestState
+from utils.question_pool import QuestionPool
+from utils.question_parser import QUESTIONS_JSON_SCHEMA, QuestionParser, parse_json_questions, parse_questions
+from utils.question_store import get_question_store
+from utils.seen_questions import get_seen_questions
+from utils.single_flight import SingleFlight
+from utils.llm_scheduler import LLMScheduler
+from utils.llm_cache import cache_key, get_llm_cache
+from utils.hedging import HedgeBudget, LatencyTracker, hedged
+from utils.circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
+from utils.model_router import ModelRouter
+from utils import metrics
+from utils.statistics import is_premium_user, try_consume_generation, refund_generation
 from aiogram.fsm.context import FSMContext
 from aiogram import Bot
-from datetime import datetime, timedelta
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_READ_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_MAX_RETRIES,
+    FULL_ENT_CONCURRENCY,
+    GENERATION_RETRIES,
+    GENERATION_RETRY_DELAY,
+    GENERATION_TOPUP_ATTEMPTS,
+    GENERATION_STREAMING,
+    GENERATION_MODEL,
+    GENERATION_COALESCING,
+    GENERATION_MODE,
+    GENERATION_BATCH_MAX_QUESTIONS,
+    GENERATION_ROUTING,
+    GENERATION_MODELS,
+    GENERATION_TIER_MODELS,
+    GENERATION_LATENCY_TARGETS,
+    GENERATION_MIN_YIELD,
+    GENERATION_ROUTER_EXPLORE,
+    LLM_MAX_CONCURRENCY,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_PROMPT_TOKENS,
+    LLM_TOKENS_PER_QUESTION,
+    LLM_LANE_WEIGHTS,
+    LLM_QUEUE_NOTICE,
+    SEEN_QUESTIONS_ENABLED,
+    LLM_CACHE_ENABLED,
+    LLM_DEADLINE_BASE,
+    LLM_DEADLINE_PER_QUESTION,
+    LLM_FIRST_CHUNK_DEADLINE,
+    LLM_HEDGING,
+    LLM_HEDGE_QUANTILE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_BUDGET,
+    LLM_HEDGE_BURST,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET,
+)
 
 logger = logging.getLogger(__name__)
 
-async def generate_questions(client: OpenAI, user_id: int, state: FSMContext, subject: str = None, subject_1: str = None, subject_2: str = None) -> None:
+# Одновременные одинаковые запросы генерации объединяются в один вызов модели
+_single_flight = SingleFlight()
+metrics.LLM_COALESCE_RATIO.set_function(lambda: _single_flight.get_stats()["coalesce_ratio"])
+metrics.LLM_SAVED_TOKENS.set_function(lambda: _single_flight.stats["saved_tokens"])
+
+# Все запросы к модели проходят через общий планировщик: лимит одновременных запросов и токенов в минуту
+_scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_LANE_WEIGHTS)
+metrics.LLM_QUEUE_DEPTH.set_function(_scheduler.waiting)
+
+# Ответы модели на одинаковые запросы выдаются из кэша (память, затем диск)
+if LLM_CACHE_ENABLED:
+    metrics.LLM_CACHE_SAVED_BYTES.set_function(lambda: get_llm_cache().stats["saved_bytes"])
+    metrics.LLM_CACHE_SAVED_TOKENS.set_function(lambda: get_llm_cache().stats["saved_tokens"])
+    metrics.LLM_CACHE_MEMORY_BYTES.set_function(lambda: get_llm_cache().get_stats()["memory_bytes"])
+    metrics.LLM_CACHE_DISK_BYTES.set_function(lambda: get_llm_cache().get_stats()["disk_bytes"])
+
+# Медленный запрос дублируется страховочным (в пределах бюджета), ошибки подряд размыкают предохранитель модели
+_hedge_budget = HedgeBudget(LLM_HEDGE_BUDGET, LLM_HEDGE_BURST)
+_latencies = {}
+_breakers = {}
+metrics.LLM_HEDGE_RATIO.set_function(lambda: _hedge_budget.stats["hedges"] / max(_hedge_budget.stats["requests"], 1))
+
+# Модель выбирается для каждого запроса по его размеру, полосе пользователя и скользящим средним
+# задержки и доли принятых парсером вопросов у каждой модели
+_router = ModelRouter(GENERATION_TIER_MODELS, GENERATION_MODELS, GENERATION_LATENCY_TARGETS,
+                      min_yield=GENERATION_MIN_YIELD, explore=GENERATION_ROUTER_EXPLORE)
+
+CIRCUIT_OPEN_MESSAGE = "⚠️ Сервис генерации вопросов сейчас не отвечает. Попробуйте через пару минут."
+
+# Кто ждет генерацию: пользователь и его полоса в планировщике. Фоновые задачи генерации наследуют
+# контекст задачи, в которой созданы; без контекста (пополнение пула) запрос идет в полосу background.
+_request_context = contextvars.ContextVar("llm_request_context", default=None)
+
+
+# Фоновые задачи потоковой генерации: event loop держит на задачи только слабые ссылки
+_background_tasks = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _background_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка фоновой задачи генерации: {task.exception()!r}")
+
+
+def _set_request_context(bot: Bot, user_id: int, is_premium: bool) -> None:
+    _request_context.set({"bot": bot, "user_id": user_id, "lane": "premium" if is_premium else "free",
+                          "notified": False})
+
+
+# Пользователи, ожидающие общий запрос SingleFlight: ключ -> их контексты запроса. Общий запрос идет
+# в задаче с контекстом первого пользователя, поэтому остальные передаются ему этим списком
+_flight_members = {}
+
+
+@contextmanager
+def _flight_member(flight_key):
+    """Записывает пользователя текущего контекста в ожидающие общий запрос flight_key"""
+    members = _flight_members.setdefault(flight_key, [])
+    context = _request_context.get()
+    if context is not None:
+        members.append(context)
+    try:
+        yield members
+    finally:
+        if context is not None:
+            members.remove(context)
+        if not members and _flight_members.get(flight_key) is members:
+            del _flight_members[flight_key]
+
+
+def _share_context(members: list) -> None:
+    """Вызывается в задаче общего запроса: уведомление об очереди и фильтр кэша по виденным вопросам
+    относятся ко всем ожидающим, а не только к первому"""
+    context = _request_context.get()
+    if context is not None:
+        _request_context.set({**context, "members": members})
+
+
+async def _shared_call(members: list, coro):
+    _share_context(members)
+    return await coro
+
+
+async def _shared_stream(members: list, stream):
+    _share_context(members)
+    async for item in stream:
+        yield item
+
+
+@asynccontextmanager
+async def _llm_slot(num_questions: int):
+    """Слот планировщика на один запрос к модели с оценкой его стоимости в токенах"""
+    cost = LLM_PROMPT_TOKENS + num_questions * LLM_TOKENS_PER_QUESTION
+    context = _request_context.get()
+    if context is None:
+        user_key, lane, on_queued = "background", "background", None
+    else:
+        user_key, lane = context["user_id"], context["lane"]
+
+        async def on_queued(position: int) -> None:
+            if not LLM_QUEUE_NOTICE:
+                return
+            # Одно сообщение на генерацию, даже если она состоит из нескольких запросов; общий запрос
+            # (SingleFlight) ждут все присоединившиеся к нему пользователи
+            for member in list(context.get("members") or [context]):
+                if not member["notified"]:
+                    member["notified"] = True
+                    await member["bot"].send_message(
+                        member["user_id"],
+                        f"⏳ Сейчас много запросов на генерацию, вы в очереди: {position}. Вопросы придут автоматически."
+                    )
+    async with _scheduler.slot(user_key, lane, cost, on_queued) as ticket:
+        metrics.LLM_QUEUE_WAIT.labels(lane).observe(time.monotonic() - ticket.enqueued_at)
+        yield ticket
+
+
+def get_scheduler_stats() -> dict:
+    return _scheduler.get_stats()
+
+
+def set_llm_share(share: float) -> None:
+    """Оставляет процессу долю share общих лимитов модели: при нескольких воркерах лимиты аккаунта делятся"""
+    global _scheduler
+    _scheduler = LLMScheduler(max(1, int(LLM_MAX_CONCURRENCY * share)), int(LLM_TOKENS_PER_MINUTE * share),
+                              LLM_LANE_WEIGHTS)
+    metrics.LLM_QUEUE_DEPTH.set_function(_scheduler.waiting)
+
+
+def _get_breaker(model: str) -> CircuitBreaker:
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker(
+            model, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET,
+            on_state_change=lambda state: metrics.LLM_CIRCUIT_OPEN.labels(model).set(int(state != CLOSED))
+        )
+    return breaker
+
+
+def _lane() -> str:
+    context = _request_context.get()
+    return "background" if context is None else context["lane"]
+
+
+def _unavailable_models() -> set:
+    return {model for model, breaker in _breakers.items() if not breaker.allows()}
+
+
+def _choose_model(num_questions: int, structured: bool = False) -> str:
+    """Модель для запроса на num_questions вопросов; structured - нужен ответ по JSON-схеме"""
+    if not GENERATION_ROUTING:
+        return GENERATION_MODEL
+    lane = _lane()
+    model = _router.choose(lane, num_questions, structured, _unavailable_models())
+    metrics.LLM_MODEL_CHOICES.labels(model, lane).inc()
+    return model
+
+
+def _escalate(model: str, reason: str, structured: bool = False):
+    """Более сильная модель полосы для повтора запроса или None, если сильнее нет"""
+    if not GENERATION_ROUTING:
+        return None
+    stronger = _router.escalate(model, _lane(), structured, _unavailable_models())
+    if stronger is not None:
+        metrics.LLM_ESCALATIONS.labels(model, stronger, reason).inc()
+    return stronger
+
+
+async def _with_escalation(model: str, request, structured: bool = False) -> tuple:
+    """Выполняет request(model); если модель так и не ответила, один раз повторяет на более сильной.
+
+    Возвращает (модель, которая ответила, результат).
+    """
+    try:
+        return model, await request(model)
+    except Exception as e:
+        stronger = _escalate(model, "error", structured)
+        if stronger is None:
+            raise
+        logger.warning(f"Модель {model} не ответила ({e}), повторяем запрос на {stronger}")
+        return stronger, await request(stronger)
+
+
+def get_router_stats() -> dict:
+    return _router.get_stats()
+
+
+def _call_deadline(num_questions: int) -> float:
+    return LLM_DEADLINE_BASE + LLM_DEADLINE_PER_QUESTION * num_questions
+
+
+async def _call_model(mode: str, model: str, num_questions: int, call, deadline: float, on_discard=None):
+    """Один вызов модели: предохранитель, дедлайн и страховочный повтор, если ответ задерживается.
+
+    Повтор отправляется, когда вызов идет дольше квантиля LLM_HEDGE_QUANTILE недавних вызовов того
+    же вида (mode и количество вопросов), и только в пределах бюджета страховочных запросов.
+    """
+    breaker = _get_breaker(model)
+    try:
+        breaker.check()
+    except CircuitOpenError:
+        metrics.LLM_CIRCUIT_REJECTED.labels(model).inc()
+        raise
+    tracker = _latencies.get((mode, num_questions))
+    if tracker is None:
+        tracker = _latencies[(mode, num_questions)] = LatencyTracker()
+    delay = None
+    if LLM_HEDGING:
+        observed = tracker.quantile(LLM_HEDGE_QUANTILE)
+        if observed is not None:
+            delay = max(observed, LLM_HEDGE_MIN_DELAY)
+    started = time.perf_counter()
+    try:
+        result, hedge_won = await asyncio.wait_for(hedged(call, delay, _hedge_budget, on_discard), deadline)
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        metrics.LLM_DEADLINE_EXCEEDED.labels(mode).inc()
+        raise asyncio.TimeoutError(f"модель не ответила за {deadline:.0f} c")
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    tracker.observe(time.perf_counter() - started)
+    if hedge_won:
+        metrics.LLM_HEDGE_WINS.labels(mode).inc()
+    return result
+
+
+async def _open_stream(client: AsyncOpenAI, params: dict) -> tuple:
+    """Открывает потоковый ответ и ждет первый фрагмент: задержка потока - это время до него"""
+    stream = await client.chat.completions.create(**params, stream=True, stream_options={"include_usage": True})
+    try:
+        return stream, await anext(stream, None)
+    except BaseException:
+        await stream.close()
+        raise
+
+
+async def _close_stream(opened: tuple) -> None:
+    await opened[0].close()
+
+
+async def _with_first(first_chunk, stream):
+    if first_chunk is not None:
+        yield first_chunk
+    async for chunk in stream:
+        yield chunk
+
+
+def create_openai_client(api_key: str = OPENAI_API_KEY, base_url: str = None) -> AsyncOpenAI:
+    """Создает асинхронный клиент OpenAI с общим пулом keep-alive соединений.
+
+    Клиент создается один раз в main.py и разделяется всеми обработчиками через dp['openai_client'].
+    """
+    http_client = DefaultAsyncHttpxClient(
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+async def generate_questions(client: AsyncOpenAI, bot: Bot, user_id: int, state: FSMContext, subject: str = None, subject_1: str = None, subject_2: str = None,
+                             question_pool: QuestionPool = None) -> None:
     is_premium = await is_premium_user(user_id)
     num_questions = 10 if is_premium else 5
     subjects_to_generate = []
@@ -19,10 +358,12 @@ async def generate_questions(client: OpenAI, user_id: int, state: FSMContext, su
         subjects_to_generate.extend([subject_1, subject_2])
 
     if not subjects_to_generate:
-        await state.bot.send_message(user_id, "⚠️ Пожалуйста, выберите предмет для начала теста.", show_alert=True)
+        await bot.send_message(user_id, "⚠️ Пожалуйста, выберите предмет для начала теста.")
         return
 
-    if not is_premium and not await can_generate_questions(user_id):
+    # Проверка и списание лимита одной операцией: параллельные нажатия не превысят лимит
+    if not is_premium and not await try_consume_generation(user_id):
+        metrics.QUOTA_DENIALS.labels("free_daily_limit").inc()
         premium_info = (
             "🚀 <b>Хотите больше возможностей? Оформите Premium подписку!</b>\n\n"
             "💎 <b>Преимущества Premium:</b>\n"
@@ -30,73 +371,578 @@ async def generate_questions(client: OpenAI, user_id: int, state: FSMContext, su
             "    - Неограниченное количество генераций вопросов в день.\n\n"
             "Чтобы узнать больше о Premium и способах подключения, нажмите /premium (раздел в разработке)."
         )
-        await state.bot.send_message(
+        await bot.send_message(
             user_id,
             f"⚠️ Достигнут лимит бесплатных генераций вопросов на сегодня (4 раза).\n\n{premium_info}",
             reply_markup=await get_main_menu_keyboard()
         )
         return
 
-    all_questions_combined = []
-    all_correct_answers_combined = []
+    _set_request_context(bot, user_id, is_premium)
+    question_ids = []
+    answer_keys = []
+    generation_pending = []
+    streamed_subjects = []
     generated_subjects = []
 
+    seen = get_seen_questions() if SEEN_QUESTIONS_ENABLED else None
+    skip_seen = (lambda question: seen.is_seen(user_id, question)) if seen else None
+    if seen:
+        await seen.preload(user_id)
+
     try:
+        # Сначала пробуем выдать готовые вопросы из пула (кроме уже виденных), иначе генерируем их сразу
+        ready = {}
         for sub in subjects_to_generate:
-            prompt = (
-                f"Сгенерируй {num_questions} тестовых вопросов по предмету '{sub}' для подготовки к ЕНТ. "
-                "Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D) и один правильный. "
-                "Формат:\n\nВопрос: ...\nA) ...\nB) ...\nC) ...\nD) ...\nПравильный ответ: X\n\n"
-                "Вопросы должны быть разного уровня сложности."
-            )
-            response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            generated_text = response.choices[0].message.content.strip()
-            logger.info(f"Сгенерированные вопросы по {sub}:\n{generated_text}")
-
-            question_blocks = [block.strip() for block in generated_text.split("\n\n") if block.strip()]
-            subject_questions = []
-            subject_correct_answers = []
-            for block in question_blocks:
-                lines = [line.strip() for line in block.split("\n") if line.strip()]
-                if len(lines) < 6:
-                    continue
-                question_text = "\n".join(lines[:-1])
-                correct_answer = lines[-1].split(":")[-1].strip().upper()
-                if correct_answer in ("A", "B", "C", "D"):
-                    subject_questions.append(question_text)
-                    subject_correct_answers.append(correct_answer)
-
-            all_questions_combined.append(subject_questions)
-            all_correct_answers_combined.append(subject_correct_answers)
+            pooled = question_pool.take(sub, num_questions, skip=skip_seen) if question_pool else None
+            if pooled:
+                ready[sub] = pooled
+        missing_subjects = [sub for sub in subjects_to_generate if sub not in ready]
+        if GENERATION_MODE == "batched" and len(missing_subjects) > 1:
+            # Несколько предметов одним запросом со структурированным ответом
+            for sub, result in (await _generate_batched(client, {sub: num_questions for sub in missing_subjects})).items():
+                if isinstance(result, Exception):
+                    raise result
+                ready[sub] = await _without_seen(client, user_id, sub, result, num_questions)
+
+        for subject_index, sub in enumerate(subjects_to_generate):
+            if sub in ready:
+                subject_questions, subject_correct_answers = ready[sub]
+            elif GENERATION_STREAMING:
+                # Вопросы будут дописываться в состояние по мере прихода из потока
+                subject_questions, subject_correct_answers = [], []
+                streamed_subjects.append((subject_index, sub))
+            else:
+                subject_questions, subject_correct_answers = await _without_seen(
+                    client, user_id, sub, await _generate_subject_questions(client, sub, num_questions), num_questions
+                )
+            if seen:
+                seen.mark_seen(user_id, subject_questions)
+
+            # В сессии храним только id вопросов и упакованную строку правильных ответов
+            question_ids.append(await get_question_store().add_many(subject_questions))
+            answer_keys.append("".join(subject_correct_answers))
+            generation_pending.append(not subject_questions)
             generated_subjects.append(sub)
 
+        generation_id = f"{user_id}:{time.monotonic_ns()}"
         await state.update_data(
-            all_questions=all_questions_combined,
-            all_correct_answers=all_correct_answers_combined,
+            question_ids=question_ids,
+            answer_keys=answer_keys,
+            expected_questions=[num_questions] * len(generated_subjects),
+            generation_pending=generation_pending,
+            generation_id=generation_id,
+            waiting_for_question=False,
             current_question_index=0,
             current_subject_index=0,
-            answers=[]
+            answers=""
         )
-        await send_next_question(state.bot, state, user_id, generated_subjects=generated_subjects)
-        if not is_premium:
-            await increment_generation_counter(user_id)
+        for subject_index, sub in streamed_subjects:
+            _spawn(_stream_subject_into_state(
+                client, bot, state, user_id, generation_id, subject_index, sub, num_questions, generated_subjects
+            ))
+        # Если первый вопрос еще не пришел, send_next_question дождется его через waiting_for_question
+        await send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
 
     except Exception as e:
         logger.error(f"Ошибка при генерации вопросов: {e}")
-        await state.bot.send_message(
+        if not is_premium:
+            await refund_generation(user_id)
+        await bot.send_message(
             user_id,
+            CIRCUIT_OPEN_MESSAGE if isinstance(e, CircuitOpenError) else
             "⚠️ Произошла ошибка при генерации вопросов. Попробуйте позже.",
             reply_markup=await get_main_menu_keyboard()
         )
 
-async def generate_full_ent_questions(client: OpenAI, user_id: int, state: FSMContext, subject_1: str,
+
+async def _without_seen(client: AsyncOpenAI, user_id: int, subject_name: str, generated: tuple,
+                        num_questions: int) -> tuple[list, list]:
+    """Убирает вопросы, которые пользователь уже видел. Вместо выбывших один раз догенерирует недостающие"""
+    if not SEEN_QUESTIONS_ENABLED:
+        return generated
+    seen = get_seen_questions()
+    await seen.preload(user_id)
+    questions, correct_answers = seen.select_unseen(user_id, *generated)
+    missing = num_questions - len(questions)
+    if missing <= 0 or len(questions) == len(generated[0]):
+        # Не хватает не из-за повторов (модель вернула меньше): догенерацией занимается сама генерация
+        return questions[:num_questions], correct_answers[:num_questions]
+    logger.info(f"По {subject_name} для {user_id} отброшено уже виденных: {len(generated[0]) - len(questions)}, "
+                f"догенерируем {missing}")
+    try:
+        extra_questions, extra_answers = await _generate_subject_questions(client, subject_name, missing)
+    except Exception as e:
+        logger.warning(f"Не удалось догенерировать вопросы по {subject_name} вместо виденных: {e}")
+        return questions, correct_answers
+    await seen.preload(user_id)  # За время догенерации фильтры могли вытесниться из кэша
+    questions, correct_answers = seen.select_unseen(user_id, questions + extra_questions, correct_answers + extra_answers)
+    return questions[:num_questions], correct_answers[:num_questions]
+
+
+def _build_prompt(subject_name: str, num_questions: int) -> str:
+    return (
+        f"Сгенерируй {num_questions} тестовых вопросов по предмету '{subject_name}' для подготовки к ЕНТ. "
+        "Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D) и один правильный. "
+        "Формат:\n\nВопрос: ...\nA) ...\nB) ...\nC) ...\nD) ...\nПравильный ответ: X\n\n"
+        "Вопросы должны быть разного уровня сложности."
+    )
+
+
+def get_generation_stats() -> dict:
+    """Счетчики объединения запросов: доля объединенных запросов и сэкономленные токены"""
+    return _single_flight.get_stats()
+
+
+def _add_usage(usage: dict, response_usage, subject_name: str, model: str) -> None:
+    if response_usage is None:
+        return
+    if usage is not None:
+        usage["total_tokens"] += response_usage.total_tokens
+    metrics.LLM_TOKENS.labels(subject_name, model, "prompt").inc(response_usage.prompt_tokens)
+    metrics.LLM_TOKENS.labels(subject_name, model, "completion").inc(response_usage.completion_tokens)
+
+
+def _record_parsed(subject_name: str, accepted: int, rejected: int) -> None:
+    metrics.PARSER_ACCEPTED.labels(subject_name).inc(accepted)
+    metrics.PARSER_REJECTED.labels(subject_name).inc(rejected)
+
+
+def _question_texts(content: str) -> list:
+    return [question.text for question in parse_questions(content)[0]]
+
+
+async def _cache_lookup(params: dict, question_texts: Callable[[str], list] = _question_texts):
+    """Ответ модели на такой же запрос из кэша. Возвращает (ключ, ответ или None); без кэша - (None, None).
+
+    Пополнение пула (запрос без пользователя) кэш не читает: иначе в пул снова и снова возвращались бы
+    одни и те же варианты, но его ответ сохраняется и сменяет самый старый вариант. Пользователю
+    выдается только вариант, ни одного вопроса (question_texts(ответ)) из которого он еще не видел
+    (для общего запроса - никто из ожидающих); если таких нет, запрос идет к модели.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None, None
+    key = cache_key(params)
+    context = _request_context.get()
+    if context is None:
+        metrics.LLM_CACHE_LOOKUPS.labels("bypass").inc()
+        return key, None
+    accept = None
+    if SEEN_QUESTIONS_ENABLED:
+        seen = get_seen_questions()
+        user_ids = {member["user_id"] for member in context.get("members") or [context]}
+        for user_id in user_ids:
+            await seen.preload(user_id)
+
+        def accept(content: str) -> bool:
+            texts = question_texts(content)
+            return not any(seen.any_seen(user_id, texts) for user_id in user_ids)
+    content, tier = await get_llm_cache().get(key, accept)
+    metrics.LLM_CACHE_LOOKUPS.labels(tier).inc()
+    return key, content
+
+
+async def _cache_store(key: str, content: str, tokens: int) -> None:
+    if key is not None:
+        await get_llm_cache().put(key, content, tokens or 0)
+
+
+async def _request_questions(client: AsyncOpenAI, subject_name: str, num_questions: int, model: str,
+                             usage: dict = None) -> tuple[list, int]:
+    """Один запрос к модели (с повторами при ошибке). Возвращает (вопросы, количество отброшенных блоков)"""
+    params = {"model": model, "messages": [{"role": "user", "content": _build_prompt(subject_name, num_questions)}],
+              "temperature": 0.7}
+    key, cached = await _cache_lookup(params)
+    if cached is not None:
+        questions, rejected = parse_questions(cached)
+        random.shuffle(questions)  # Один и тот же сохраненный ответ разные пользователи получают в разном порядке
+        return questions, rejected
+    for attempt in range(1, GENERATION_RETRIES + 2):
+        try:
+            async with _llm_slot(num_questions) as ticket:
+                started = time.perf_counter()
+                response = await _call_model("complete", model, num_questions,
+                                             lambda: client.chat.completions.create(**params),
+                                             _call_deadline(num_questions))
+                ticket.tokens = response.usage.total_tokens if response.usage else None
+            duration = time.perf_counter() - started
+            metrics.LLM_DURATION.labels(subject_name, model, "complete").observe(duration)
+            break
+        except CircuitOpenError:
+            raise  # Повторять бессмысленно: предохранитель отклонит и повтор
+        except Exception as e:
+            metrics.LLM_ERRORS.labels(subject_name, model).inc()
+            if attempt > GENERATION_RETRIES:
+                raise
+            logger.warning(f"Ошибка генерации по {subject_name} (попытка {attempt}): {e}")
+            await asyncio.sleep(GENERATION_RETRY_DELAY * attempt)
+
+    _add_usage(usage, response.usage, subject_name, model)
+    generated_text = response.choices[0].message.content.strip()
+    logger.debug(f"Сгенерированные вопросы по {subject_name}:\n{generated_text}")
+    questions, rejected = parse_questions(generated_text)
+    _record_parsed(subject_name, len(questions), rejected)
+    _router.observe(model, duration, num_questions, len(questions))
+    if questions and not rejected:
+        # В кэш попадают только ответы, разобранные целиком: иначе каждое попадание требовало бы догенерации
+        await _cache_store(key, generated_text, response.usage.total_tokens if response.usage else 0)
+    return questions, rejected
+
+
+async def _generate_subject_questions(client: AsyncOpenAI, subject_name: str, num_questions: int,
+                                      model: str = None) -> tuple[list, list]:
+    """Генерирует вопросы по предмету. Одинаковые одновременные запросы получают результат одного вызова модели.
+
+    Без model модель выбирает маршрутизатор.
+    """
+    model = model or _choose_model(num_questions)
+    if not GENERATION_COALESCING:
+        return await _generate_subject_questions_once(client, subject_name, num_questions, model)
+    flight_key = (subject_name, num_questions, model)
+    with _flight_member(("do", *flight_key)) as members:
+        questions, correct_answers = await _single_flight.do(flight_key, lambda usage: _shared_call(
+            members, _generate_subject_questions_once(client, subject_name, num_questions, model, usage)
+        ))
+    # Каждый ожидающий получает свою копию вопросов в своем порядке
+    order = random.sample(range(len(questions)), len(questions))
+    return [questions[i] for i in order], [correct_answers[i] for i in order]
+
+
+async def _generate_subject_questions_once(client: AsyncOpenAI, subject_name: str, num_questions: int, model: str,
+                                           usage: dict = None) -> tuple[list, list]:
+    """Генерирует и разбирает вопросы по одному предмету, догенерируя отброшенные парсером.
+
+    Догенерация идет на более сильной модели полосы: ответ этой модели парсер уже не принял.
+    """
+    model, (questions, rejected) = await _with_escalation(
+        model, lambda attempt_model: _request_questions(client, subject_name, num_questions, attempt_model, usage)
+    )
+    for _ in range(GENERATION_TOPUP_ATTEMPTS):
+        missing = num_questions - len(questions)
+        if missing <= 0:
+            break
+        model = _escalate(model, "parse") or model
+        logger.info(f"По {subject_name} получено {len(questions)}/{num_questions} (отброшено {rejected}), "
+                    f"догенерируем {missing} на {model}")
+        extra, extra_rejected = await _request_questions(client, subject_name, missing, model, usage)
+        questions.extend(extra)
+        rejected += extra_rejected
+    questions = questions[:num_questions]
+    logger.info(f"Сгенерировано вопросов по {subject_name}: {len(questions)}/{num_questions}, отброшено блоков: {rejected}")
+    return [question.text for question in questions], [question.answer for question in questions]
+
+
+def _build_batch_prompt(subjects: dict) -> str:
+    subject_lines = "\n".join(f"- {subject_name}: {count}" for subject_name, count in subjects.items())
+    return (
+        "Сгенерируй тестовые вопросы для подготовки к ЕНТ по следующим предметам "
+        f"(предмет: количество вопросов):\n{subject_lines}\n"
+        "Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D) и один правильный. "
+        "Вопросы должны быть разного уровня сложности. Название предмета в ответе пиши точно как в списке."
+    )
+
+
+def _split_batches(subjects: dict) -> list:
+    """Делит предметы на пакеты не больше GENERATION_BATCH_MAX_QUESTIONS вопросов (предмет не делится)"""
+    batches = []
+    current, current_size = {}, 0
+    for subject_name, count in subjects.items():
+        if current and current_size + count > GENERATION_BATCH_MAX_QUESTIONS:
+            batches.append(current)
+            current, current_size = {}, 0
+        current[subject_name] = count
+        current_size += count
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _request_batch(client: AsyncOpenAI, subjects: dict, model: str) -> dict:
+    """Один запрос на несколько предметов со структурированным ответом. Возвращает {предмет: вопросы}"""
+    params = {"model": model, "messages": [{"role": "user", "content": _build_batch_prompt(subjects)}],
+              "temperature": 0.7, "response_format": {"type": "json_schema", "json_schema": QUESTIONS_JSON_SCHEMA}}
+    key, cached = await _cache_lookup(params, lambda content: [
+        question.text for questions in parse_json_questions(content, list(subjects))[0].values() for question in questions
+    ])
+    if cached is not None:
+        questions, _ = parse_json_questions(cached, list(subjects))
+        for subject_questions in questions.values():
+            random.shuffle(subject_questions)
+        return questions
+    total = sum(subjects.values())
+    for attempt in range(1, GENERATION_RETRIES + 2):
+        try:
+            async with _llm_slot(total) as ticket:
+                started = time.perf_counter()
+                response = await _call_model("batch", model, total,
+                                             lambda: client.chat.completions.create(**params), _call_deadline(total))
+                ticket.tokens = response.usage.total_tokens if response.usage else None
+            duration = time.perf_counter() - started
+            metrics.LLM_DURATION.labels("batch", model, "batch").observe(duration)
+            break
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            metrics.LLM_ERRORS.labels("batch", model).inc()
+            if attempt > GENERATION_RETRIES:
+                raise
+            logger.warning(f"Ошибка пакетной генерации по {', '.join(subjects)} (попытка {attempt}): {e}")
+            await asyncio.sleep(GENERATION_RETRY_DELAY * attempt)
+
+    _add_usage(None, response.usage, "batch", model)
+    generated_text = response.choices[0].message.content or ""
+    logger.debug(f"Пакетная генерация по {', '.join(subjects)}:\n{generated_text}")
+    questions, rejected = parse_json_questions(generated_text, list(subjects))
+    for subject_name in subjects:
+        _record_parsed(subject_name, len(questions[subject_name]), rejected[subject_name])
+    _router.observe(model, duration, total, sum(min(len(questions[name]), count) for name, count in subjects.items()))
+    if not any(rejected.values()) and all(len(questions[name]) >= count for name, count in subjects.items()):
+        await _cache_store(key, generated_text, response.usage.total_tokens if response.usage else 0)
+    return questions
+
+
+async def _generate_batch(client: AsyncOpenAI, subjects: dict) -> dict:
+    model, questions = await _with_escalation(
+        _choose_model(sum(subjects.values()), structured=True),
+        lambda attempt_model: _request_batch(client, subjects, attempt_model), structured=True
+    )
+    result = {}
+    for subject_name, count in subjects.items():
+        subject_questions = questions[subject_name][:count]
+        missing = count - len(subject_questions)
+        if missing > 0:
+            # Недостающее по предмету догенерируем обычным запросом на более сильной модели
+            topup_model = _escalate(model, "parse") or model
+            logger.info(f"Пакетная генерация дала по {subject_name} {len(subject_questions)}/{count}, "
+                        f"догенерируем {missing} на {topup_model}")
+            texts, answers = await _generate_subject_questions(client, subject_name, missing, topup_model)
+            result[subject_name] = ([question.text for question in subject_questions] + texts,
+                                    [question.answer for question in subject_questions] + answers)
+        else:
+            result[subject_name] = ([question.text for question in subject_questions],
+                                    [question.answer for question in subject_questions])
+    return result
+
+
+async def _generate_batched(client: AsyncOpenAI, subjects: dict) -> dict:
+    """Генерирует несколько предметов минимальным числом запросов.
+
+    Возвращает {предмет: (вопросы, правильные ответы)}; если пакет не удался, вместо результата
+    по его предметам лежит исключение.
+    """
+    batches = _split_batches(subjects)
+    results = await asyncio.gather(*(_generate_batch(client, batch) for batch in batches), return_exceptions=True)
+    generated = {}
+    for batch, result in zip(batches, results):
+        for subject_name in batch:
+            generated[subject_name] = result if isinstance(result, Exception) else result[subject_name]
+    return generated
+
+
+async def _stream_questions_once(client: AsyncOpenAI, subject_name: str, num_questions: int, model: str,
+                                 parser: QuestionParser, usage: dict = None):
+    """Один потоковый запрос: отдает Question, как только блок вопроса пришел целиком"""
+    params = {"model": model, "messages": [{"role": "user", "content": _build_prompt(subject_name, num_questions)}],
+              "temperature": 0.7}
+    key, cached = await _cache_lookup(params)
+    if cached is not None:
+        # Сохраненный ответ приходит целиком сразу, поэтому его можно перемешать, не задерживая первый вопрос
+        questions = parser.feed(cached) + parser.close()
+        random.shuffle(questions)
+        for question in questions:
+            yield question
+        return
+    for attempt in range(1, GENERATION_RETRIES + 2):
+        yielded = 0
+        parts = []
+        try:
+            # Слот занят, пока идет поток: это тоже запрос к модели
+            async with _llm_slot(num_questions) as ticket:
+                started = time.perf_counter()
+                stream, first_chunk = await _call_model("stream", model, num_questions,
+                                                        lambda: _open_stream(client, params),
+                                                        LLM_FIRST_CHUNK_DEADLINE, _close_stream)
+                try:
+                    async for chunk in _with_first(first_chunk, stream):
+                        if chunk.usage is not None:
+                            ticket.tokens = chunk.usage.total_tokens
+                        _add_usage(usage, chunk.usage, subject_name, model)
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta:
+                            continue
+                        parts.append(delta)
+                        for question in parser.feed(delta):
+                            yielded += 1
+                            yield question
+                finally:
+                    await stream.close()
+            for question in parser.close():
+                yield question
+            duration = time.perf_counter() - started
+            metrics.LLM_DURATION.labels(subject_name, model, "stream").observe(duration)
+            _record_parsed(subject_name, parser.accepted, parser.rejected)
+            _router.observe(model, duration, num_questions, parser.accepted)
+            if parser.accepted and not parser.rejected:
+                await _cache_store(key, "".join(parts).strip(), ticket.tokens)
+            return
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            metrics.LLM_ERRORS.labels(subject_name, model).inc()
+            # Повторять можно только если пользователю еще ничего не отдали
+            if yielded or attempt > GENERATION_RETRIES:
+                raise
+            logger.warning(f"Ошибка потоковой генерации по {subject_name} (попытка {attempt}): {e}")
+            await asyncio.sleep(GENERATION_RETRY_DELAY * attempt)
+
+
+async def _stream_subject_questions(client: AsyncOpenAI, subject_name: str, num_questions: int):
+    """Потоковая генерация: отдает (вопрос, правильный ответ) сразу, как только блок вопроса пришел целиком.
+
+    Одинаковые одновременные запросы читают один поток модели. Порядок вопросов здесь не
+    перемешивается: это задержало бы первый вопрос до конца генерации.
+    """
+    model = _choose_model(num_questions)
+    if not GENERATION_COALESCING:
+        async for item in _stream_subject_questions_once(client, subject_name, num_questions, model):
+            yield item
+        return
+    flight_key = (subject_name, num_questions, model)
+    with _flight_member(("stream", *flight_key)) as members:
+        stream = _single_flight.stream(flight_key, lambda usage: _shared_stream(
+            members, _stream_subject_questions_once(client, subject_name, num_questions, model, usage)
+        ))
+        async for item in stream:
+            yield item
+
+
+async def _stream_subject_questions_once(client: AsyncOpenAI, subject_name: str, num_questions: int, model: str,
+                                         usage: dict = None):
+    received = 0
+    rejected = 0
+    for attempt in range(GENERATION_TOPUP_ATTEMPTS + 1):
+        missing = num_questions - received
+        if missing <= 0:
+            break
+        if attempt:
+            model = _escalate(model, "parse") or model
+            logger.info(f"По {subject_name} получено {received}/{num_questions} (отброшено {rejected}), "
+                        f"догенерируем {missing} на {model}")
+        while True:
+            parser = QuestionParser()
+            streamed = 0
+            try:
+                # aclosing освобождает слот планировщика сразу, даже если поток прерван раньше конца
+                async with aclosing(_stream_questions_once(client, subject_name, missing, model, parser, usage)) as questions:
+                    async for question in questions:
+                        if received >= num_questions:
+                            break
+                        received += 1
+                        streamed += 1
+                        yield question.text, question.answer
+                break
+            except Exception as e:
+                # На более сильную модель переходим, только если из этого потока пользователю еще ничего не отдали
+                stronger = None if streamed else _escalate(model, "error")
+                if stronger is None:
+                    raise
+                logger.warning(f"Модель {model} не ответила ({e}), повторяем запрос на {stronger}")
+                model = stronger
+        rejected += parser.rejected
+
+
+async def _stream_unseen_questions(client: AsyncOpenAI, user_id: int, subject_name: str, num_questions: int):
+    """Потоковая генерация без вопросов, которые пользователь уже видел.
+
+    Вместо пропущенных догенерирует недостающие отдельным потоком (не больше GENERATION_TOPUP_ATTEMPTS
+    раз), чтобы тест не стал короче. Выданные вопросы вызывающий отмечает виденными сам, поэтому
+    повтор внутри догенерации тоже отсеивается.
+    """
+    if not SEEN_QUESTIONS_ENABLED:
+        async for item in _stream_subject_questions(client, subject_name, num_questions):
+            yield item
+        return
+    seen = get_seen_questions()
+    received = 0
+    for attempt in range(GENERATION_TOPUP_ATTEMPTS + 1):
+        missing = num_questions - received
+        if attempt:
+            logger.info(f"По {subject_name} для {user_id} пропущено уже виденных: {skipped}, догенерируем {missing}")
+        skipped = 0
+        try:
+            async for question, correct_answer in _stream_subject_questions(client, subject_name, missing):
+                # Пока ждали вопрос, фильтры могли вытесниться из кэша; если они в кэше, preload не ждет
+                await seen.preload(user_id)
+                if seen.is_seen(user_id, question):
+                    skipped += 1
+                    continue
+                received += 1
+                yield question, correct_answer
+        except Exception as e:
+            if not attempt:
+                raise
+            logger.warning(f"Не удалось догенерировать вопросы по {subject_name} вместо виденных: {e}")
+            return
+        if not skipped or received >= num_questions:
+            # Не хватает не из-за повторов (модель вернула меньше): догенерацией занимается сам поток
+            return
+
+
+async def _stream_subject_into_state(client: AsyncOpenAI, bot: Bot, state: FSMContext, user_id: int, generation_id: str,
+                                     subject_index: int, subject_name: str, num_questions: int,
+                                     generated_subjects: list) -> None:
+    """Фоновая задача: дописывает вопросы предмета в состояние и отправляет вопрос, если пользователь его ждет"""
+    received = 0
+    error = None
+    seen = get_seen_questions() if SEEN_QUESTIONS_ENABLED else None
+    try:
+        async for question, correct_answer in _stream_unseen_questions(client, user_id, subject_name, num_questions):
+            qid = await get_question_store().add(question)
+            async with get_chat_lock(user_id):
+                data = await state.get_data()
+                if data.get("generation_id") != generation_id:
+                    return  # Пользователь уже начал другой тест
+                question_ids = list(data["question_ids"])
+                answer_keys = list(data["answer_keys"])
+                question_ids[subject_index] = question_ids[subject_index] + [qid]
+                answer_keys[subject_index] += correct_answer
+                waiting = data.get("waiting_for_question", False)
+                await state.update_data(question_ids=question_ids, answer_keys=answer_keys,
+                                        waiting_for_question=False)
+            if seen:
+                seen.mark_seen(user_id, [question])
+            received += 1
+            if waiting:
+                await send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
+    except Exception as e:
+        error = e
+        logger.error(f"Ошибка потоковой генерации вопросов по {subject_name}: {e}")
+    finally:
+        async with get_chat_lock(user_id):
+            data = await state.get_data()
+            is_current = data.get("generation_id") == generation_id
+            waiting = is_current and data.get("waiting_for_question", False)
+            nothing_generated = False
+            if is_current:
+                generation_pending = list(data["generation_pending"])
+                generation_pending[subject_index] = False
+                await state.update_data(generation_pending=generation_pending, waiting_for_question=False)
+                nothing_generated = not any(generation_pending) and not any(data["question_ids"])
+        if is_current and not received:
+            await bot.send_message(user_id, CIRCUIT_OPEN_MESSAGE if isinstance(error, CircuitOpenError) else
+                                   f"⚠️ Не удалось сгенерировать вопросы по предмету {subject_name}.")
+        if nothing_generated:
+            # Тест не состоялся: возвращаем списанную генерацию
+            await refund_generation(user_id)
+        logger.info(f"Потоковая генерация по {subject_name} для {user_id} завершена: {received}/{num_questions}")
+        if waiting:
+            await send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
+
+
+async def generate_full_ent_questions(client: AsyncOpenAI, bot: Bot, user_id: int, state: FSMContext, subject_1: str,
                                       subject_2: str) -> None:
     is_premium = await is_premium_user(user_id)
+    _set_request_context(bot, user_id, is_premium)
     num_questions = {"history": 20, "math_literacy": 10, "reading_literacy": 10, "profile1": 40, "profile2": 40}
     subjects = {
         "history": "История Казахстана",
@@ -105,83 +951,193 @@ async def generate_full_ent_questions(client: OpenAI, user_id: int, state: FSMCo
         "profile1": subject_1,
         "profile2": subject_2,
     }
-    all_questions = {}
-    all_correct_answers = {}
+    question_ids = {}
+    answer_keys = {}
+
+    if GENERATION_STREAMING and GENERATION_MODE != "batched":
+        await _start_full_ent_streaming(client, bot, user_id, state, subjects, num_questions)
+        return
+
+    await bot.send_message(user_id, "⏳ Идет генерация вопросов для пробного ЕНТ. Это может занять некоторое время...")
+
+    # Предметы генерируются параллельно, но не больше FULL_ENT_CONCURRENCY запросов одновременно
+    semaphore = asyncio.Semaphore(FULL_ENT_CONCURRENCY)
+    durations = {}
 
-    await state.bot.send_message(user_id, "⏳ Идет генерация вопросов для пробного ЕНТ. Это может занять некоторое время...")
+    async def generate_one(key: str, subject_name: str) -> tuple[list, list]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                generated = await _generate_subject_questions(client, subject_name, num_questions[key])
+                return await _without_seen(client, user_id, subject_name, generated, num_questions[key])
+            finally:
+                durations[key] = time.perf_counter() - started
 
     try:
-        for key, subject_name in subjects.items():
-            prompt = (
-                f"Сгенерируй {num_questions[key]} тестовых вопросов по предмету '{subject_name}' для подготовки к ЕНТ. "
-                "Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D) и один правильный. "
-                "Формат:\n\nВопрос: ...\nA) ...\nB) ...\nC) ...\nD) ...\nПравильный ответ: X\n\n"
-                "Вопросы должны быть разного уровня сложности."
+        started = time.perf_counter()
+        if GENERATION_MODE == "batched":
+            batched = await _generate_batched(
+                client, {subject_name: num_questions[key] for key, subject_name in subjects.items()}
             )
-            response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
+
+            async def without_seen(key: str, subject_name: str) -> tuple[list, list]:
+                result = batched[subject_name]
+                if isinstance(result, Exception):
+                    raise result
+                return await _without_seen(client, user_id, subject_name, result, num_questions[key])
+
+            results = await asyncio.gather(
+                *(without_seen(key, subject_name) for key, subject_name in subjects.items()),
+                return_exceptions=True
+            )
+            logger.info(f"Пакетная генерация пробного ЕНТ для {user_id}: {time.perf_counter() - started:.2f} c")
+        else:
+            results = await asyncio.gather(
+                *(generate_one(key, subject_name) for key, subject_name in subjects.items()),
+                return_exceptions=True
+            )
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Генерация пробного ЕНТ для {user_id}: параллельно {elapsed:.2f} c, "
+                f"последовательно было бы {sum(durations.values()):.2f} c "
+                f"({', '.join(f'{key}={duration:.2f}' for key, duration in durations.items())})"
             )
-            generated_text = response.choices[0].message.content.strip()
-            logger.info(f"Сгенерированные вопросы по {subject_name}:\n{generated_text}")
-
-            question_blocks = [block.strip() for block in generated_text.split("\n\n") if block.strip()]
-            subject_questions = []
-            subject_correct_answers = []
-            for block in question_blocks:
-                lines = [line.strip() for line in block.split("\n") if line.strip()]
-                if len(lines) < 6:
-                    continue
-                question_text = "\n".join(lines[:-1])
-                correct_answer = lines[-1].split(":")[-1].strip().upper()
-                if correct_answer in ("A", "B", "C", "D"):
-                    subject_questions.append(question_text)
-                    subject_correct_answers.append(correct_answer)
 
-            all_questions[key] = subject_questions
-            all_correct_answers[key] = subject_correct_answers
+        failed_subjects = []
+        for (key, subject_name), result in zip(subjects.items(), results):
+            if isinstance(result, Exception):
+                # Ошибка по одному предмету не отменяет остальные: предмет просто остается пустым
+                logger.error(f"Не удалось сгенерировать вопросы по {subject_name}: {result}")
+                failed_subjects.append(subject_name)
+                result = ([], [])
+            if SEEN_QUESTIONS_ENABLED:
+                get_seen_questions().mark_seen(user_id, result[0])
+            question_ids[key] = await get_question_store().add_many(result[0])
+            answer_keys[key] = "".join(result[1])
 
-        await state.update_data(full_ent_questions=all_questions)
-        await state.update_data(full_ent_correct_answers=all_correct_answers)
+        if len(failed_subjects) == len(subjects):
+            raise next((result for result in results if isinstance(result, CircuitOpenError)),
+                       RuntimeError("не удалось сгенерировать ни один предмет"))
+        if failed_subjects:
+            await bot.send_message(
+                user_id,
+                f"⚠️ Не удалось сгенерировать вопросы по предметам: {', '.join(failed_subjects)}. "
+                "Остальные предметы доступны для прохождения."
+            )
+
+        await state.update_data(full_ent_question_ids=question_ids, full_ent_answer_keys=answer_keys)
         await state.set_state(TestState.full_ent_start_subject)
-        await send_full_ent_start_subject_choice(state.bot, state, user_id)
+        await send_full_ent_start_subject_choice(bot, state, user_id)
 
     except Exception as e:
         logger.error(f"Ошибка при генерации вопросов для полного ЕНТ: {e}")
-        await state.bot.send_message(
+        await bot.send_message(
             user_id,
+            CIRCUIT_OPEN_MESSAGE if isinstance(e, CircuitOpenError) else
             "⚠️ Произошла ошибка при генерации вопросов для пробного ЕНТ. Попробуйте позже.",
             reply_markup=await get_main_menu_keyboard()
         )
 
-# Эти функции теперь должны быть импортированы из других модулей
-async def get_main_menu_keyboard():
-    # ... (реализация в keyboards.py)
-    pass
 
-async def can_generate_questions(user_id: int):
-    # ... (реализация в utils/statistics.py)
-    pass
+async def _start_full_ent_streaming(client: AsyncOpenAI, bot: Bot, user_id: int, state: FSMContext,
+                                    subjects: dict, num_questions: dict) -> None:
+    """Запускает потоковую генерацию всех предметов пробного ЕНТ и сразу предлагает выбрать первый предмет"""
+    generation_id = f"{user_id}:{time.monotonic_ns()}"
+    await state.update_data(
+        full_ent_question_ids={key: [] for key in subjects},
+        full_ent_answer_keys={key: "" for key in subjects},
+        full_ent_expected=dict(num_questions),
+        full_ent_generation_pending=list(subjects),
+        full_ent_waiting=False,
+        generation_id=generation_id,
+    )
+    await state.set_state(TestState.full_ent_start_subject)
+    await send_full_ent_start_subject_choice(bot, state, user_id)
+
+    semaphore = asyncio.Semaphore(FULL_ENT_CONCURRENCY)
+
+    async def stream_one(key: str, subject_name: str) -> None:
+        async with semaphore:
+            await _stream_full_ent_subject_into_state(
+                client, bot, state, user_id, generation_id, key, subject_name, num_questions[key]
+            )
+
+    for key, subject_name in subjects.items():
+        _spawn(stream_one(key, subject_name))
+
+
+async def _stream_full_ent_subject_into_state(client: AsyncOpenAI, bot: Bot, state: FSMContext, user_id: int,
+                                              generation_id: str, key: str, subject_name: str,
+                                              num_questions: int) -> None:
+    """Фоновая задача пробного ЕНТ: дописывает вопросы предмета key в состояние"""
+    received = 0
+    error = None
+    seen = get_seen_questions() if SEEN_QUESTIONS_ENABLED else None
+    try:
+        async for question, correct_answer in _stream_unseen_questions(client, user_id, subject_name, num_questions):
+            qid = await get_question_store().add(question)
+            async with get_chat_lock(user_id):
+                data = await state.get_data()
+                if data.get("generation_id") != generation_id:
+                    return
+                question_ids = dict(data["full_ent_question_ids"])
+                answer_keys = dict(data["full_ent_answer_keys"])
+                question_ids[key] = question_ids[key] + [qid]
+                answer_keys[key] += correct_answer
+                waiting = data.get("full_ent_waiting") and data.get("full_ent_current_subject") == key
+                await state.update_data(full_ent_question_ids=question_ids, full_ent_answer_keys=answer_keys,
+                                        full_ent_waiting=False if waiting else data.get("full_ent_waiting", False))
+            if seen:
+                seen.mark_seen(user_id, [question])
+            received += 1
+            if waiting:
+                await send_next_full_ent_question(bot, state, user_id)
+    except Exception as e:
+        error = e
+        logger.error(f"Ошибка потоковой генерации пробного ЕНТ по {subject_name}: {e}")
+    finally:
+        async with get_chat_lock(user_id):
+            data = await state.get_data()
+            is_current = data.get("generation_id") == generation_id
+            waiting = is_current and data.get("full_ent_waiting") and data.get("full_ent_current_subject") == key
+            if is_current:
+                pending = [pending_key for pending_key in data.get("full_ent_generation_pending", []) if pending_key != key]
+                await state.update_data(full_ent_generation_pending=pending,
+                                        full_ent_waiting=False if waiting else data.get("full_ent_waiting", False))
+        if is_current and not received:
+            await bot.send_message(user_id, CIRCUIT_OPEN_MESSAGE if isinstance(error, CircuitOpenError) else
+                                   f"⚠️ Не удалось сгенерировать вопросы по предмету {subject_name}.")
+        logger.info(f"Потоковая генерация пробного ЕНТ по {subject_name} для {user_id} завершена: {received}/{num_questions}")
+        if waiting:
+            await send_next_full_ent_question(bot, state, user_id)
+
+
+# Блокировки состояния чата: фоновая генерация и обработчики не должны перезаписывать данные друг друга
+_chat_locks = weakref.WeakValueDictionary()
+
 
-async def increment_generation_counter(user_id: int):
-    # ... (реализация в utils/statistics.py)
-    pass
+def get_chat_lock(user_id: int) -> asyncio.Lock:
+    lock = _chat_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[user_id] = lock
+    return lock
+
+
+# Эти функции теперь должны быть импортированы из других модулей
+async def get_main_menu_keyboard():
+    from keyboards import get_main_menu_keyboard as _get_main_menu_keyboard
+    return await _get_main_menu_keyboard()
 
 async def send_next_question(bot: Bot, state: FSMContext, user_id: int, generated_subjects: list = None):
-    # ... (реализация в handlers.py)
-    pass
+    # Импорт внутри функции: handlers сам импортирует этот модуль
+    from handlers import send_next_question as _send_next_question
+    await _send_next_question(bot, state, user_id, generated_subjects=generated_subjects)
 
 async def send_full_ent_start_subject_choice(bot: Bot, state: FSMContext, user_id: int):
-    # ... (реализация в handlers.py)
-    pass
-
-async def is_premium_user(user_id: int):
-    # ... (реализация в utils/statistics.py)
-    user_statistics = await get_user_statistics()
-    return user_statistics.get(user_id, {}).get("is_premium", False)
+    from handlers import send_full_ent_start_subject_choice as _send_full_ent_start_subject_choice
+    await _send_full_ent_start_subject_choice(bot, state, user_id)
 
-async def get_user_statistics():
-    # ... (реализация для получения статистики, например, из базы данных или памяти)
-    return {}
\ No newline at end of file
+async def send_next_full_ent_question(bot: Bot, state: FSMContext, user_id: int):
+    from handlers import send_next_full_ent_question as _send_next_full_ent_question
+    await _send_next_full_ent_question(bot, state, user_id)
\ No newline at end of file
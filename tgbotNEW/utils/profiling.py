@@ -0,0 +1,273 @@
+# utils/profiling.py
+import asyncio
+import logging
+import os
+import selectors
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import FSInputFile, TelegramObject
+from config import (
+    PROFILE_DIR,
+    PROFILE_MAX_SECONDS,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_TOP_N,
+    PROFILE_MEMORY_FRAMES,
+)
+
+logger = logging.getLogger(__name__)
+
+CPU = "cpu"
+MEMORY = "mem"
+
+_ROOT = os.getcwd().replace("\\", "/").rstrip("/") + "/"
+# Ожидание событий в select: event loop простаивает, в CPU-профиль такие сэмплы не попадают
+_IDLE_CODES = frozenset(cls.select.__code__ for cls in (selectors.DefaultSelector, selectors.SelectSelector))
+
+
+def _frame_label(code) -> str:
+    """Имя кадра для collapsed stacks: путь (в проекте - относительный) и имя функции, без ';' и пробелов"""
+    path = code.co_filename.replace("\\", "/")
+    if path.startswith(_ROOT):
+        path = path[len(_ROOT):]
+    else:
+        path = "/".join(path.rsplit("/", 2)[-2:])
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{path}:{name}".replace(";", ",").replace(" ", "_")
+
+
+class StackSampler:
+    """Сэмплирующий профайлер одного потока (потока event loop).
+
+    Фоновый поток каждые interval секунд снимает стек профилируемого потока через
+    sys._current_frames() и считает одинаковые стеки. Сам профилируемый код ничем не
+    инструментируется, поэтому искажение времени - только захват GIL на время снятия стека.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            if frame.f_code in _IDLE_CODES:
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks ("корень;...;лист количество") для flamegraph.pl и speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, top_n: int = 30) -> str:
+        """Таблица функций по собственному (лист стека) и полному (где-либо в стеке) числу сэмплов"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        busy = sum(self.stacks.values()) or 1
+        lines = []
+        for title, counter in (("Собственное время", own), ("Полное время (с вызванными функциями)", total)):
+            lines.append(f"{title}:")
+            lines.append(f"{'сэмплов':>8} {'%':>6}  функция")
+            for frame, count in counter.most_common(top_n):
+                lines.append(f"{count:>8} {100 * count / busy:>6.1f}  {frame}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+def allocation_report(snapshot: tracemalloc.Snapshot, top_n: int = 30) -> str:
+    """Крупнейшие места выделения памяти из снимка tracemalloc: по строкам и по стекам вызовов"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    lines = ["Крупнейшие места выделения (живые объекты, выделенные за время профилирования):",
+             f"{'КиБ':>10} {'блоков':>8}  строка"]
+    for stat in snapshot.statistics("lineno")[:top_n]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:>10.1f} {stat.count:>8}  {frame.filename}:{frame.lineno}")
+    lines += ["", "Те же выделения со стеками вызовов:"]
+    for stat in snapshot.statistics("traceback")[:min(top_n, 10)]:
+        lines.append(f"{stat.size / 1024:.1f} КиБ в {stat.count} блоках:")
+        lines += [f"    {line}" for line in stat.traceback.format(most_recent_first=True)]
+    return "\n".join(lines) + "\n"
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Внешняя middleware обновлений, подключаемая только на время профилирования: считает
+    обработанные обновления и завершает профилирование после заданного их количества"""
+
+    def __init__(self, profiler: "Profiler"):
+        self.profiler = profiler
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict], Awaitable[Any]], event: TelegramObject,
+                       data: dict) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.update_done()
+
+
+class Profiler:
+    """Профилирование по команде администратора: следующие N обновлений или до остановки.
+
+    cpu - сэмплы стеков потока event loop (collapsed stacks для flame graph и таблица функций),
+    mem - снимок tracemalloc с крупнейшими местами выделения. Пока профилирование выключено,
+    middleware не подключена, поток сэмплирования не запущен и tracemalloc не работает, поэтому
+    обработка обновлений ничего на него не тратит. При нескольких воркерах профилируется тот,
+    которому достался чат администратора.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, sample_interval: float = PROFILE_SAMPLE_INTERVAL,
+                 top_n: int = PROFILE_TOP_N, memory_frames: int = PROFILE_MEMORY_FRAMES,
+                 max_seconds: float = PROFILE_MAX_SECONDS):
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.top_n = top_n
+        self.memory_frames = memory_frames
+        self.max_seconds = max_seconds
+        self._session = None
+        self._finish_task = None
+
+    @property
+    def active(self) -> bool:
+        return self._session is not None
+
+    def status(self) -> str:
+        session = self._session
+        if session is None:
+            return "Профилирование выключено"
+        return (f"Профилирование ({', '.join(session['kinds'])}): обработано {session['done']} из "
+                f"{session['updates']} обновлений за {time.monotonic() - session['started']:.0f} c")
+
+    def start(self, dispatcher: Dispatcher, bot: Bot, chat_id: int, kinds: tuple, updates: int) -> bool:
+        """Включает профилирование следующих updates обновлений. Результаты придут в chat_id файлами.
+        Вызывается из потока event loop. False, если профилирование уже идет."""
+        if self._session is not None:
+            return False
+        sampler = None
+        if CPU in kinds:
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+        # Если tracemalloc уже запущен (python -X tracemalloc), он не останавливается после профилирования
+        own_tracing = MEMORY in kinds and not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start(self.memory_frames)
+        middleware = ProfilingMiddleware(self)
+        dispatcher.update.outer_middleware.register(middleware)
+        self._session = {
+            "kinds": kinds, "updates": updates, "done": 0, "started": time.monotonic(),
+            "dispatcher": dispatcher, "bot": bot, "chat_id": chat_id, "sampler": sampler, "middleware": middleware,
+            "own_tracing": own_tracing,
+            "timer": asyncio.get_running_loop().call_later(self.max_seconds, self._finish_later),
+        }
+        logger.info(f"Профилирование {kinds} запущено на {updates} обновлений")
+        return True
+
+    def update_done(self) -> None:
+        session = self._session
+        if session is None:
+            return
+        session["done"] += 1
+        if session["done"] == session["updates"]:
+            self._finish_later()
+
+    def _finish_later(self) -> None:
+        # Отчет собирается и отправляется отдельной задачей, обновление не ждет его
+        self._finish_task = asyncio.create_task(self.finish())
+
+    async def finish(self) -> list:
+        """Останавливает профилирование, сохраняет результаты в directory и отправляет их администратору.
+        Возвращает пути файлов (пустой список, если профилирование не шло)."""
+        session, self._session = self._session, None
+        if session is None:
+            return []
+        session["timer"].cancel()
+        session["dispatcher"].update.outer_middleware.unregister(session["middleware"])
+        elapsed = time.monotonic() - session["started"]
+        files = await asyncio.to_thread(self._write_reports, session, elapsed)
+        logger.info(f"Профилирование завершено: {session['done']} обновлений за {elapsed:.1f} c, файлы {files}")
+        bot, chat_id = session["bot"], session["chat_id"]
+        for path in files:
+            try:
+                await bot.send_document(chat_id, FSInputFile(path))
+            except Exception as e:
+                logger.error(f"Не удалось отправить {path}: {e}")
+        return files
+
+    def _write_reports(self, session: dict, elapsed: float) -> list:
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        header = f"Обновлений: {session['done']} из {session['updates']}, длительность {elapsed:.1f} c\n"
+        files = []
+        sampler = session["sampler"]
+        if sampler is not None:
+            sampler.stop()
+            busy = sampler.samples - sampler.idle
+            summary = (f"{header}Сэмплов: {sampler.samples} (каждые {sampler.interval * 1000:.0f} мс), "
+                       f"event loop занят в {100 * busy / (sampler.samples or 1):.0f}%\n\n")
+            files.append(self._write(f"{prefix}-cpu.folded", sampler.collapsed()))
+            files.append(self._write(f"{prefix}-cpu-top.txt", summary + sampler.top_functions(self.top_n)))
+        if MEMORY in session["kinds"] and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if session["own_tracing"]:
+                tracemalloc.stop()
+            summary = f"{header}Отслежено выделений: сейчас {current / 2 ** 20:.1f} МиБ, пик {peak / 2 ** 20:.1f} МиБ\n\n"
+            files.append(self._write(f"{prefix}-mem-top.txt", summary + allocation_report(snapshot, self.top_n)))
+        return files
+
+    @staticmethod
+    def _write(path: str, text: str) -> str:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+
+_profiler = None
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
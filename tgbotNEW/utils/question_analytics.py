@@ -0,0 +1,285 @@
+# utils/question_analytics.py
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import time
+import numpy as np
+from config import (
+    ANALYTICS_ENABLED,
+    ANALYTICS_ANSWERS_PATH,
+    ANALYTICS_MIN_ANSWERS,
+    ANALYTICS_MIN_DISCRIMINATION,
+    ANALYTICS_MIN_DIFFICULTY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Одна запись - ответ на один вопрос (20 байт): id вопроса, раздел, предмет, выбранный и правильный вариант
+ANSWER_DTYPE = np.dtype([
+    ("question", "<u8"),
+    ("section", "<u8"),
+    ("subject", "<u2"),
+    ("chosen", "u1"),
+    ("correct", "u1"),
+])
+OPTION_CODES = {"A": 0, "B": 1, "C": 2, "D": 3}
+NO_ANSWER_CODE = 4  # Вопрос показан, но ответа нет
+OPTION_COUNT = 5  # A-D и "нет ответа"
+
+
+class AnswerLog:
+    """Журнал ответов в виде компактных массивов.
+
+    Ответы дописываются в бинарный файл записями ANSWER_DTYPE и читаются обратно одним
+    np.fromfile. Раздел (section) - ответы одного пользователя по одному предмету в одном тесте:
+    балл раздела нужен для расчета различающей способности вопросов. Названия предметов
+    кодируются номерами, список хранится рядом в JSON.
+
+    При нескольких воркерах у каждого свой журнал (один писатель на файл), а shards - шаблон
+    glob журналов всех воркеров: read_all читает их вместе, чтобы статистика по вопросам
+    считалась по ответам всех пользователей.
+    """
+
+    def __init__(self, path: str, flush_rows: int = 10000, shards: str = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_rows = flush_rows
+        self.shards = shards
+        self._subjects_path = f"{path}.subjects.json"
+        self._subjects = []
+        if os.path.exists(self._subjects_path):
+            with open(self._subjects_path, encoding="utf-8") as f:
+                self._subjects = json.load(f)
+        self._subject_codes = {subject: code for code, subject in enumerate(self._subjects)}
+        self._pending = []
+
+    @property
+    def subjects(self) -> list:
+        return list(self._subjects)
+
+    def _subject_code(self, subject: str) -> int:
+        code = self._subject_codes.get(subject)
+        if code is None:
+            code = self._subject_codes[subject] = len(self._subjects)
+            self._subjects.append(subject)
+            with open(self._subjects_path, "w", encoding="utf-8") as f:
+                json.dump(self._subjects, f, ensure_ascii=False)
+        return code
+
+    def record_section(self, subject: str, question_ids: list, answer_key: str, user_answers: str) -> None:
+        """Записывает ответы одного теста по предмету. user_answers[i] - ответ на вопрос i.
+
+        Учитываются только показанные вопросы (до последнего отвеченного); раздел без ответов не пишется.
+        """
+        shown = min(len(question_ids), len(answer_key), len(user_answers))
+        if not shown:
+            return
+        section = random.getrandbits(63)
+        code = self._subject_code(subject)
+        for qid, correct, chosen in zip(question_ids[:shown], answer_key, user_answers):
+            correct_code = OPTION_CODES.get(correct.upper())
+            if correct_code is not None:
+                self._pending.append((int(qid, 16), section, code, OPTION_CODES.get(chosen.upper(), NO_ANSWER_CODE),
+                                      correct_code))
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        with open(self.path, "ab") as f:
+            np.array(rows, dtype=ANSWER_DTYPE).tofile(f)
+
+    def read(self) -> np.ndarray:
+        """Все записанные ответы (без несброшенных) одним массивом"""
+        return _read_records(self.path)
+
+    def read_all(self) -> tuple[np.ndarray, list]:
+        """Ответы из журналов всех воркеров (или только свои без shards) и общий список предметов"""
+        paths = sorted(set(glob.glob(self.shards)) | {self.path}) if self.shards else [self.path]
+        codes = {}
+        parts = []
+        for path in paths:
+            records = _read_records(path)
+            if path == self.path:
+                shard_subjects = self.subjects
+            else:
+                # Список предметов читается после ответов: писатель дописывает предмет до ответов с ним
+                try:
+                    with open(f"{path}.subjects.json", encoding="utf-8") as f:
+                        shard_subjects = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Журнал ответов {path} пропущен: не удалось прочитать предметы ({e})")
+                    continue
+            if not len(records):
+                continue
+            # Номера предметов у каждого журнала свои: переводим их в общую нумерацию
+            mapping = np.array([codes.setdefault(subject, len(codes)) for subject in shard_subjects] or [0],
+                               dtype=np.uint16)
+            records = records.copy()
+            records["subject"] = mapping[np.minimum(records["subject"], len(mapping) - 1)]
+            parts.append(records)
+        subjects = list(codes)
+        if not parts:
+            return np.empty(0, dtype=ANSWER_DTYPE), subjects
+        return np.concatenate(parts), subjects
+
+
+def _read_records(path: str) -> np.ndarray:
+    """Записи журнала; недописанная другим процессом последняя запись не читается"""
+    if not os.path.exists(path):
+        return np.empty(0, dtype=ANSWER_DTYPE)
+    return np.fromfile(path, dtype=ANSWER_DTYPE, count=os.path.getsize(path) // ANSWER_DTYPE.itemsize)
+
+
+class QuestionAnalytics:
+    """Результат анализа ответов.
+
+    Массивы по вопросам выровнены с question_ids: answered - сколько раз на вопрос отвечали,
+    difficulty - доля правильных ответов, discrimination - корреляция правильности ответа с
+    баллом раздела без этого вопроса (низкая или отрицательная обычно означает неверный ключ
+    или двусмысленный вопрос), option_rates - доли выбора A, B, C, D и "нет ответа".
+    """
+
+    __slots__ = ("question_ids", "subject_codes", "answer_keys", "answered", "difficulty", "discrimination",
+                 "option_rates", "subject_distributions", "records", "elapsed")
+
+    def flagged(self, min_answers: int, min_discrimination: float, min_difficulty: float) -> set:
+        """id вопросов (в виде hex, как в хранилище), которые по статистике не стоит выдавать"""
+        enough = self.answered >= min_answers
+        bad = enough & ((self.discrimination < min_discrimination) | (self.difficulty < min_difficulty))
+        return {f"{qid:016x}" for qid in self.question_ids[bad].tolist()}
+
+    def summary(self) -> dict:
+        return {
+            "records": self.records,
+            "questions": len(self.question_ids),
+            "elapsed": round(self.elapsed, 3),
+            "subjects": self.subject_distributions,
+        }
+
+
+def compute_question_analytics(records: np.ndarray, subjects: list, bins: int = 10) -> QuestionAnalytics:
+    """Считает статистику по всем вопросам и предметам сразу, без циклов по ответам"""
+    started = time.perf_counter()
+    question_ids, q_idx = np.unique(records["question"], return_inverse=True)
+    num_questions = len(question_ids)
+    correct = (records["chosen"] == records["correct"]).astype(np.float64)
+    answered = np.bincount(q_idx, minlength=num_questions)
+    safe_answered = np.maximum(answered, 1)
+
+    # Ответы раздела пишутся подряд (record_section), поэтому разделы находятся без сортировки
+    section = records["section"]
+    section_starts = np.ones(len(section), dtype=bool)
+    section_starts[1:] = section[1:] != section[:-1]
+    s_idx = np.cumsum(section_starts) - 1
+    # Балл раздела без текущего вопроса: иначе вопрос коррелировал бы сам с собой
+    section_size = np.bincount(s_idx)
+    section_correct = np.bincount(s_idx, weights=correct)
+    rest = (section_correct[s_idx] - correct) / np.maximum(section_size[s_idx] - 1, 1)
+
+    # Точечно-бисериальная корреляция через суммы по вопросам (для 0/1 сумма квадратов равна сумме)
+    sum_x = np.bincount(q_idx, weights=correct, minlength=num_questions)
+    sum_y = np.bincount(q_idx, weights=rest, minlength=num_questions)
+    sum_xy = np.bincount(q_idx, weights=correct * rest, minlength=num_questions)
+    sum_yy = np.bincount(q_idx, weights=rest * rest, minlength=num_questions)
+    covariance = answered * sum_xy - sum_x * sum_y
+    denominator = np.sqrt(np.clip(answered * sum_x - sum_x ** 2, 0, None) * np.clip(answered * sum_yy - sum_y ** 2, 0, None))
+    discrimination = np.divide(covariance, denominator, out=np.zeros(num_questions), where=denominator > 1e-9)
+
+    option_counts = np.bincount(q_idx * OPTION_COUNT + records["chosen"], minlength=num_questions * OPTION_COUNT)
+    option_rates = option_counts.reshape(num_questions, OPTION_COUNT) / safe_answered[:, None]
+
+    subject_codes = np.zeros(num_questions, dtype=np.uint16)
+    subject_codes[q_idx] = records["subject"]
+    answer_keys = np.zeros(num_questions, dtype=np.uint8)
+    answer_keys[q_idx] = records["correct"]
+
+    # Распределение баллов (процент правильных за раздел) по каждому предмету
+    section_subjects = np.zeros(len(section_size), dtype=np.uint16)
+    section_subjects[s_idx] = records["subject"]
+    section_scores = section_correct / section_size * 100
+    subject_distributions = {}
+    for code in np.unique(section_subjects).tolist():
+        scores = section_scores[section_subjects == code]
+        p25, median, p75 = np.percentile(scores, (25, 50, 75))
+        subject_distributions[subjects[code] if code < len(subjects) else str(code)] = {
+            "tests": len(scores),
+            "mean": round(float(scores.mean()), 2),
+            "p25": round(float(p25), 2),
+            "median": round(float(median), 2),
+            "p75": round(float(p75), 2),
+            "histogram": np.histogram(scores, bins=bins, range=(0, 100))[0].tolist(),
+        }
+
+    analytics = QuestionAnalytics()
+    analytics.question_ids = question_ids
+    analytics.subject_codes = subject_codes
+    analytics.answer_keys = answer_keys
+    analytics.answered = answered
+    analytics.difficulty = sum_x / safe_answered
+    analytics.discrimination = discrimination
+    analytics.option_rates = option_rates
+    analytics.subject_distributions = subject_distributions
+    analytics.records = len(records)
+    analytics.elapsed = time.perf_counter() - started
+    return analytics
+
+
+_answer_log = None
+_latest_analytics = None
+
+
+def get_answer_log() -> AnswerLog:
+    global _answer_log
+    if _answer_log is None:
+        _answer_log = AnswerLog(ANALYTICS_ANSWERS_PATH)
+    return _answer_log
+
+
+def set_answer_log_path(path: str, shards: str = None) -> None:
+    """Журнал ответов в другом файле: у каждого воркера supervisor.py свой журнал, а аналитика
+    считается по всем журналам, подходящим под шаблон shards"""
+    global _answer_log
+    _answer_log = AnswerLog(path, shards=shards)
+
+
+def get_question_analytics():
+    """Результат последнего запуска run_analytics или None"""
+    return _latest_analytics
+
+
+def record_answers(subject: str, question_ids: list, answer_key: str, user_answers: str) -> None:
+    if ANALYTICS_ENABLED:
+        get_answer_log().record_section(subject, question_ids, answer_key, user_answers)
+
+
+async def run_analytics(question_pool=None) -> QuestionAnalytics:
+    """Пересчитывает аналитику по журналам всех воркеров в отдельном потоке и передает плохие вопросы в пул"""
+    global _latest_analytics
+    answer_log = get_answer_log()
+    answer_log.flush()
+    loop = asyncio.get_running_loop()
+    analytics = await loop.run_in_executor(None, lambda: compute_question_analytics(*answer_log.read_all()))
+    _latest_analytics = analytics
+    flagged = analytics.flagged(ANALYTICS_MIN_ANSWERS, ANALYTICS_MIN_DISCRIMINATION, ANALYTICS_MIN_DIFFICULTY)
+    if question_pool is not None:
+        question_pool.set_rejected(flagged)
+    logger.info(f"Аналитика ответов: {analytics.records} ответов, {len(analytics.question_ids)} вопросов, "
+                f"отклонено {len(flagged)}, расчет {analytics.elapsed:.2f} c")
+    return analytics
+
+
+async def analytics_loop(interval: float, question_pool=None) -> None:
+    while True:
+        try:
+            await run_analytics(question_pool)
+        except Exception as e:
+            logger.error(f"Ошибка расчета аналитики ответов: {e}")
+        await asyncio.sleep(interval)
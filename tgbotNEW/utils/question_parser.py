@@ -0,0 +1,202 @@
+# utils/question_parser.py
+import json
+import re
+from dataclasses import dataclass, field
+
+OPTION_KEYS = ("A", "B", "C", "D")
+# Модель иногда пишет варианты кириллическими буквами, похожими на латинские
+_LOOKALIKES = str.maketrans({"А": "A", "В": "B", "С": "C"})
+
+_OPTION_RE = re.compile(r"^\(?([A-DАВС])[\)\.:]\s*(.*)$")
+_ANSWER_RE = re.compile(r"^\**\s*Правильный\s+ответ\s*\**\s*[:\-—]?\s*\**\s*\(?([A-DАВС])\b", re.IGNORECASE)
+_QUESTION_START_RE = re.compile(r"^\**\s*(Вопрос\b|\d+\s*[\.\)]\s)", re.IGNORECASE)
+
+
+@dataclass
+class Question:
+    """Разобранный тестовый вопрос: формулировка, варианты A-D и ключ ответа"""
+    stem: str
+    options: dict
+    answer: str
+
+    @property
+    def text(self) -> str:
+        """Текст вопроса в том виде, в котором он показывается пользователю"""
+        return "\n".join([self.stem] + [f"{key}) {self.options[key]}" for key in OPTION_KEYS])
+
+
+@dataclass
+class _Block:
+    stem_lines: list = field(default_factory=list)
+    options: dict = field(default_factory=dict)
+    last_option: str = None
+
+    def is_empty(self) -> bool:
+        return not self.stem_lines and not self.options
+
+
+class QuestionParser:
+    """Инкрементальный парсер ответа модели.
+
+    Принимает текст кусками (например, из потока), за один проход разбирает его по строкам и
+    отдает готовые Question, как только встречается строка "Правильный ответ". Пустые строки внутри
+    вопроса не ломают разбор. Некорректные блоки не теряются молча, а считаются в rejected.
+    """
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self._buffer = ""
+        self._block = _Block()
+
+    def feed(self, chunk: str) -> list:
+        """Добавляет очередной кусок текста и возвращает вопросы, которые завершились в нем"""
+        self._buffer += chunk
+        if "\n" not in chunk:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        ready = []
+        for line in lines:
+            question = self._feed_line(line)
+            if question:
+                ready.append(question)
+        return ready
+
+    def close(self) -> list:
+        """Завершает разбор: дочитывает последнюю строку и отбрасывает незаконченный блок"""
+        ready = []
+        if self._buffer:
+            question = self._feed_line(self._buffer)
+            self._buffer = ""
+            if question:
+                ready.append(question)
+        self._reject_block()
+        return ready
+
+    def _reject_block(self) -> None:
+        if not self._block.is_empty():
+            self.rejected += 1
+        self._block = _Block()
+
+    def _feed_line(self, raw_line: str):
+        line = raw_line.strip()
+        if not line:
+            return None
+        block = self._block
+
+        # Дешевые проверки первых символов отсекают регулярные выражения для большинства строк
+        answer_match = _ANSWER_RE.match(line) if line[0] in "*Пп" else None
+        if answer_match:
+            return self._finish_block(answer_match.group(1).upper().translate(_LOOKALIKES))
+
+        option_match = _OPTION_RE.match(line) if line[1:2] in ").:" or line[0] == "(" else None
+        if option_match and block.stem_lines:
+            key = option_match.group(1).translate(_LOOKALIKES)
+            if key in block.options:
+                # Повтор варианта означает, что начался новый вопрос без ответа на предыдущий
+                self._reject_block()
+                return None
+            block.options[key] = option_match.group(2).strip()
+            block.last_option = key
+            return None
+
+        if block.options:
+            if _QUESTION_START_RE.match(line):
+                # Новый вопрос начался, а у предыдущего нет строки с ответом
+                self._reject_block()
+                self._block.stem_lines.append(line)
+            else:
+                # Перенос длинного варианта ответа на следующую строку
+                block.options[block.last_option] += f" {line}"
+            return None
+
+        block.stem_lines.append(line)
+        return None
+
+    def _finish_block(self, answer: str):
+        block = self._block
+        self._block = _Block()
+        if not block.stem_lines or tuple(sorted(block.options)) != OPTION_KEYS or answer not in block.options:
+            self.rejected += 1
+            return None
+        self.accepted += 1
+        return Question(stem="\n".join(block.stem_lines), options=block.options, answer=answer)
+
+
+def parse_questions(text: str) -> tuple[list, int]:
+    """Разбирает весь текст целиком. Возвращает (вопросы, количество отброшенных блоков)"""
+    parser = QuestionParser()
+    questions = parser.feed(text)
+    questions.extend(parser.close())
+    return questions, parser.rejected
+
+
+# Схема структурированного ответа для генерации нескольких предметов одним запросом
+QUESTIONS_JSON_SCHEMA = {
+    "name": "ent_questions",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "subjects": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "subject": {"type": "string"},
+                        "questions": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "question": {"type": "string"},
+                                    **{key: {"type": "string"} for key in OPTION_KEYS},
+                                    "answer": {"type": "string", "enum": list(OPTION_KEYS)},
+                                },
+                                "required": ["question", *OPTION_KEYS, "answer"],
+                                "additionalProperties": False,
+                            },
+                        },
+                    },
+                    "required": ["subject", "questions"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["subjects"],
+        "additionalProperties": False,
+    },
+}
+
+
+def parse_json_questions(text: str, subjects: list) -> tuple[dict, dict]:
+    """Разбирает ответ по QUESTIONS_JSON_SCHEMA.
+
+    Возвращает ({предмет: вопросы}, {предмет: количество отброшенных}). Предметы, которых нет
+    в subjects, игнорируются; если JSON не разобрался, все предметы остаются пустыми.
+    """
+    questions = {subject: [] for subject in subjects}
+    rejected = {subject: 0 for subject in subjects}
+    try:
+        groups = json.loads(text)["subjects"]
+    except (ValueError, KeyError, TypeError):
+        return questions, rejected
+    for group in groups if isinstance(groups, list) else ():
+        subject = group.get("subject") if isinstance(group, dict) else None
+        if subject not in questions:
+            continue
+        for item in group.get("questions") or ():
+            try:
+                stem = item["question"].strip()
+                options = {key: item[key].strip() for key in OPTION_KEYS}
+                answer = item["answer"].strip().upper().translate(_LOOKALIKES)
+            except (KeyError, TypeError, AttributeError):
+                rejected[subject] += 1
+                continue
+            if not stem or not all(options.values()) or answer not in OPTION_KEYS:
+                rejected[subject] += 1
+                continue
+            if not stem.lower().startswith("вопрос"):
+                stem = f"Вопрос: {stem}"
+            questions[subject].append(Question(stem=stem, options=options, answer=answer))
+    return questions, rejected
@@ -0,0 +1,265 @@
+# utils/question_pool.py
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable
+from utils.question_store import question_id
+
+logger = logging.getLogger(__name__)
+
+# Функция генерации: (предмет, количество) -> (вопросы, правильные ответы)
+GenerateFunc = Callable[[str, int], Awaitable[tuple[list, list]]]
+
+
+class QuestionPool:
+    """Пул заранее сгенерированных вопросов по предметам с фоновым пополнением.
+
+    Вопросы выдаются из пула без обращения к LLM. Когда в пуле предмета остается меньше
+    low_water вопросов, фоновые воркеры догенерируют его до target. Одинаковые вопросы в пул
+    предмета не попадают дважды. Если stall_batches пакетов подряд не добавили в пул ни одного
+    вопроса (все отброшены или уже есть в пуле), пополнение предмета откладывается на stall_backoff
+    секунд. Пул сохраняется на диск (в фоне, не чаще раза в save_delay секунд), поэтому переживает
+    перезапуск бота.
+    """
+
+    def __init__(self, path: str, subjects: list, low_water: int = 20, target: int = 60,
+                 batch_size: int = 10, workers: int = 2, stall_batches: int = 3, stall_backoff: float = 300.0,
+                 save_delay: float = 1.0):
+        self.path = path
+        self.subjects = list(subjects)
+        self.low_water = low_water
+        self.target = target
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stall_batches = stall_batches
+        self.stall_backoff = stall_backoff
+        self.save_delay = save_delay
+        self._questions = {subject: deque() for subject in self.subjects}
+        self._ids = {subject: set() for subject in self.subjects}
+        self._refill_queue = asyncio.Queue()
+        self._pending = set()
+        self._backoff_until = {}
+        self._tasks = []
+        self._save_task = None
+        self._dirty = False
+        self._generate = None
+        self._rejected = set()
+        self.stats = {"hits": 0, "misses": 0, "refills": 0, "refill_errors": 0, "rejected": 0, "duplicates": 0,
+                      "stalls": 0, "refill_time_total": 0.0, "refill_time_last": 0.0}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить пул вопросов из {self.path}: {e}")
+            return
+        for subject, items in data.items():
+            self._add(subject, [tuple(item) for item in items])
+        logger.info(f"Пул вопросов загружен: {self.depth()}")
+
+    def _add(self, subject: str, items: list) -> int:
+        """Добавляет в пул предмета вопросы, которых в нем еще нет. Возвращает количество добавленных"""
+        queue = self._questions.setdefault(subject, deque())
+        ids = self._ids.setdefault(subject, set())
+        added = 0
+        for item in items:
+            item_id = question_id(item[0])
+            if item_id in ids:
+                self.stats["duplicates"] += 1
+                continue
+            ids.add(item_id)
+            queue.append(item)
+            added += 1
+        return added
+
+    def _write(self, snapshot: dict) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _snapshot(self) -> dict:
+        return {subject: list(items) for subject, items in self._questions.items()}
+
+    def _mark_dirty(self) -> None:
+        """Пул изменился: сохранение на диск откладывается, несколько изменений подряд пишутся одним файлом"""
+        self._dirty = True
+        if self._save_task is None:
+            try:
+                self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+            except RuntimeError:
+                self.save()  # Нет event loop (например, в скрипте): пишем сразу
+
+    async def _save_later(self) -> None:
+        try:
+            await asyncio.sleep(self.save_delay)
+            self._dirty = False
+            # Копия пула снимается в event loop, а запись файла идет в потоке
+            await asyncio.to_thread(self._write, self._snapshot())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Не удалось сохранить пул вопросов в {self.path}: {e}")
+        finally:
+            self._save_task = None
+        if self._dirty:
+            self._mark_dirty()
+
+    def save(self) -> None:
+        """Сохраняет пул на диск сразу"""
+        self._dirty = False
+        self._write(self._snapshot())
+
+    def depth(self, subject: str = None):
+        """Количество готовых вопросов по предмету (или по всем предметам)"""
+        if subject is not None:
+            return len(self._questions.get(subject, ()))
+        return {subject: len(items) for subject, items in self._questions.items()}
+
+    def take(self, subject: str, count: int, skip=None):
+        """Забирает count вопросов из пула. Возвращает (вопросы, ответы) или None, если вопросов не хватает.
+
+        skip(question) -> True для вопросов, которые этому пользователю не подходят (уже видел):
+        такие вопросы остаются в пуле для других пользователей.
+        """
+        items = self._questions.setdefault(subject, deque())
+        if len(items) < count:
+            self.stats["misses"] += 1
+            self.request_refill(subject)
+            return None
+        # Вопросы снимаются с начала очереди; пропущенные возвращаются на свои места
+        popped, taken, skipped = [], [], []
+        while items and len(taken) < count:
+            item = items.popleft()
+            popped.append(item)
+            (skipped if skip is not None and skip(item[0]) else taken).append(item)
+        if len(taken) < count:
+            items.extendleft(reversed(popped))
+            self.stats["misses"] += 1
+            self.request_refill(subject)
+            return None
+        items.extendleft(reversed(skipped))
+        ids = self._ids[subject]
+        for question, _ in taken:
+            ids.discard(question_id(question))
+        self.stats["hits"] += 1
+        self.request_refill(subject)
+        self._mark_dirty()
+        return [question for question, _ in taken], [answer for _, answer in taken]
+
+    def put(self, subject: str, questions: list, correct_answers: list) -> int:
+        """Добавляет вопросы в пул, кроме отсеянных аналитикой и уже лежащих в пуле. Возвращает количество добавленных"""
+        items = [(question, answer) for question, answer in zip(questions, correct_answers)
+                 if question_id(question) not in self._rejected]
+        self.stats["rejected"] += len(questions) - len(items)
+        added = self._add(subject, items)
+        if added:
+            self._mark_dirty()
+        return added
+
+    def set_rejected(self, question_ids: set) -> None:
+        """Вопросы, которые по статистике ответов признаны плохими: убираются из пула и больше в него не попадают"""
+        self._rejected = set(question_ids)
+        removed = 0
+        for subject, items in self._questions.items():
+            kept = deque(item for item in items if question_id(item[0]) not in self._rejected)
+            if len(kept) != len(items):
+                removed += len(items) - len(kept)
+                self._questions[subject] = kept
+                self._ids[subject] = {question_id(item[0]) for item in kept}
+                self.request_refill(subject)
+        if removed:
+            self.stats["rejected"] += removed
+            self._mark_dirty()
+            logger.info(f"Из пула убрано вопросов по итогам аналитики: {removed}")
+
+    def request_refill(self, subject: str) -> None:
+        """Ставит предмет в очередь на пополнение, если он опустился ниже low_water"""
+        if self.depth(subject) >= self.low_water or subject in self._pending:
+            return
+        if time.monotonic() < self._backoff_until.get(subject, 0.0):
+            return
+        self._pending.add(subject)
+        self._refill_queue.put_nowait(subject)
+
+    async def _refill(self, subject: str) -> None:
+        stalled = 0
+        while self.depth(subject) < self.target:
+            started = time.perf_counter()
+            questions, correct_answers = await self._generate(subject, self.batch_size)
+            elapsed = time.perf_counter() - started
+            self.stats["refills"] += 1
+            self.stats["refill_time_total"] += elapsed
+            self.stats["refill_time_last"] = elapsed
+            added = self.put(subject, questions, correct_answers)
+            if added:
+                stalled = 0
+                logger.info(f"Пул по {subject} пополнен за {elapsed:.2f} c, в пуле {self.depth(subject)}")
+                continue
+            stalled += 1
+            logger.warning(f"Пополнение пула по {subject} не добавило вопросов (получено {len(questions)})")
+            if stalled >= self.stall_batches:
+                # Модель (или кэш ее ответов) повторяет отброшенные вопросы: не крутимся в цикле
+                self.stats["stalls"] += 1
+                self._backoff_until[subject] = time.monotonic() + self.stall_backoff
+                logger.warning(f"Пополнение пула по {subject} отложено на {self.stall_backoff:.0f} c: "
+                               f"{stalled} пакетов подряд без новых вопросов")
+                return
+
+    async def _worker(self) -> None:
+        while True:
+            subject = await self._refill_queue.get()
+            try:
+                await self._refill(subject)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["refill_errors"] += 1
+                logger.error(f"Ошибка пополнения пула по {subject}: {e}")
+            finally:
+                self._pending.discard(subject)
+                self._refill_queue.task_done()
+
+    def start(self, generate: GenerateFunc) -> None:
+        """Запускает фоновые воркеры пополнения и ставит в очередь все неполные предметы"""
+        self._generate = generate
+        for subject in self.subjects:
+            self.request_refill(subject)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Идущее сохранение дожидаемся: иначе запись файла в потоке могла бы пересечься с финальной
+        if self._save_task is not None:
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        if self._save_task is not None:
+            # Следующее сохранение еще ждет паузы: его заменит финальная запись
+            self._save_task.cancel()
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        if self._dirty:
+            await asyncio.to_thread(self._write, self._snapshot())
+            self._dirty = False
+
+    def get_stats(self) -> dict:
+        requests = self.stats["hits"] + self.stats["misses"]
+        refills = self.stats["refills"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+            "refill_time_avg": self.stats["refill_time_total"] / refills if refills else 0.0,
+            "depth": self.depth(),
+        }
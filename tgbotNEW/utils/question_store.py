@@ -0,0 +1,113 @@
+# utils/question_store.py
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import QUESTION_STORE_PATH, QUESTION_STORE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Символ "нет ответа" в упакованной строке ответов пользователя
+NO_ANSWER = "-"
+
+
+def question_id(text: str) -> str:
+    """Идентификатор вопроса по его содержимому: одинаковые тексты получают один id"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class QuestionStore:
+    """Общее хранилище текстов вопросов без дубликатов.
+
+    В данных FSM сессии лежат только id вопросов, а сами тексты хранятся здесь один раз,
+    сколько бы пользователей ни получили этот вопрос. Тексты сохраняются в SQLite, чтобы id
+    в восстановленных после перезапуска сессиях оставались действительными. В памяти держатся
+    только cache_size последних использованных текстов, остальные читаются с диска.
+    """
+
+    def __init__(self, path: str, cache_size: int = 20000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.cache_size = cache_size
+        self._texts = OrderedDict()
+        # Все обращения к соединению идут через один поток, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="question-store")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS questions (id TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _remember(self, qid: str, text: str) -> None:
+        self._texts[qid] = text
+        self._texts.move_to_end(qid)
+        if len(self._texts) > self.cache_size:
+            self._texts.popitem(last=False)
+
+    def _insert(self, rows: list) -> None:
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO questions (id, text) VALUES (?, ?)", rows)
+
+    def _select(self, qid: str):
+        return self._conn.execute("SELECT text FROM questions WHERE id = ?", (qid,)).fetchone()
+
+    async def add_many(self, texts: list) -> list:
+        """Сохраняет тексты вопросов и возвращает их id"""
+        ids = [question_id(text) for text in texts]
+        new_rows = [(qid, text) for qid, text in zip(ids, texts) if qid not in self._texts]
+        if new_rows:
+            await self._run(self._insert, new_rows)
+        for qid, text in zip(ids, texts):
+            self._remember(qid, text)
+        return ids
+
+    async def add(self, text: str) -> str:
+        return (await self.add_many([text]))[0]
+
+    async def get(self, qid: str) -> str:
+        text = self._texts.get(qid)
+        if text is None:
+            row = await self._run(self._select, qid)
+            if row is None:
+                logger.error(f"Вопрос {qid} не найден в хранилище")
+                return "⚠️ Текст вопроса недоступен."
+            text = row[0]
+        self._remember(qid, text)
+        return text
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+_question_store = None
+
+
+def get_question_store() -> QuestionStore:
+    global _question_store
+    if _question_store is None:
+        _question_store = QuestionStore(QUESTION_STORE_PATH, QUESTION_STORE_CACHE_SIZE)
+    return _question_store
+
+
+def set_answer(answers: str, index: int, answer: str) -> str:
+    """Записывает ответ на вопрос index в упакованную строку ответов"""
+    if index >= len(answers):
+        answers = answers.ljust(index, NO_ANSWER)
+    return answers[:index] + answer + answers[index + 1:]
+
+
+def get_answer(answers: str, index: int):
+    """Ответ пользователя на вопрос index или None, если ответа нет"""
+    if index < len(answers) and answers[index] != NO_ANSWER:
+        return answers[index]
+    return None
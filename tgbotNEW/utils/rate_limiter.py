@@ -0,0 +1,93 @@
+# utils/rate_limiter.py
+import time
+
+
+class _WindowState:
+    __slots__ = ("index", "current", "previous")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.current = 0
+        self.previous = 0
+
+
+class SlidingWindowLimiter:
+    """Ограничитель "не больше limit событий за window секунд" со скользящим окном.
+
+    На каждого пользователя хранятся только три числа: номер текущего окна и счетчики текущего и
+    предыдущего окон. Число событий за последние window секунд оценивается как
+    previous * (доля предыдущего окна, попадающая в интервал) + current. Проверка и списание
+    выполняются в try_acquire без await, поэтому атомарны для конкурентных корутин.
+    """
+
+    def __init__(self, limit: int, window: float, clock=time.time, cleanup_every: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.cleanup_every = cleanup_every
+        self._states = {}
+        self._operations = 0
+
+    def _state(self, key, now: float) -> _WindowState:
+        index = int(now // self.window)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _WindowState(index)
+        elif state.index != index:
+            state.previous = state.current if state.index == index - 1 else 0
+            state.current = 0
+            state.index = index
+        return state
+
+    def _used(self, state: _WindowState, now: float) -> float:
+        previous_weight = 1 - (now % self.window) / self.window
+        return state.previous * previous_weight + state.current
+
+    def try_acquire(self, key, cost: int = 1) -> bool:
+        """Атомарно проверяет лимит и списывает cost. Возвращает False, если лимит исчерпан."""
+        now = self.clock()
+        state = self._state(key, now)
+        self._operations += 1
+        if self._operations % self.cleanup_every == 0:
+            self.cleanup()
+        if self._used(state, now) + cost > self.limit:
+            return False
+        state.current += cost
+        return True
+
+    def consume(self, key, cost: int = 1) -> None:
+        """Списывает cost без проверки лимита"""
+        self._state(key, self.clock()).current += cost
+
+    def refund(self, key, cost: int = 1) -> None:
+        """Возвращает списанное, например, если генерация не удалась"""
+        now = self.clock()
+        state = self._state(key, now)
+        from_current = min(cost, state.current)
+        state.current -= from_current
+        # Если списание было в прошлом окне, возвращаем из него
+        state.previous = max(0, state.previous - (cost - from_current))
+
+    def remaining(self, key) -> int:
+        now = self.clock()
+        state = self._states.get(key)
+        if state is None:
+            return self.limit
+        state = self._state(key, now)
+        return max(0, int(self.limit - self._used(state, now)))
+
+    def can_acquire(self, key, cost: int = 1) -> bool:
+        return self.remaining(key) >= cost
+
+    def reset(self, key) -> None:
+        self._states.pop(key, None)
+
+    def cleanup(self) -> None:
+        """Удаляет пользователей, у которых оба окна уже истекли"""
+        current_index = int(self.clock() // self.window)
+        stale = [key for key, state in self._states.items() if state.index < current_index - 1]
+        for key in stale:
+            del self._states[key]
+
+    def __len__(self) -> int:
+        return len(self._states)
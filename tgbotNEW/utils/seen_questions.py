@@ -0,0 +1,307 @@
+# utils/seen_questions.py
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from config import SEEN_DB_PATH, SEEN_FILTER_BITS, SEEN_FILTER_CAPACITY, SEEN_CACHE_USERS, SEEN_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_OPTION_LINE_RE = re.compile(r"^\(?[A-DАВС][\)\.:]\s")
+_STEM_PREFIX_RE = re.compile(r"^\W*(вопрос\b\s*\d*|\d+\s*[\.\)])\W*")
+_WORD_RE = re.compile(r"\w+")
+
+# MinHash по словам формулировки: BANDS полос по ROWS значений. Формулировки с долей общих слов
+# (Jaccard) 0.9 совпадают хотя бы в одной полосе с вероятностью ~97%, 0.8 - ~80%, 0.5 - ~12%
+BANDS = 4
+ROWS = 5
+MIN_NEAR_TOKENS = 4  # Для совсем коротких формулировок сравниваем только точный ключ
+_TOKEN_HASHES = struct.Struct(f"<{BANDS * ROWS}I")
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+@lru_cache(maxsize=50000)
+def _token_hashes(token: str) -> tuple:
+    # Все BANDS * ROWS хеш-функций MinHash из одного вызова SHAKE. Хеши не зависят от запуска (в отличие
+    # от hash()), поэтому сохраненные фильтры остаются действительными после перезапуска
+    return _TOKEN_HASHES.unpack(hashlib.shake_128(token.encode("utf-8")).digest(_TOKEN_HASHES.size))
+
+
+def question_stem(text: str) -> str:
+    """Формулировка вопроса без вариантов ответа"""
+    lines = []
+    for line in text.split("\n"):
+        if _OPTION_LINE_RE.match(line.strip()):
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def normalize_stem(text: str) -> str:
+    """Формулировка без префикса "Вопрос N:", регистра, пунктуации и лишних пробелов"""
+    stem = question_stem(text).lower().replace("ё", "е")
+    return " ".join(_WORD_RE.findall(_STEM_PREFIX_RE.sub("", stem, count=1)))
+
+
+@lru_cache(maxsize=20000)
+def fingerprint(text: str) -> tuple:
+    """Ключи вопроса: точный (хеш нормализованной формулировки) и ключи полос MinHash для почти дубликатов"""
+    normalized = normalize_stem(text)
+    keys = [_hash64(normalized)]
+    tokens = set(normalized.split())
+    if len(tokens) >= MIN_NEAR_TOKENS:
+        signature = [min(values) for values in zip(*map(_token_hashes, tokens))]
+        for band in range(BANDS):
+            keys.append(_hash64(f"{band}:{signature[band * ROWS:(band + 1) * ROWS]}"))
+    return tuple(keys)
+
+
+class BloomFilter:
+    """Фильтр Блума фиксированного размера: добавление и проверка за O(hashes), ложных пропусков нет"""
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, size: int, hashes: int = 4, bits: bytearray = None, count: int = 0):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray(size // 8)
+        self.count = count  # Сколько вопросов добавлено
+
+    def _positions(self, key: int):
+        # Двойное хеширование: k позиций из двух половин 64-битного ключа
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: int) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class _SeenSet:
+    """Два поколения фильтров: когда текущее заполнено, старое забывается. Память на пользователя ограничена"""
+    __slots__ = ("current", "previous")
+
+    def __init__(self, current: BloomFilter, previous: BloomFilter = None):
+        self.current = current
+        self.previous = previous
+
+    def contains(self, keys: tuple) -> bool:
+        return any(key in self.current or (self.previous is not None and key in self.previous) for key in keys)
+
+    def add(self, keys: tuple, capacity: int) -> None:
+        if self.current.count >= capacity:
+            self.previous, self.current = self.current, BloomFilter(self.current.size, self.current.hashes)
+        for key in keys:
+            self.current.add(key)
+        self.current.count += 1
+
+
+class SeenQuestionsStore:
+    """Какие вопросы пользователь уже видел.
+
+    Вопрос узнается по отпечатку формулировки (точный ключ и полосы MinHash), поэтому повтором
+    считаются и переформатированные, и слегка переписанные моделью вопросы. На пользователя хранится
+    не больше двух фильтров Блума по filter_bits бит; последние пользователи держатся в LRU-кэше,
+    фильтры сохраняются в SQLite в сжатом виде. Изменившиеся фильтры пишутся пачкой раз в
+    flush_interval секунд в отдельном потоке, поэтому mark_seen не ждет диска.
+    """
+
+    def __init__(self, path: str, filter_bits: int = 65536, capacity: int = 500, cache_users: int = 2000,
+                 flush_interval: float = 2.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filter_bits = filter_bits
+        self.capacity = capacity
+        self.cache_users = cache_users
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="seen-questions")
+        self.stats = {"checked": 0, "repeats": 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            "user_id INTEGER PRIMARY KEY, current BLOB NOT NULL, current_count INTEGER NOT NULL, "
+            "previous BLOB, previous_count INTEGER)"
+        )
+        self._conn.commit()
+
+    def _load(self, user_id: int) -> _SeenSet:
+        """Фильтры пользователя из базы (чтение и распаковка)"""
+        row = self._conn.execute(
+            "SELECT current, current_count, previous, previous_count FROM seen WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return _SeenSet(BloomFilter(self.filter_bits))
+        current = BloomFilter(self.filter_bits, bits=bytearray(zlib.decompress(row[0])), count=row[1])
+        previous = None
+        if row[2] is not None:
+            previous = BloomFilter(self.filter_bits, bits=bytearray(zlib.decompress(row[2])), count=row[3])
+        return _SeenSet(current, previous)
+
+    def _cache_put(self, user_id: int, seen: _SeenSet) -> None:
+        self._cache[user_id] = seen
+        self._evict(keep=user_id)
+
+    async def preload(self, user_id: int) -> None:
+        """Загружает фильтры пользователя в кэш в отдельном потоке. Вызывается перед синхронными
+        проверками (is_seen, select_unseen, any_seen), чтобы они не читали базу в event loop"""
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            return
+        seen = await asyncio.get_running_loop().run_in_executor(self._executor, self._load, user_id)
+        # Пока шло чтение, фильтры могли загрузиться или измениться в другой корутине
+        if user_id not in self._cache:
+            self._cache_put(user_id, seen)
+
+    def _get(self, user_id: int) -> _SeenSet:
+        seen = self._cache.get(user_id)
+        if seen is None:
+            # Без preload (например, в скрипте) читаем сразу
+            seen = self._load(user_id)
+            self._cache_put(user_id, seen)
+        self._cache.move_to_end(user_id)
+        return seen
+
+    def _evict(self, keep: int = None) -> None:
+        """Вытесняет самых давних пользователей сверх cache_users. Несохраненные фильтры остаются до сброса,
+        иначе отметки потеряются."""
+        excess = len(self._cache) - self.cache_users
+        if excess <= 0:
+            return
+        evicted = []
+        for user_id in self._cache:
+            if user_id not in self._dirty and user_id != keep:
+                evicted.append(user_id)
+                if len(evicted) == excess:
+                    break
+        for user_id in evicted:
+            del self._cache[user_id]
+
+    def is_seen(self, user_id: int, question: str) -> bool:
+        self.stats["checked"] += 1
+        seen = self._get(user_id).contains(fingerprint(question))
+        if seen:
+            self.stats["repeats"] += 1
+        return seen
+
+    def any_seen(self, user_id: int, questions: list) -> bool:
+        """Видел ли пользователь хоть один из вопросов. В статистику повторов не идет: это проверка
+        готового набора (например, ответа из кэша), а не выдача вопросов"""
+        seen = self._get(user_id)
+        return any(seen.contains(fingerprint(question)) for question in questions)
+
+    def select_unseen(self, user_id: int, questions: list, correct_answers: list) -> tuple[list, list]:
+        """Оставляет вопросы, которых пользователь не видел, и убирает повторы внутри самого списка"""
+        seen = self._get(user_id)
+        batch_keys = set()
+        kept_questions, kept_answers = [], []
+        for question, answer in zip(questions, correct_answers):
+            keys = fingerprint(question)
+            self.stats["checked"] += 1
+            if seen.contains(keys) or not batch_keys.isdisjoint(keys):
+                self.stats["repeats"] += 1
+                continue
+            batch_keys.update(keys)
+            kept_questions.append(question)
+            kept_answers.append(answer)
+        return kept_questions, kept_answers
+
+    def mark_seen(self, user_id: int, questions: list) -> None:
+        if not questions:
+            return
+        seen = self._get(user_id)
+        for question in questions:
+            seen.add(fingerprint(question), self.capacity)
+        self._dirty.add(user_id)
+        if self._flush_task is None:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                self._flush_now()  # Нет event loop (например, в скрипте): пишем сразу
+
+    def _rows(self, user_ids) -> list:
+        """Копии фильтров для записи: пока они сжимаются в другом потоке, фильтры в памяти могут меняться"""
+        rows = []
+        for user_id in user_ids:
+            seen = self._cache[user_id]
+            previous = seen.previous
+            rows.append((user_id, bytes(seen.current.bits), seen.current.count,
+                         bytes(previous.bits) if previous else None, previous.count if previous else None))
+        return rows
+
+    def _write(self, rows: list) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO seen (user_id, current, current_count, previous, previous_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(user_id, zlib.compress(current), current_count,
+                  zlib.compress(previous) if previous is not None else None, previous_count)
+                 for user_id, current, current_count, previous, previous_count in rows]
+            )
+
+    def _flush_now(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self._write(self._rows(dirty))
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, self._rows(dirty))
+        except Exception:
+            # Не теряем отметки: попробуем записать их при следующем сбросе
+            self._dirty |= dirty
+            raise
+        self._evict()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи просмотренных вопросов: {e}")
+
+    def get_stats(self) -> dict:
+        checked = self.stats["checked"]
+        return {**self.stats, "repeat_rate": self.stats["repeats"] / checked if checked else 0.0,
+                "cached_users": len(self._cache), "dirty_users": len(self._dirty),
+                "bytes_per_user": 2 * self.filter_bits // 8}
+
+    def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # Сначала дожидаемся уже начатой записи, затем пишем оставшиеся изменения
+        self._executor.shutdown(wait=True)
+        self._flush_now()
+        self._conn.close()
+
+
+_seen_questions = None
+
+
+def get_seen_questions() -> SeenQuestionsStore:
+    global _seen_questions
+    if _seen_questions is None:
+        _seen_questions = SeenQuestionsStore(SEEN_DB_PATH, SEEN_FILTER_BITS, SEEN_FILTER_CAPACITY, SEEN_CACHE_USERS,
+                                             SEEN_FLUSH_INTERVAL)
+    return _seen_questions
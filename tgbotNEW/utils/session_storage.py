@@ -0,0 +1,196 @@
+# utils/session_storage.py
+import asyncio
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at", "accessed_at", "size")
+
+    def __init__(self, state: str = None, data: dict = None, updated_at: float = None, size: int = 0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at if updated_at is not None else time.time()
+        self.accessed_at = time.time()
+        self.size = size
+
+
+class SessionStorage(BaseStorage):
+    """FSM-хранилище в памяти с учетом размера сессий и вытеснением.
+
+    Размер сессии - длина ее данных в pickle. Он пересчитывается фоновой задачей раз в flush_interval
+    только для изменившихся сессий, поэтому обработчик сериализации не ждет. Сессии хранятся в
+    порядке последнего обращения. Из памяти вытесняются сессии, к которым не обращались дольше
+    idle_timeout секунд, и самые давние сверх memory_budget байт (или cache_size сессий).
+
+    Здесь вытесненная сессия теряется, как после перезапуска с MemoryStorage. SQLiteStorage
+    держит ее на диске и читает оттуда при следующем обращении.
+    """
+
+    def __init__(self, memory_budget: int = 64 * 2 ** 20, idle_timeout: float = 1800, cache_size: int = None,
+                 flush_interval: float = 0.5, ttl: float = 7 * 24 * 3600, cleanup_interval: float = 3600):
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.memory_bytes = 0
+        self.stats = {"loaded": 0, "evicted_idle": 0, "evicted_budget": 0}
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._deleted = set()
+        self._last_cleanup = time.time()
+        self._flush_task = None
+        self._closed = False
+
+    async def _load(self, db_key: str) -> _Record | None:
+        """Сессия, вытесненная из памяти ранее; None - такой нет"""
+        return None
+
+    async def _persist(self, rows: list, deleted: list, expire_before: float = None) -> None:
+        """Записывает измененные сессии (key, state, pickle данных, updated_at) и удаляет пустые"""
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        db_key = self.key_builder.build(key)
+        record = self._cache.get(db_key)
+        now = time.time()
+        if record is None:
+            loaded = await self._load(db_key)
+            # Пока шла загрузка, запись могла появиться в кэше из другой корутины
+            record = self._cache.get(db_key)
+            if record is None:
+                if loaded is not None:
+                    self.stats["loaded"] += 1
+                record = loaded or _Record()
+                self._cache[db_key] = record
+                self.memory_bytes += record.size
+                self._evict(now, keep=db_key)
+        elif now - record.updated_at >= self.ttl:
+            record.state, record.data = None, {}
+        record.accessed_at = now
+        self._cache.move_to_end(db_key)
+        return record
+
+    def _evict(self, now: float, keep: str = None) -> None:
+        """Вытесняет простаивающие сессии и самые давние сверх бюджета. Несброшенные не вытесняются,
+        иначе изменения потеряются: их очередь дойдет после следующего сброса."""
+        memory_bytes, count = self.memory_bytes, len(self._cache)
+        evicted = []
+        for db_key, record in self._cache.items():
+            idle = now - record.accessed_at >= self.idle_timeout
+            over_budget = memory_bytes > self.memory_budget or (self.cache_size is not None and count > self.cache_size)
+            if not idle and not over_budget:
+                # Дальше сессии только свежее
+                break
+            if db_key in self._dirty or db_key == keep:
+                continue
+            evicted.append((db_key, "idle" if idle else "budget"))
+            memory_bytes -= record.size
+            count -= 1
+        for db_key, reason in evicted:
+            del self._cache[db_key]
+            self.stats[f"evicted_{reason}"] += 1
+            metrics.FSM_EVICTED_SESSIONS.labels(reason).inc()
+        self.memory_bytes = memory_bytes
+
+    def _mark_dirty(self, key: StorageKey, record: _Record) -> None:
+        record.updated_at = time.time()
+        db_key = self.key_builder.build(key)
+        if record.state is None and not record.data:
+            self._deleted.add(db_key)
+        else:
+            self._deleted.discard(db_key)
+        self._dirty.add(db_key)
+        if self._flush_task is None and not self._closed:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = dict(data)
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._get_record(key)).data.copy()
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict[str, Any]:
+        # После загрузки записи изменение выполняется без await, поэтому атомарно для других корутин
+        record = await self._get_record(key)
+        record.data.update(data)
+        self._mark_dirty(key, record)
+        return record.data.copy()
+
+    def active_sessions(self) -> int:
+        """Количество сессий в памяти с установленным состоянием"""
+        return sum(1 for record in self._cache.values() if record.state is not None)
+
+    def memory_sessions(self) -> int:
+        """Количество сессий в памяти"""
+        return len(self._cache)
+
+    async def flush(self) -> None:
+        """Пересчитывает размер изменившихся сессий, сохраняет их и вытесняет лишние из памяти"""
+        now = time.time()
+        expire_before = None
+        if now - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = now
+            expire_before = now - self.ttl
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted & dirty, set()
+        rows = []
+        for db_key in dirty:
+            record = self._cache[db_key]
+            blob = b"" if db_key in deleted else pickle.dumps(record.data, pickle.HIGHEST_PROTOCOL)
+            self.memory_bytes += len(blob) - record.size
+            record.size = len(blob)
+            if blob:
+                rows.append((db_key, record.state, blob, record.updated_at))
+                metrics.FSM_SESSION_SIZE.observe(record.size)
+        if rows or deleted or expire_before is not None:
+            try:
+                await self._persist(rows, list(deleted), expire_before)
+            except Exception:
+                # Не теряем изменения: попробуем записать их при следующем сбросе
+                self._dirty |= dirty
+                self._deleted |= deleted
+                raise
+        self._evict(time.time())
+
+    async def _flush_loop(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сброса сессий FSM: {e}")
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "sessions": len(self._cache), "memory_bytes": self.memory_bytes,
+                "dirty": len(self._dirty)}
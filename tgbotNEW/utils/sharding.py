@@ -0,0 +1,145 @@
+# utils/sharding.py
+import asyncio
+import hashlib
+import logging
+import os
+from collections import deque
+import aiohttp
+from utils.webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+_EVENT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message",
+                 "callback_query", "my_chat_member", "chat_member", "chat_join_request", "inline_query",
+                 "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer", "message_reaction")
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Согласованный хеш (jump consistent hash): при переходе от N к N+1 корзине переезжает 1/(N+1) ключей"""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(chat_id, shards: int) -> int:
+    """Номер воркера для чата: все обновления одного чата всегда попадают к одному воркеру"""
+    digest = hashlib.blake2b(str(chat_id).encode("utf-8"), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "little"), shards)
+
+
+def update_chat_id(raw_update: dict):
+    """id чата (или пользователя) сырого обновления Telegram, как в UpdatePipeline; без них - update_id"""
+    for field in _EVENT_FIELDS:
+        event = raw_update.get(field)
+        if event is None:
+            continue
+        if not isinstance(event, dict):
+            # Некорректное обновление: воркер его пропустит, отправляем по update_id
+            break
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat is not None:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user is not None:
+            return user["id"]
+        break
+    return raw_update.get("update_id", 0)
+
+
+def worker_path(path: str, index) -> str:
+    """Свой файл воркера для данных с единственным писателем: data/pool.json -> data/pool.w1.json.
+    С index="*" - шаблон glob файлов всех воркеров"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+class ShardRouter:
+    """Раздает сырые обновления Telegram воркерам по согласованному хешу chat_id.
+
+    У каждого воркера своя очередь и одна задача отправки: обновления уходят пачками по HTTP в
+    порядке поступления, поэтому обновления одного чата приходят воркеру в том же порядке, а
+    состояние FSM чата всегда живет в одном процессе. Если воркер недоступен (перезапускается)
+    или перегружен (503), пачка повторяется после паузы, но не больше max_retries раз подряд:
+    иначе одна застрявшая пачка навсегда остановила бы очередь воркера. Любой другой ответ,
+    кроме 200, повтор не исправит - такая пачка отбрасывается с записью в лог.
+    """
+
+    def __init__(self, urls: list, secret_token: str = None, batch_size: int = 100, retry_delay: float = 0.5,
+                 max_retries: int = 120):
+        self.urls = list(urls)
+        self.headers = {SECRET_HEADER: secret_token} if secret_token else {}
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._queues = [deque() for _ in self.urls]
+        self._wakeups = [asyncio.Event() for _ in self.urls]
+        self._tasks = []
+        self._session = None
+        self.stats = {"submitted": 0, "sent": 0, "batches": 0, "retries": 0, "dropped": 0}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._tasks = [asyncio.create_task(self._send_loop(index)) for index in range(len(self.urls))]
+
+    def submit(self, raw_update: dict) -> int:
+        """Ставит обновление в очередь его воркера и возвращает номер воркера"""
+        index = shard_for(update_chat_id(raw_update), len(self.urls))
+        self._queues[index].append(raw_update)
+        self._wakeups[index].set()
+        self.stats["submitted"] += 1
+        return index
+
+    async def _send_loop(self, index: int) -> None:
+        queue, wakeup, url = self._queues[index], self._wakeups[index], self.urls[index]
+        attempts = 0
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            batch = [queue[position] for position in range(min(len(queue), self.batch_size))]
+            try:
+                async with self._session.post(url, json=batch, headers=self.headers) as response:
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                status = None
+                logger.warning(f"Воркер {index} недоступен: {e}")
+            attempts += 1
+            if status in (None, 503) and attempts <= self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if status == 200:
+                self.stats["sent"] += len(batch)
+                self.stats["batches"] += 1
+            else:
+                # Повтор не поможет (или попытки кончились): воркер не принимает эти обновления
+                self.stats["dropped"] += len(batch)
+                logger.error(f"Воркер {index} не принял {len(batch)} обновлений "
+                             f"(HTTP {status}, попыток: {attempts})")
+            attempts = 0
+            for _ in batch:
+                queue.popleft()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки принятых обновлений (не дольше timeout), затем останавливает отправку"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.pending and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending:
+            logger.warning(f"Не доставлено воркерам обновлений: {self.pending}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": self.pending, "per_worker": [len(queue) for queue in self._queues]}
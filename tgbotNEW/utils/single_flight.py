@@ -0,0 +1,113 @@
+# utils/single_flight.py
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """Один запрос к модели, результат которого разделяют все ожидающие"""
+    __slots__ = ("task", "waiters", "usage", "items", "done", "error", "_updated")
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 1
+        # Сюда запрос записывает потраченные токены: по ним считается экономия от объединения
+        self.usage = {"total_tokens": 0}
+        self.items = []
+        self.done = False
+        self.error = None
+        self._updated = asyncio.Event()
+
+    def notify(self) -> None:
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait(self) -> None:
+        await self._updated.wait()
+
+
+class SingleFlight:
+    """Реестр выполняющихся запросов: одинаковые одновременные запросы разделяют один вызов модели.
+
+    Ключ - нормализованный запрос (предмет, количество, модель). Пока запрос с таким ключом
+    выполняется, новые желающие не отправляют свой, а ждут его результат. Сам запрос идет в
+    отдельной задаче, поэтому отмена одного ожидающего не обрывает его для остальных.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.stats = {"requests": 0, "coalesced": 0, "upstream_calls": 0, "saved_tokens": 0}
+
+    def _join(self, registry: dict, key: Hashable):
+        self.stats["requests"] += 1
+        flight = registry.get(key)
+        if flight is not None:
+            flight.waiters += 1
+            self.stats["coalesced"] += 1
+            logger.debug(f"Запрос {key} объединен с выполняющимся, ожидающих: {flight.waiters}")
+            return flight, False
+        flight = registry[key] = _Flight()
+        self.stats["upstream_calls"] += 1
+        return flight, True
+
+    def _finish(self, registry: dict, key: Hashable, flight: _Flight) -> None:
+        if registry.get(key) is flight:
+            del registry[key]
+        # Каждый присоединившийся сэкономил один такой же запрос
+        self.stats["saved_tokens"] += flight.usage["total_tokens"] * (flight.waiters - 1)
+
+    async def do(self, key: Hashable, func: Callable[[dict], Awaitable[Any]]) -> Any:
+        """Выполняет func(usage) или присоединяется к уже выполняющемуся вызову с тем же ключом"""
+        flight, is_leader = self._join(self._calls, key)
+        if is_leader:
+            async def run():
+                try:
+                    return await func(flight.usage)
+                finally:
+                    self._finish(self._calls, key, flight)
+
+            flight.task = asyncio.create_task(run())
+        return await asyncio.shield(flight.task)
+
+    async def stream(self, key: Hashable, func: Callable[[dict], AsyncIterator]) -> AsyncIterator:
+        """Потоковый вариант do: каждый подписчик получает все элементы потока с начала"""
+        flight, is_leader = self._join(self._streams, key)
+        if is_leader:
+            async def pump():
+                try:
+                    async for item in func(flight.usage):
+                        flight.items.append(item)
+                        flight.notify()
+                except Exception as e:
+                    flight.error = e
+                finally:
+                    flight.done = True
+                    flight.notify()
+                    self._finish(self._streams, key, flight)
+
+            flight.task = asyncio.create_task(pump())
+        index = 0
+        while True:
+            if index < len(flight.items):
+                yield flight.items[index]
+                index += 1
+            elif flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            else:
+                await flight.wait()
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    def get_stats(self) -> dict:
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "coalesce_ratio": self.stats["coalesced"] / requests if requests else 0.0,
+            "in_flight": self.in_flight(),
+        }
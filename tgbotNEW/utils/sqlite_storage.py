@@ -0,0 +1,83 @@
+# utils/sqlite_storage.py
+import asyncio
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.session_storage import SessionStorage, _Record
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(SessionStorage):
+    """FSM-хранилище на SQLite (WAL), переживающее перезапуск бота.
+
+    Сессии живут в памяти, как в SessionStorage: запись в память происходит сразу, а на диск
+    изменения сбрасываются фоновой задачей раз в flush_interval секунд, и несколько ответов одного
+    чата за это время превращаются в одну запись строки. Вытесненные из памяти сессии (простой
+    дольше idle_timeout, бюджет memory_budget байт или cache_size сессий) остаются на диске и
+    читаются оттуда при следующем обращении. Сессии, не обновлявшиеся дольше ttl секунд, удаляются.
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000, flush_interval: float = 0.5,
+                 ttl: float = 7 * 24 * 3600, cleanup_interval: float = 3600, memory_budget: int = 64 * 2 ** 20,
+                 idle_timeout: float = 1800):
+        super().__init__(memory_budget=memory_budget, idle_timeout=idle_timeout, cache_size=cache_size,
+                         flush_interval=flush_interval, ttl=ttl, cleanup_interval=cleanup_interval)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Все обращения к соединению идут через один поток, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _select(self, key: str):
+        return self._conn.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    async def _load(self, db_key: str) -> _Record | None:
+        row = await self._run(self._select, db_key)
+        if row and time.time() - row[2] < self.ttl:
+            # pickle, а не json: в данных FSM встречаются словари с целочисленными ключами
+            return _Record(row[0], pickle.loads(row[1]), row[2], size=len(row[1]))
+        return None
+
+    def _write(self, rows: list, deleted: list, expire_before: float = None) -> None:
+        with self._conn:
+            if rows:
+                self._conn.executemany(
+                    "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    rows
+                )
+            if deleted:
+                self._conn.executemany("DELETE FROM fsm WHERE key = ?", [(db_key,) for db_key in deleted])
+            if expire_before is not None:
+                expired = self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (expire_before,)).rowcount
+                if expired:
+                    logger.info(f"Удалено просроченных FSM-сессий: {expired}")
+
+    async def _persist(self, rows: list, deleted: list, expire_before: float = None) -> None:
+        await self._run(self._write, rows, deleted, expire_before)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        await super().close()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
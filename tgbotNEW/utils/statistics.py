@@ -1,70 +1,292 @@
+import asyncio
+import json
 import logging
-from datetime import datetime, timedelta
+import os
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from config import STATS_DB_PATH, STATS_FLUSH_INTERVAL, STATS_RECENT_SCORES, STATS_CACHE_USERS
+from utils.rate_limiter import SlidingWindowLimiter
+from utils.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
-# Временное хранилище статистики в памяти (для простоты примера)
-user_statistics = {}
 FREE_GENERATE_LIMIT = 4
 GENERATE_WINDOW = timedelta(days=1)
+# Бесплатные генерации: не больше FREE_GENERATE_LIMIT за скользящее окно GENERATE_WINDOW
+generation_limiter = SlidingWindowLimiter(FREE_GENERATE_LIMIT, GENERATE_WINDOW.total_seconds())
 
-async def get_user_statistics():
-    """Асинхронная функция для получения статистики пользователей (например, из БД)"""
-    return user_statistics
+
+class SubjectAggregate:
+    """Накопительная статистика пользователя по предмету: обновление и чтение за O(1)"""
+    __slots__ = ("count", "total", "min", "max", "recent")
+
+    def __init__(self, count: int = 0, total: float = 0.0, min_score: float = None, max_score: float = None,
+                 recent: list = ()):
+        self.count = count
+        self.total = total
+        self.min = min_score
+        self.max = max_score
+        self.recent = deque(recent, maxlen=STATS_RECENT_SCORES)
+
+    def add(self, score: float) -> None:
+        self.count += 1
+        self.total += score
+        self.min = score if self.min is None else min(self.min, score)
+        self.max = score if self.max is None else max(self.max, score)
+        self.recent.append(score)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class UserStats:
+    __slots__ = ("is_premium", "tests_passed", "subjects")
+
+    def __init__(self, is_premium: bool = False, tests_passed: int = 0):
+        self.is_premium = is_premium
+        self.tests_passed = tests_passed
+        self.subjects = {}
+
+
+# Отметка в кэше: пользователя нет в базе, повторно SQLite не спрашиваем
+_MISSING = object()
+
+
+class StatisticsStore:
+    """Постоянное хранилище статистики пользователей на SQLite.
+
+    Для каждого пользователя и предмета хранятся только агрегаты (количество, сумма, минимум,
+    максимум и последние STATS_RECENT_SCORES результатов), поэтому память и время ответа не растут
+    с числом пройденных тестов. Изменения копятся в памяти и пишутся на диск пачкой раз в
+    flush_interval секунд. В памяти держатся cache_users последних пользователей; запросы к SQLite
+    выполняются в отдельном потоке, event loop их не ждет.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 2.0, cache_users: int = 10000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.cache_users = cache_users
+        self._users = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="statistics")
+        # Одновременные обращения к одному пользователю разделяют одно чтение из SQLite
+        self._loads = SingleFlight()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, is_premium INTEGER NOT NULL DEFAULT 0, tests_passed INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subject_scores ("
+            "user_id INTEGER NOT NULL, subject TEXT NOT NULL, count INTEGER NOT NULL, total REAL NOT NULL, "
+            "min REAL, max REAL, recent TEXT NOT NULL, PRIMARY KEY (user_id, subject))"
+        )
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _select(self, user_id: int):
+        row = self._conn.execute("SELECT is_premium, tests_passed FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = UserStats(bool(row[0]), row[1])
+        for subject, count, total, min_score, max_score, recent in self._conn.execute(
+            "SELECT subject, count, total, min, max, recent FROM subject_scores WHERE user_id = ?", (user_id,)
+        ):
+            user.subjects[subject] = SubjectAggregate(count, total, min_score, max_score, json.loads(recent))
+        return user
+
+    def _write(self, users: list, scores: list) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO users (user_id, is_premium, tests_passed) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET is_premium = excluded.is_premium, tests_passed = excluded.tests_passed",
+                users
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO subject_scores (user_id, subject, count, total, min, max, recent) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                scores
+            )
+
+    def _delete(self, user_id: int) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self._conn.execute("DELETE FROM subject_scores WHERE user_id = ?", (user_id,))
+
+    def _remember(self, user_id: int, user) -> None:
+        self._users[user_id] = user
+        self._users.move_to_end(user_id)
+        self._evict(keep=user_id)
+
+    def _evict(self, keep: int = None) -> None:
+        """Вытесняет самых давних пользователей сверх cache_users. Несохраненные остаются до сброса."""
+        excess = len(self._users) - self.cache_users
+        if excess <= 0:
+            return
+        evicted = []
+        for user_id in self._users:
+            if user_id not in self._dirty and user_id != keep:
+                evicted.append(user_id)
+                if len(evicted) == excess:
+                    break
+        for user_id in evicted:
+            del self._users[user_id]
+
+    async def get(self, user_id: int):
+        """Статистика пользователя или None, если он еще ничего не проходил"""
+        user = self._users.get(user_id)
+        if user is None:
+            loaded = await self._loads.do(user_id, lambda usage: self._run(self._select, user_id))
+            # Пока шло чтение, пользователь мог появиться в памяти из другой корутины
+            user = self._users.get(user_id, _MISSING if loaded is None else loaded)
+        self._remember(user_id, user)
+        return None if user is _MISSING else user
+
+    async def _get_or_create(self, user_id: int) -> UserStats:
+        user = await self.get(user_id)
+        if user is None:
+            user = UserStats()
+            self._remember(user_id, user)
+        return user
+
+    def _mark_dirty(self, user_id: int) -> None:
+        self._dirty.add(user_id)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def record_test(self, user_id: int, subject_scores: dict) -> None:
+        """Учитывает один пройденный тест: {предмет: процент правильных ответов}"""
+        user = await self._get_or_create(user_id)
+        user.tests_passed += 1
+        for subject, score in subject_scores.items():
+            user.subjects.setdefault(subject, SubjectAggregate()).add(score)
+        self._mark_dirty(user_id)
+
+    async def set_premium(self, user_id: int, is_premium: bool) -> None:
+        (await self._get_or_create(user_id)).is_premium = is_premium
+        self._mark_dirty(user_id)
+
+    async def delete(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+        self._dirty.discard(user_id)
+        await self._run(self._delete, user_id)
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        users = [(user_id, self._users[user_id]) for user_id in dirty]
+        try:
+            await self._run(
+                self._write,
+                [(user_id, int(user.is_premium), user.tests_passed) for user_id, user in users],
+                [(user_id, subject, aggregate.count, aggregate.total, aggregate.min, aggregate.max,
+                  json.dumps(list(aggregate.recent)))
+                 for user_id, user in users for subject, aggregate in user.subjects.items()]
+            )
+        except Exception:
+            # Не теряем изменения: попробуем записать их при следующем сбросе
+            self._dirty |= dirty
+            raise
+        self._evict()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи статистики: {e}")
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+_statistics_store = None
+
+
+def get_statistics_store() -> StatisticsStore:
+    global _statistics_store
+    if _statistics_store is None:
+        _statistics_store = StatisticsStore(STATS_DB_PATH, flush_interval=STATS_FLUSH_INTERVAL,
+                                            cache_users=STATS_CACHE_USERS)
+    return _statistics_store
+
+
+async def record_test_result(user_id: int, subject_scores: dict) -> None:
+    """Сохраняет результаты пройденного теста по предметам"""
+    await get_statistics_store().record_test(user_id, subject_scores)
+    logger.info(f"Результаты теста пользователя {user_id}: {subject_scores}")
+
+
+async def get_user_report(user_id: int):
+    """Статистика пользователя для /stats или None, если тестов еще не было"""
+    return await get_statistics_store().get(user_id)
 
 async def is_premium_user(user_id: int):
     """Асинхронная функция для проверки, является ли пользователь премиум-пользователем"""
-    stats = await get_user_statistics()
-    return stats.get(user_id, {}).get("is_premium", False)
+    user = await get_statistics_store().get(user_id)
+    return user.is_premium if user else False
 
 async def can_generate_questions(user_id: int) -> bool:
-    """Проверяет, может ли пользователь генерировать вопросы (с учетом лимитов)"""
+    """Проверяет, может ли пользователь генерировать вопросы (с учетом лимитов), ничего не списывая"""
+    if await is_premium_user(user_id):
+        return True
+    return generation_limiter.can_acquire(user_id)
+
+async def try_consume_generation(user_id: int) -> bool:
+    """Атомарно проверяет лимит и списывает одну генерацию. Возвращает False, если лимит исчерпан."""
     if await is_premium_user(user_id):
         return True
-    stats = await get_user_statistics()
-    user_data = stats.get(user_id, {})
-    last_generations = user_data.get("last_generations", [])
-    now = datetime.now()
-    within_window = [gen_time for gen_time in last_generations if now - gen_time < GENERATE_WINDOW]
-    return len(within_window) < FREE_GENERATE_LIMIT
+    allowed = generation_limiter.try_acquire(user_id)
+    logger.info(f"Генерация пользователя {user_id}: {'разрешена' if allowed else 'лимит исчерпан'}, "
+                f"осталось {generation_limiter.remaining(user_id)}")
+    return allowed
+
+async def refund_generation(user_id: int) -> None:
+    """Возвращает списанную генерацию, если вопросы сгенерировать не удалось"""
+    if await is_premium_user(user_id):
+        return
+    generation_limiter.refund(user_id)
+    logger.info(f"Генерация пользователя {user_id} возвращена, осталось {generation_limiter.remaining(user_id)}")
 
 async def increment_generation_counter(user_id: int) -> None:
-    """Увеличивает счетчик генераций вопросов для пользователя"""
+    """Увеличивает счетчик генераций вопросов для пользователя (без проверки лимита)"""
     if await is_premium_user(user_id):
         return
-    stats = await get_user_statistics()
-    user_data = stats.get(user_id, {})
-    last_generations = user_data.get("last_generations", [])
-    last_generations.append(datetime.now())
-    # Оставляем только генерации за последний день
-    now = datetime.now()
-    updated_generations = [gen_time for gen_time in last_generations if now - gen_time < GENERATE_WINDOW]
-    user_data["last_generations"] = updated_generations
-    stats[user_id] = user_data
-    logger.info(f"Счетчик генераций пользователя {user_id} обновлен: {updated_generations}")
+    generation_limiter.consume(user_id)
+    logger.info(f"Счетчик генераций пользователя {user_id} обновлен, осталось {generation_limiter.remaining(user_id)}")
 
 async def update_premium_status(user_id: int, is_premium: bool) -> None:
     """Обновляет статус премиум-пользователя"""
-    stats = await get_user_statistics()
-    user_data = stats.get(user_id, {})
-    user_data["is_premium"] = is_premium
-    stats[user_id] = user_data
+    await get_statistics_store().set_premium(user_id, is_premium)
     logger.info(f"Статус Premium пользователя {user_id} обновлен: {is_premium}")
 
 async def reset_daily_generation_counter(user_id: int) -> None:
     """Сбрасывает счетчик ежедневных генераций пользователя"""
-    stats = await get_user_statistics()
-    user_data = stats.get(user_id, {})
-    user_data["last_generations"] = []
-    stats[user_id] = user_data
+    generation_limiter.reset(user_id)
     logger.info(f"Счетчик генераций пользователя {user_id} сброшен.")
 
 async def clear_user_statistics(user_id: int) -> None:
     """Удаляет статистику пользователя"""
-    stats = await get_user_statistics()
-    if user_id in stats:
-        del stats[user_id]
-        logger.info(f"Статистика пользователя {user_id} удалена.")
+    generation_limiter.reset(user_id)
+    await get_statistics_store().delete(user_id)
+    logger.info(f"Статистика пользователя {user_id} удалена.")
 
 # Пример использования (необязательно включать в финальную версию, если вы не тестируете здесь)
 # async def main():
@@ -73,7 +295,7 @@ async def clear_user_statistics(user_id: int) -> None:
 #     for _ in range(5):
 #         if await can_generate_questions(user_id):
 #             await increment_generation_counter(user_id)
-#             print(f"Генерация. Осталось: {FREE_GENERATE_LIMIT - len(user_statistics.get(user_id, {}).get('last_generations', []))}")
+#             print(f"Генерация. Осталось: {generation_limiter.remaining(user_id)}")
 #         else:
 #             print("Лимит генераций исчерпан.")
 #             break
@@ -0,0 +1,190 @@
+# utils/telegram_sender.py
+import asyncio
+import logging
+import time
+from collections import deque
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Предел длины текста одного сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: reserve() сразу списывает токен и возвращает, сколько ждать"""
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def reserve(self) -> float:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        # Токены могут уйти в минус: следующий получит время ожидания с учетом уже занятых
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_full(self, now: float) -> bool:
+        """Восстановилась ли корзина полностью: тогда она ничем не отличается от новой"""
+        return self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ("make_request", "bot", "method", "future", "enqueued_at")
+
+    def __init__(self, make_request, bot, method):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+def _can_merge(first, second) -> bool:
+    """Можно ли дописать текст second в конец first одним сообщением"""
+    if not isinstance(first, SendMessage) or not isinstance(second, SendMessage):
+        return False
+    if first.reply_markup is not None:
+        # Клавиатура относится к конкретному сообщению, после нее текст не дописываем
+        return False
+    return (first.model_dump(exclude={"text", "reply_markup"})
+            == second.model_dump(exclude={"text", "reply_markup"}))
+
+
+class OutboundSender(BaseRequestMiddleware):
+    """Очередь исходящих сообщений поверх сессии Bot: через нее проходят все message.answer и bot.send_message.
+
+    Запросы с chat_id (отправка и редактирование сообщений) выстраиваются в очередь своего чата и
+    уходят по порядку, не чаще лимитов Telegram: корзина токенов на каждый чат и одна общая.
+    Подряд идущие текстовые сообщения одному чату, накопившиеся в очереди, склеиваются в одно.
+    Ответ 429 (retry_after) не роняет обработчик: запрос повторяется после указанной паузы.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1.0, chat_burst: int = 3, max_retries: int = 3,
+                 coalesce: bool = True):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+        self._chat_buckets = {}
+        # Корзины чатов без очереди проверяются не чаще, чем за время полного восстановления корзины
+        self.sweep_interval = chat_burst / chat_rate
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        self._queues = {}
+        self._tasks = set()
+        self.stats = {"sent": 0, "coalesced": 0, "retry_after": 0, "queue_delay_total": 0.0}
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await self._request(make_request, bot, method)
+        outgoing = _Outgoing(make_request, bot, method)
+        if outgoing.enqueued_at >= self._next_sweep:
+            self._sweep(outgoing.enqueued_at)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            task = asyncio.create_task(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(outgoing)
+        return await outgoing.future
+
+    async def _request(self, make_request, bot, method):
+        """Запрос к Bot API с повтором после retry_after"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.stats["retry_after"] += 1
+                metrics.TELEGRAM_RETRY_AFTER.inc()
+                logger.warning(f"Telegram просит подождать {e.retry_after} c перед {type(method).__name__}")
+                await asyncio.sleep(e.retry_after)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _sweep(self, now: float) -> None:
+        """Удаляет восстановившиеся корзины чатов без очереди: после них остались бы только разовые чаты"""
+        self._next_sweep = now + self.sweep_interval
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if chat_id not in self._queues and bucket.is_full(now)]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    async def _drain(self, chat_id, queue: deque) -> None:
+        try:
+            while queue:
+                delay = self._chat_bucket(chat_id).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                batch = [queue.popleft()]
+                length = len(getattr(batch[0].method, "text", None) or "")
+                # Пока ждали лимит чата, в очереди могли накопиться следующие сообщения
+                while self.coalesce and queue and _can_merge(batch[-1].method, queue[0].method) \
+                        and length + 2 + len(queue[0].method.text) <= MAX_MESSAGE_LENGTH:
+                    length += 2 + len(queue[0].method.text)
+                    batch.append(queue.popleft())
+                await self._send(batch)
+        finally:
+            # Корзина чата остается: сообщения обработчика обычно уходят по одному, и без нее следующее
+            # получило бы новую полную корзину. Восстановившиеся корзины удаляет _sweep
+            del self._queues[chat_id]
+            for item in queue:
+                if not item.future.done():
+                    item.future.cancel()
+
+    async def _send(self, batch: list) -> None:
+        head = batch[0]
+        method = head.method
+        if len(batch) > 1:
+            method = method.model_copy(update={
+                "text": "\n\n".join(item.method.text for item in batch),
+                "reply_markup": batch[-1].method.reply_markup,
+            })
+            self.stats["coalesced"] += len(batch) - 1
+            metrics.TELEGRAM_COALESCED.inc(len(batch) - 1)
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        for item in batch:
+            self.stats["queue_delay_total"] += now - item.enqueued_at
+            metrics.TELEGRAM_QUEUE_DELAY.observe(now - item.enqueued_at)
+        try:
+            result = await self._request(head.make_request, head.bot, method)
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        self.stats["sent"] += 1
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def get_stats(self) -> dict:
+        queued = self.stats["sent"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "waiting": self.waiting(),
+            "chat_buckets": len(self._chat_buckets),
+            "queue_delay_avg": self.stats["queue_delay_total"] / queued if queued else 0.0,
+        }
@@ -0,0 +1,102 @@
+# utils/update_pipeline.py
+import asyncio
+import logging
+from collections import deque
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+def _chat_key(update: Update):
+    """Ключ упорядочивания: id чата (или пользователя), к которому относится обновление"""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    # Обновления без чата и пользователя упорядочивать не с чем
+    return ("update", update.update_id)
+
+
+class UpdatePipeline:
+    """Асинхронная обработка входящих обновлений с ограничением параллелизма.
+
+    Обновления одного чата обрабатываются строго по порядку поступления, обновления разных чатов -
+    параллельно, но не больше concurrency одновременно. Если в очереди уже max_pending обновлений,
+    submit отказывает: вебхук отвечает Telegram ошибкой, и тот доставит обновление повторно.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int = 100, max_pending: int = 10000):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.max_pending = max_pending
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._tasks = set()
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "errors": 0}
+
+    def submit(self, update: Update) -> bool:
+        """Ставит обновление в очередь его чата. Возвращает False, если очередь переполнена."""
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            return False
+        self._enqueue(update)
+        return True
+
+    def submit_many(self, updates: list) -> bool:
+        """Ставит пачку обновлений целиком или, если она не помещается в очередь, не ставит ничего"""
+        if self.pending + len(updates) > self.max_pending:
+            self.stats["rejected"] += len(updates)
+            return False
+        for update in updates:
+            self._enqueue(update)
+        return True
+
+    def _enqueue(self, update: Update) -> None:
+        self.pending += 1
+        self.stats["accepted"] += 1
+        key = _chat_key(update)
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return
+        queue = self._queues[key] = deque([update])
+        task = asyncio.create_task(self._drain(key, queue))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key, queue: deque) -> None:
+        try:
+            while queue:
+                update = queue[0]
+                async with self._semaphore:
+                    try:
+                        await self.dispatcher.feed_update(self.bot, update)
+                        self.stats["processed"] += 1
+                    except Exception as e:
+                        self.stats["errors"] += 1
+                        logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+                queue.popleft()
+                self.pending -= 1
+        finally:
+            del self._queues[key]
+            # При отмене оставшиеся обновления чата уже не будут обработаны
+            self.pending -= len(queue)
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """Дожидается обработки уже принятых обновлений, затем отменяет оставшиеся"""
+        if not self._tasks:
+            return
+        done, not_done = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.warning(f"Не дождались обработки обновлений в {len(not_done)} чатах")
+            await asyncio.gather(*not_done, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": self.pending, "active_chats": len(self._queues)}
@@ -0,0 +1,86 @@
+# utils/webhook.py
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from utils.update_pipeline import UpdatePipeline
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(pipeline: UpdatePipeline, path: str, secret_token: str = None) -> web.Application:
+    """aiohttp-приложение вебхука: принимает обновление, ставит его в очередь и сразу отвечает Telegram.
+
+    Кроме одного обновления принимает и список обновлений: так их пересылает воркерам supervisor.py.
+    Обновления проверяются по одному: некорректное пропускается с записью в лог, а не отклоняет
+    всю пачку вместе с корректными.
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError as e:
+            logger.warning(f"Некорректный запрос вебхука: {e}")
+            return web.Response(status=400)
+        updates = []
+        for raw in (payload if isinstance(payload, list) else [payload]):
+            try:
+                updates.append(Update.model_validate(raw, context={"bot": pipeline.bot}))
+            except ValueError as e:
+                # Повтор доставки его не исправит, а остальные обновления пачки терять нельзя
+                update_id = raw.get("update_id") if isinstance(raw, dict) else None
+                logger.warning(f"Пропущено некорректное обновление {update_id}: {e}")
+        if not pipeline.submit_many(updates):
+            # Не теряем обновление: Telegram повторит доставку, когда очередь разгрузится
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, base_url: str, path: str, host: str, port: int,
+                      secret_token: str = None, concurrency: int = 100, max_pending: int = 10000,
+                      stop_event: asyncio.Event = None) -> None:
+    """Запускает бота в режиме вебхука и работает до SIGINT/SIGTERM (или до stop_event).
+
+    В отличие от start_polling(skip_updates=True), накопившиеся за время перезапуска обновления
+    не сбрасываются: Telegram доставит их на вебхук после старта.
+    """
+    pipeline = UpdatePipeline(dispatcher, bot, concurrency=concurrency, max_pending=max_pending)
+    runner = web.AppRunner(create_webhook_app(pipeline, path, secret_token))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    workflow_data = {"dispatcher": dispatcher, "bots": [bot], **dispatcher.workflow_data}
+    await dispatcher.emit_startup(bot=bot, **workflow_data)
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop_event.set)
+    try:
+        if base_url:
+            await bot.set_webhook(
+                f"{base_url.rstrip('/')}{path}",
+                secret_token=secret_token or None,
+                allowed_updates=dispatcher.resolve_used_update_types(),
+                drop_pending_updates=False,
+            )
+        logger.info(f"Вебхук слушает {host}:{port}{path}")
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать обновления, потом дорабатываем принятые
+        await runner.cleanup()
+        await pipeline.close()
+        logger.info(f"Вебхук остановлен: {pipeline.get_stats()}")
+        await dispatcher.emit_shutdown(bot=bot, **workflow_data)